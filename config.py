@@ -134,3 +134,9 @@ def defPaths(customSavePath):
     # saveddata db location modifier, shouldn't ever need to touch this
     eos.config.saveddata_connectionstring = "sqlite:///" + saveDB + "?check_same_thread=False"
     eos.config.gamedata_connectionstring = "sqlite:///" + gameDB + "?check_same_thread=False"
+    # memory-mapped gamedata snapshot, exported from gameDB by scripts/gamedataSnapshot.py
+    eos.config.gamedata_snapshot = os.path.join(pyfaPath, "eve.snap")
+    # item name search index, kept next to gameDB and rebuilt whenever it changes
+    eos.config.gamedata_search_index = os.path.join(pyfaPath, "eve.search")
+    # market groups and variations with pyfa's overrides applied, rebuilt likewise
+    eos.config.gamedata_market_index = os.path.join(pyfaPath, "eve.market")
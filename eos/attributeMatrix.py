@@ -0,0 +1,106 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+"""
+Dense items x attributes table of base attribute values.
+
+Values are kept in a single flat array of doubles, row by row, with
+index maps from typeID to row and attributeID to column. Attributes an
+item doesn't have are stored as NaN. Matrices are built by
+eos.db.getAttributeMatrix().
+"""
+
+import array
+
+NAN = float("nan")
+
+
+def _missing(value):
+    # NaN is the only value not equal to itself
+    return value != value
+
+
+class AttributeMatrix(object):
+    def __init__(self, itemIDs, attrIDs, values=None):
+        # Row and column order, and their reverse maps
+        self.itemIDs = list(itemIDs)
+        self.attrIDs = list(attrIDs)
+        self.rowIndex = dict((itemID, i) for i, itemID in enumerate(self.itemIDs))
+        self.colIndex = dict((attrID, i) for i, attrID in enumerate(self.attrIDs))
+        if values is None:
+            values = array.array("d", [NAN]) * (len(self.itemIDs) * len(self.attrIDs))
+        self.values = values
+
+    @classmethod
+    def fromRows(cls, rows, itemIDs, attrIDs=None):
+        """
+        Build matrix from (typeID, attributeID, value) rows. If attrIDs is
+        None, columns are all attributes found in rows, by ID.
+        """
+        if attrIDs is None:
+            rows = list(rows)
+            attrIDs = sorted(set(row[1] for row in rows))
+        matrix = cls(itemIDs, attrIDs)
+        rowIndex = matrix.rowIndex
+        colIndex = matrix.colIndex
+        width = len(matrix.attrIDs)
+        values = matrix.values
+        for typeID, attrID, value in rows:
+            row = rowIndex.get(typeID)
+            col = colIndex.get(attrID)
+            if row is not None and col is not None and value is not None:
+                values[row * width + col] = value
+        return matrix
+
+    @property
+    def shape(self):
+        return len(self.itemIDs), len(self.attrIDs)
+
+    def get(self, itemID, attrID, default=None):
+        row = self.rowIndex.get(itemID)
+        col = self.colIndex.get(attrID)
+        if row is None or col is None:
+            return default
+        value = self.values[row * len(self.attrIDs) + col]
+        return default if _missing(value) else value
+
+    def row(self, itemID):
+        """Values of all columns for an item, NaN where missing"""
+        width = len(self.attrIDs)
+        start = self.rowIndex[itemID] * width
+        return self.values[start:start + width]
+
+    def column(self, attrID):
+        """Values of an attribute for all rows, NaN where missing"""
+        return self.values[self.colIndex[attrID]::len(self.attrIDs)]
+
+    def varying(self):
+        """
+        IDs of attributes which differ between items: either their values
+        aren't all the same, or only some of the items have them.
+        """
+        result = []
+        for attrID in self.attrIDs:
+            present = [value for value in self.column(attrID) if not _missing(value)]
+            if not present:
+                continue
+            first = present[0]
+            if len(present) < len(self.itemIDs) or any(value != first for value in present):
+                result.append(attrID)
+        return result
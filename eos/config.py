@@ -4,8 +4,28 @@ import sys
 debug = False
 gamedataCache = True
 saveddataCache = True
+# Bounds of each cached query: max amount of entries and of objects referenced by them
+gamedataCacheEntries = 5000
+gamedataCacheWeight = 50000
+saveddataCacheEntries = 1000
+saveddataCacheWeight = 20000
 gamedata_connectionstring = 'sqlite:///' + unicode(realpath(join(dirname(abspath(__file__)), "..", "eve.db")), sys.getfilesystemencoding())
 saveddata_connectionstring = 'sqlite:///' + unicode(realpath(join(dirname(abspath(__file__)), "..", "saveddata", "saveddata.db")), sys.getfilesystemencoding())
+# saveddata write tuning: sqlite journal and sync modes, and for how long (seconds)
+# commits may be held back to batch several changes into one transaction
+saveddata_journal_mode = "WAL"
+saveddata_synchronous = "NORMAL"
+saveddataCommitDelay = 0.5
+saveddataCommitMaxDelay = 2.0
+# Memory-mapped gamedata snapshot built by scripts/gamedataSnapshot.py, ignored if missing or stale
+gamedata_snapshot = unicode(realpath(join(dirname(abspath(__file__)), "..", "eve.snap")), sys.getfilesystemencoding())
+# Have getItem, getGroup, getCategory and getAttributeInfo return read-only snapshot views
+# instead of ORM objects; views can't be fitted, so only for tools which just read gamedata
+gamedata_snapshot_views = False
+# Item name search index, built from gamedata on first search and rebuilt when client build changes
+gamedata_search_index = unicode(realpath(join(dirname(abspath(__file__)), "..", "eve.search")), sys.getfilesystemencoding())
+# Market groups, variations and publicity with pyfa's overrides applied, rebuilt when gamedata or overrides change
+gamedata_market_index = unicode(realpath(join(dirname(abspath(__file__)), "..", "eve.market")), sys.getfilesystemencoding())
 
 #Autodetect path, only change if the autodetection bugs out.
 path = dirname(unicode(__file__, sys.getfilesystemencoding()))
@@ -19,12 +19,14 @@
 
 import threading
 
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData, create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import pool
 
 from eos import config
+from eos import snapshot
+from eos.db.sessions import currentScope, ScopedLock
 import migration
 
 class ReadOnlyException(Exception):
@@ -49,6 +51,9 @@ try:
 except:
     config.gamedata_version = None
 
+# Compact read-only view of the same gamedata, only used if it was exported from this client build
+gamedata_snapshot = snapshot.load(getattr(config, "gamedata_snapshot", None), config.gamedata_version)
+
 saveddata_connectionstring = config.saveddata_connectionstring
 if saveddata_connectionstring is not None:
     if callable(saveddata_connectionstring):
@@ -56,12 +61,25 @@ if saveddata_connectionstring is not None:
     else:
         saveddata_engine = create_engine(saveddata_connectionstring, echo=config.debug)
 
+    def tuneSaveddataConnection(dbapiConnection, connectionRecord):
+        # Write-ahead log needs fewer fsyncs than rollback journal, and with it
+        # NORMAL sync level is still safe against corruption
+        cursor = dbapiConnection.cursor()
+        cursor.execute("PRAGMA journal_mode = %s" % getattr(config, "saveddata_journal_mode", "DELETE"))
+        cursor.execute("PRAGMA synchronous = %s" % getattr(config, "saveddata_synchronous", "FULL"))
+        cursor.close()
+
+    if saveddata_engine.dialect.name == "sqlite":
+        event.listen(saveddata_engine, "connect", tuneSaveddataConnection)
+
     saveddata_meta = MetaData()
     saveddata_meta.bind = saveddata_engine
-    saveddata_session = sessionmaker(bind=saveddata_engine, autoflush=False, expire_on_commit=False)()
+    saveddata_sessionmaker = sessionmaker(bind=saveddata_engine, autoflush=False, expire_on_commit=False)
+    # Shared session, unless calling thread took one of its own, see eos.db.sessions
+    saveddata_session = scoped_session(saveddata_sessionmaker, scopefunc=currentScope)
 
-# Lock controlling any changes introduced to session
-sd_lock = threading.Lock()
+# Lock controlling any changes introduced to session (of calling thread)
+sd_lock = ScopedLock()
 
 #Import all the definitions for all our database stuff
 from eos.db.gamedata import *
@@ -70,12 +88,19 @@ from eos.db.saveddata import *
 #Import queries
 from eos.db.gamedata.queries import *
 from eos.db.saveddata.queries import *
+from eos.db.cache import getCacheStats, clearCaches
+from eos.db.sessions import threadSession, snapshotSession, handoff, isThreadSession, isReadOnlySession
 
 #If using in memory saveddata, you'll want to reflect it so the data structure is good.
 if config.saveddata_connectionstring == "sqlite:///:memory:":
     saveddata_meta.create_all()
 
 def rollback():
+    if not isThreadSession() and commitPending():
+        # Changes flushed by commit() were reported as committed and only
+        # wait for deferred commit, so discard just what came after them
+        discardUnflushed()
+        return
     with sd_lock:
         saveddata_session.rollback()
 
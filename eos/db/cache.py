@@ -0,0 +1,149 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from utils.compat import OrderedDict
+
+# All caches created so far, by name
+caches = {}
+
+# Marker for cache misses, as None is a valid cached result
+MISSING = object()
+
+
+def weigh(value):
+    """Rough size of a cached value: number of objects it keeps alive"""
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return max(len(value), 1)
+    return 1
+
+
+class QueryCache(object):
+    """
+    Bounded LRU cache for query results.
+
+    Entries are evicted least recently used first once either maxEntries
+    entries or maxWeight total weight (see weigh()) is exceeded. Entries can
+    be tagged, e.g. with IDs of the entities they hold, which allows dropping
+    every entry referring to an entity without scanning the whole cache.
+    """
+
+    def __init__(self, name, maxEntries=None, maxWeight=None):
+        self.name = name
+        self.maxEntries = maxEntries
+        self.maxWeight = maxWeight
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.weight = 0
+        self.__entries = OrderedDict()
+        self.__tags = {}
+        self.__lock = threading.RLock()
+        caches[name] = self
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=MISSING):
+        with self.__lock:
+            entry = self.__entries.pop(key, MISSING)
+            if entry is MISSING:
+                self.misses += 1
+                return default
+            # Re-insert to mark entry as most recently used
+            self.__entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=(), weight=None):
+        with self.__lock:
+            self.__discard(key)
+            tags = frozenset(tags)
+            if weight is None:
+                weight = weigh(value)
+            self.__entries[key] = (value, weight, tags)
+            self.weight += weight
+            for tag in tags:
+                self.__tags.setdefault(tag, set()).add(key)
+            self.__shrink()
+
+    def pop(self, key):
+        with self.__lock:
+            return self.__discard(key)
+
+    def invalidate(self, tag):
+        """Drop all entries tagged with tag, returns amount of dropped entries"""
+        with self.__lock:
+            keys = self.__tags.pop(tag, ())
+            for key in list(keys):
+                self.__discard(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.__lock:
+            self.invalidations += len(self.__entries)
+            self.__entries.clear()
+            self.__tags.clear()
+            self.weight = 0
+
+    def stats(self):
+        with self.__lock:
+            return {"entries": len(self.__entries),
+                    "weight": self.weight,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations}
+
+    def __discard(self, key):
+        entry = self.__entries.pop(key, MISSING)
+        if entry is MISSING:
+            return None
+        value, weight, tags = entry
+        self.weight -= weight
+        for tag in tags:
+            keys = self.__tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.__tags[tag]
+        return value
+
+    def __shrink(self):
+        while self.__entries and ((self.maxEntries is not None and len(self.__entries) > self.maxEntries) or
+                                  (self.maxWeight is not None and self.weight > self.maxWeight)):
+            key = next(iter(self.__entries))
+            self.__discard(key)
+            self.evictions += 1
+
+
+def getCacheStats():
+    """Return hit/miss/eviction counters of all query caches, keyed by cache name"""
+    return dict((name, cache.stats()) for name, cache in caches.iteritems())
+
+
+def clearCaches():
+    for cache in caches.itervalues():
+        cache.clear()
@@ -18,33 +18,46 @@
 # along with eos.  If not, see <http://www.gnu.org/licenses/>.
 #===============================================================================
 
-from eos.db import gamedata_session
+from eos.db import gamedata_session, gamedata_snapshot
 from eos.db.gamedata.metaGroup import metatypes_table, items_table
+from eos.db.gamedata.attribute import typeattributes_table
 from sqlalchemy.sql import and_, or_, select, func
 from sqlalchemy.orm import join, exc
 from eos.types import Item, Category, Group, MarketGroup, AttributeInfo, MetaData, MetaGroup
 from eos.db.util import processEager, processWhere
+from eos.db.cache import QueryCache, MISSING
+from eos import searchIndex, marketIndex
+from eos.attributeMatrix import AttributeMatrix
 import eos.config
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 configVal = getattr(eos.config, "gamedataCache", None)
 if configVal is True:
     def cachedQuery(amount, *keywords):
         def deco(function):
-            cache = {}
+            cache = QueryCache("gamedata.%s" % function.__name__,
+                               getattr(eos.config, "gamedataCacheEntries", None),
+                               getattr(eos.config, "gamedataCacheWeight", None))
             def checkAndReturn(*args, **kwargs):
                 useCache = kwargs.pop("useCache", True)
                 cacheKey = []
-                cacheKey.extend(args)
+                # Only first amount positional arguments identify query
+                cacheKey.extend(args[:amount])
                 for keyword in keywords:
                     cacheKey.append(kwargs.get(keyword))
 
                 cacheKey = tuple(cacheKey)
-                handler = cache.get(cacheKey)
-                if handler is None or not useCache:
-                    handler = cache[cacheKey] = function(*args, **kwargs)
+                handler = cache.get(cacheKey) if useCache else MISSING
+                if handler is MISSING:
+                    handler = function(*args, **kwargs)
+                    cache.set(cacheKey, handler)
 
                 return handler
 
+            checkAndReturn.cache = cache
             return checkAndReturn
         return deco
 
@@ -66,9 +79,21 @@ def sqlizeString(line):
     line = line.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "%")
     return line
 
+def useSnapshotViews(eager=None):
+    """
+    Whether plain lookups get read-only views of gamedata snapshot rather
+    than ORM objects, see eos.snapshot. Eager loading needs ORM objects.
+    """
+    return (eager is None and gamedata_snapshot is not None and
+            getattr(eos.config, "gamedata_snapshot_views", False))
+
 itemNameMap = {}
 @cachedQuery(1, "lookfor")
 def getItem(lookfor, eager=None):
+    if useSnapshotViews(eager):
+        item = gamedata_snapshot.getItem(lookfor)
+        if item is not None:
+            return item
     if isinstance(lookfor, int):
         if eager is None:
             item = gamedata_session.query(Item).get(lookfor)
@@ -90,9 +115,38 @@ def getItem(lookfor, eager=None):
         raise TypeError("Need integer or string as argument")
     return item
 
+# Relations needed to calculate fits, loaded along with items by getItems
+FIT_EAGER = ("attributes", "effects", "group.category", "metaGroup")
+# Max amount of IDs passed to single IN clause, sqlite limits bound parameters to 999
+BATCH_SIZE = 500
+
+def getItems(itemIDs, eager=FIT_EAGER):
+    """
+    Load many items at once, in batches of BATCH_SIZE. Requested relations are
+    loaded in one extra query per relation and batch rather than per item.
+    Returns dictionary {typeID: item}; as long as caller keeps it, getItem()
+    calls for these IDs are answered from session without hitting database.
+    """
+    itemIDs = list(set(itemIDs))
+    for itemID in itemIDs:
+        if not isinstance(itemID, (int, long)):
+            raise TypeError("All passed item IDs must be integers")
+
+    items = {}
+    options = processEager(eager, subquery=True)
+    for i in xrange(0, len(itemIDs), BATCH_SIZE):
+        chunk = itemIDs[i:i + BATCH_SIZE]
+        for item in gamedata_session.query(Item).options(*options).filter(Item.ID.in_(chunk)).all():
+            items[item.ID] = item
+    return items
+
 groupNameMap = {}
 @cachedQuery(1, "lookfor")
 def getGroup(lookfor, eager=None):
+    if useSnapshotViews(eager):
+        group = gamedata_snapshot.getGroup(lookfor)
+        if group is not None:
+            return group
     if isinstance(lookfor, int):
         if eager is None:
             group = gamedata_session.query(Group).get(lookfor)
@@ -116,6 +170,10 @@ def getGroup(lookfor, eager=None):
 categoryNameMap = {}
 @cachedQuery(1, "lookfor")
 def getCategory(lookfor, eager=None):
+    if useSnapshotViews(eager):
+        category = gamedata_snapshot.getCategory(lookfor)
+        if category is not None:
+            return category
     if isinstance(lookfor, int):
         if eager is None:
             category = gamedata_session.query(Category).get(lookfor)
@@ -207,6 +265,81 @@ def searchItems(nameLike, where=None, join=None, eager=None):
     items = items.limit(100).all()
     return items
 
+_searchIndex = None
+_searchIndexLock = threading.Lock()
+def getSearchIndex():
+    """
+    Return name search index of current gamedata. It is loaded from disk, or
+    built and saved there if missing or made for another client build.
+    """
+    global _searchIndex
+    with _searchIndexLock:
+        if _searchIndex is None:
+            path = getattr(eos.config, "gamedata_search_index", None)
+            index = searchIndex.load(path, eos.config.gamedata_version)
+            if index is None:
+                rows = gamedata_session.execute(
+                    "SELECT it.typeID, it.typeName, ig.groupName, ic.categoryName FROM invtypes AS it "
+                    "LEFT JOIN invgroups AS ig ON ig.groupID = it.groupID "
+                    "LEFT JOIN invcategories AS ic ON ic.categoryID = ig.categoryID")
+                index = searchIndex.SearchIndex.build(rows, eos.config.gamedata_version)
+                if path is not None:
+                    try:
+                        index.save(path)
+                    except EnvironmentError, e:
+                        # Read-only install dir, index is rebuilt on next start
+                        logger.warning("Could not save search index to %s: %s", path, e)
+            _searchIndex = index
+        return _searchIndex
+
+_marketIndex = None
+_marketIndexLock = threading.Lock()
+def getMarketIndex(overrides):
+    """
+    Return market index of current gamedata with given override tables
+    applied, see eos.marketIndex. It is loaded from disk, or built and saved
+    there if missing or made for another client build or other overrides.
+    """
+    global _marketIndex
+    version = eos.config.gamedata_version
+    buildKey = (unicode(version) if version is not None else None, marketIndex.overridesKey(overrides))
+    with _marketIndexLock:
+        if _marketIndex is None or _marketIndex.buildKey != buildKey:
+            path = getattr(eos.config, "gamedata_market_index", None)
+            index = marketIndex.load(path, buildKey)
+            if index is None:
+                items = gamedata_session.execute(
+                    "SELECT typeID, typeName, marketGroupID, published FROM invtypes")
+                metaTypes = gamedata_session.execute(
+                    "SELECT typeID, parentTypeID, metaGroupID FROM invmetatypes")
+                metaGroups = gamedata_session.execute(
+                    "SELECT metaGroupID, metaGroupName FROM invmetagroups")
+                index = marketIndex.MarketIndex.build(items, metaTypes, metaGroups, overrides, buildKey)
+                if path is not None:
+                    try:
+                        index.save(path)
+                    except EnvironmentError, e:
+                        # Read-only install dir, index is rebuilt on next start
+                        logger.warning("Could not save market index to %s: %s", path, e)
+            _marketIndex = index
+        return _marketIndex
+
+def searchIndexedItems(text, categories=None, groups=None, eager=None, limit=100):
+    """
+    Find items whose names match text using the search index, see
+    eos.searchIndex. Returns items ordered from best to worst match.
+    """
+    if not isinstance(text, basestring):
+        raise TypeError("Need string as argument")
+
+    typeIDs = getSearchIndex().search(text, categories=categories, groups=groups, limit=limit)
+    if not typeIDs:
+        return []
+    items = gamedata_session.query(Item).options(*processEager(eager)).filter(Item.ID.in_(typeIDs)).all()
+    order = dict((typeID, i) for i, typeID in enumerate(typeIDs))
+    items.sort(key=lambda item: order[item.ID])
+    return items
+
 @cachedQuery(2, "where", "itemids")
 def getVariations(itemids, where=None, eager=None):
     for itemid in itemids:
@@ -224,6 +357,10 @@ def getVariations(itemids, where=None, eager=None):
 
 @cachedQuery(1, "attr")
 def getAttributeInfo(attr, eager=None):
+    if useSnapshotViews(eager):
+        info = gamedata_snapshot.getAttributeInfo(attr)
+        if info is not None:
+            return info
     if isinstance(attr, basestring):
         filter = AttributeInfo.name == attr
     elif isinstance(attr, int):
@@ -259,3 +396,35 @@ def directAttributeRequest(itemIDs, attrIDs):
 
     result = gamedata_session.execute(q).fetchall()
     return result
+
+def getAttributeMatrix(itemIDs, attrIDs=None):
+    """
+    Return AttributeMatrix of base attribute values of given items, rows in
+    order of itemIDs. Columns are attrIDs if given, otherwise every attribute
+    any of the items has. Values come from the gamedata snapshot if there is
+    one, else from a single batched query over dgmtypeattribs.
+    """
+    itemIDs = list(itemIDs)
+    for itemID in itemIDs:
+        if not isinstance(itemID, (int, long)):
+            raise TypeError("All itemIDs must be integer")
+    if attrIDs is not None:
+        attrIDs = list(attrIDs)
+        for attrID in attrIDs:
+            if not isinstance(attrID, (int, long)):
+                raise TypeError("All attrIDs must be integer")
+
+    if gamedata_snapshot is not None:
+        rows = gamedata_snapshot.getAttributeRows(itemIDs, attrIDs)
+    else:
+        rows = []
+        uniqueIDs = list(set(itemIDs))
+        for i in xrange(0, len(uniqueIDs), BATCH_SIZE):
+            chunk = uniqueIDs[i:i + BATCH_SIZE]
+            where = typeattributes_table.c.typeID.in_(chunk)
+            if attrIDs is not None:
+                where = and_(where, typeattributes_table.c.attributeID.in_(attrIDs))
+            q = select((typeattributes_table.c.typeID, typeattributes_table.c.attributeID,
+                        typeattributes_table.c.value), where)
+            rows.extend(gamedata_session.execute(q).fetchall())
+    return AttributeMatrix.fromRows(rows, itemIDs, attrIDs)
@@ -1,5 +1,6 @@
 import config
 import shutil
+import sqlite3
 import time
 import re
 import os
@@ -15,7 +16,58 @@ def getVersion(db):
 def getAppVersion():
     return migrations.appVersion
 
-def update(saveddata_engine):
+def backup(saveddata_engine, toFile):
+    """
+    Take consistent copy of saveddata database while it's open, including
+    changes still sitting in WAL file.
+    """
+    raw = saveddata_engine.raw_connection()
+    try:
+        dbapiConnection = raw.connection
+        if hasattr(dbapiConnection, "backup"):
+            # Online backup API, sqlite3 module of Python 3.7+
+            target = sqlite3.connect(toFile)
+            try:
+                dbapiConnection.backup(target)
+            finally:
+                target.close()
+            return
+
+        cursor = dbapiConnection.cursor()
+        try:
+            # Same result as backup API, needs SQLite 3.27+
+            cursor.execute("VACUUM INTO ?", (toFile,))
+            return
+        except sqlite3.OperationalError:
+            pass
+
+        # Old SQLite: copy files while holding write lock, so nobody can
+        # change them under us. Pending WAL is copied along, it's replayed
+        # when the copy is opened.
+        isolation = dbapiConnection.isolation_level
+        dbapiConnection.isolation_level = None
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                shutil.copyfile(config.saveDB, toFile)
+                if os.path.isfile(config.saveDB + "-wal"):
+                    shutil.copyfile(config.saveDB + "-wal", toFile + "-wal")
+            finally:
+                cursor.execute("ROLLBACK")
+        finally:
+            dbapiConnection.isolation_level = isolation
+    finally:
+        raw.close()
+
+def update(saveddata_engine, callback=None):
+    """
+    Bring saveddata database up to current version. Database is backed up
+    first, then all pending upgrades are applied in a single transaction:
+    either all of them succeed, or database is left untouched.
+
+    callback, if given, is called with (done, total, description) before
+    each upgrade and once everything is committed.
+    """
     dbVersion = getVersion(saveddata_engine)
     appVersion = getAppVersion()
 
@@ -30,13 +82,40 @@ def update(saveddata_engine):
             appVersion,
             time.strftime("%Y%m%d_%H%M%S"))
 
-        shutil.copyfile(config.saveDB, toFile)
+        backup(saveddata_engine, toFile)
+
+        total = appVersion - dbVersion
+        connection = saveddata_engine.connect()
+        dbapiConnection = connection.connection.connection
+        # pysqlite commits on its own before any DDL statement, which would
+        # split upgrades into several transactions. Take over transaction
+        # control for the duration of migration.
+        isolation = dbapiConnection.isolation_level
+        dbapiConnection.isolation_level = None
+        try:
+            transaction = connection.begin()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for version in xrange(dbVersion, appVersion):
+                    func = migrations.updates[version+1]
+                    if callback is not None:
+                        callback(version - dbVersion, total, "Applying database update: %d" % (version+1))
+                    if func:
+                        logger.info("Applying database update: %d", version+1)
+                        started = time.time()
+                        func(connection)
+                        logger.debug("Database update %d took %.2fs", version+1, time.time() - started)
 
-        for version in xrange(dbVersion, appVersion):
-            func = migrations.updates[version+1]
-            if func:
-                logger.info("Applying database update: %d", version+1)
-                func(saveddata_engine)
+                # when all is said and done, set version to current
+                connection.execute("PRAGMA user_version = {}".format(appVersion))
+            except:
+                logger.exception("Database update failed, rolling back to version %d", dbVersion)
+                transaction.rollback()
+                raise
+            transaction.commit()
+        finally:
+            dbapiConnection.isolation_level = isolation
+            connection.close()
 
-        # when all is said and done, set version to current
-        saveddata_engine.execute("PRAGMA user_version = {}".format(appVersion))
+        if callback is not None:
+            callback(total, total, "Database updated to version %d" % appVersion)
@@ -0,0 +1,44 @@
+"""
+Helper for migrations replacing retired items with their replacements
+"""
+
+# Columns holding item IDs of fitted things
+MODULE_COLUMNS = (("modules", "itemID"), ("cargo", "itemID"))
+
+
+def convert(saveddata_engine, conversions, columns=MODULE_COLUMNS):
+    """
+    Apply {replacement: (retired, ...)} map to given (table, column) pairs.
+
+    The map goes into a temporary table, so each column is rewritten by a
+    single UPDATE (one table scan) instead of one UPDATE per retired item.
+    Chains within the map (A replaced by B, B by C) are followed through,
+    so A ends up as C. Each upgrade still makes its own pass, so items are
+    carried through conversions of later upgrades as before.
+    """
+    mapping = {}
+    for replacement_item, retired_items in conversions.iteritems():
+        for retired_item in retired_items:
+            if retired_item is not None and retired_item != replacement_item:
+                mapping[retired_item] = replacement_item
+
+    if not mapping:
+        return
+
+    for retired_item in mapping:
+        replacement_item = mapping[retired_item]
+        seen = set((retired_item,))
+        while replacement_item in mapping and replacement_item not in seen:
+            seen.add(replacement_item)
+            replacement_item = mapping[replacement_item]
+        mapping[retired_item] = replacement_item
+
+    saveddata_engine.execute('CREATE TEMP TABLE "itemConversion" ("retired" INTEGER PRIMARY KEY, "replacement" INTEGER)')
+    try:
+        saveddata_engine.execute('INSERT INTO "itemConversion" VALUES (?, ?)', *mapping.items())
+        for table, column in columns:
+            saveddata_engine.execute(
+                'UPDATE "{0}" SET "{1}" = (SELECT "replacement" FROM "itemConversion" WHERE "retired" = "{0}"."{1}") '
+                'WHERE "{1}" IN (SELECT "retired" FROM "itemConversion")'.format(table, column))
+    finally:
+        saveddata_engine.execute('DROP TABLE "itemConversion"')
@@ -12,6 +12,7 @@ Migration 1
 """
 
 import sqlalchemy
+from eos.db.migrations import itemConversion
 
 CONVERSIONS = {
     6135: [  # Scoped Cargo Scanner
@@ -90,8 +91,5 @@ def upgrade(saveddata_engine):
         saveddata_engine.execute("ALTER TABLE fits ADD COLUMN targetResistsID INTEGER;")
 
     # Convert modules
-    for replacement_item, list in CONVERSIONS.iteritems():
-        for retired_item in list:
-            saveddata_engine.execute('UPDATE "modules" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
-            saveddata_engine.execute('UPDATE "cargo" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
+    itemConversion.convert(saveddata_engine, CONVERSIONS)
 
@@ -7,6 +7,8 @@ Migration 11
     modules with their new replacements
 """
 
+from eos.db.migrations import itemConversion
+
 
 CONVERSIONS = {
     16467: (  # Medium Gremlin Compact Energy Neutralizer
@@ -109,8 +111,5 @@ CONVERSIONS = {
 def upgrade(saveddata_engine):
 
     # Convert modules
-    for replacement_item, list in CONVERSIONS.iteritems():
-        for retired_item in list:
-            saveddata_engine.execute('UPDATE "modules" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
-            saveddata_engine.execute('UPDATE "cargo" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
+    itemConversion.convert(saveddata_engine, CONVERSIONS)
 
@@ -10,6 +10,8 @@ Migration 4
     and output of itemDiff.py
 """
 
+from eos.db.migrations import itemConversion
+
 
 CONVERSIONS = {
     506: (  # 'Basic' Capacitor Power Relay
@@ -134,8 +136,5 @@ CONVERSIONS = {
 def upgrade(saveddata_engine):
 
     # Convert modules
-    for replacement_item, list in CONVERSIONS.iteritems():
-        for retired_item in list:
-            saveddata_engine.execute('UPDATE "modules" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
-            saveddata_engine.execute('UPDATE "cargo" SET "itemID" = ? WHERE "itemID" = ?', (replacement_item, retired_item))
+    itemConversion.convert(saveddata_engine, CONVERSIONS)
 
@@ -8,6 +8,8 @@ Migration 7
     Pyfa.
 """
 
+from eos.db.migrations import itemConversion
+
 
 CONVERSIONS = {
     640: (  # Scorpion
@@ -18,7 +20,5 @@ CONVERSIONS = {
 def upgrade(saveddata_engine):
 
     # Convert ships
-    for replacement_item, list in CONVERSIONS.iteritems():
-        for retired_item in list:
-            saveddata_engine.execute('UPDATE "fits" SET "shipID" = ? WHERE "shipID" = ?', (replacement_item, retired_item))
+    itemConversion.convert(saveddata_engine, CONVERSIONS, columns=(("fits", "shipID"),))
 
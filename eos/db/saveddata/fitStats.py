@@ -0,0 +1,37 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+from sqlalchemy import Table, Column, Integer, Float, String, Boolean, ForeignKey
+from eos.db import saveddata_meta
+
+# Summary stats of fits as of their last calculation, so fits can be sorted and
+# filtered without loading them. Rows are stamped with gamedata client build and
+# character skills they were calculated with, see eos.db.getStaleFitStatsIDs()
+fitStats_table = Table("fitStats", saveddata_meta,
+                       Column("fitID", ForeignKey("fits.ID"), primary_key = True),
+                       Column("gamedataVersion", String),
+                       Column("characterID", Integer),
+                       Column("skillsStamp", String),
+                       Column("dps", Float),
+                       Column("volley", Float),
+                       Column("ehp", Float),
+                       Column("capStable", Boolean),
+                       Column("capState", Float),
+                       Column("price", Float),
+                       Column("timestamp", Integer, nullable = False))
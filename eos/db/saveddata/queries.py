@@ -19,13 +19,35 @@
 
 from eos.db.util import processEager, processWhere
 from eos.db import saveddata_session, sd_lock
+from eos.db.sessions import isThreadSession, isReadOnlySession
+from eos.db.cache import QueryCache, MISSING
 
 from eos.types import *
 from eos.db.saveddata.fleet import squadmembers_table
-from eos.db.saveddata.fit import projectedFits_table
-from sqlalchemy.sql import and_
+from eos.db.saveddata.fit import fits_table, projectedFits_table
+from eos.db.saveddata.module import modules_table
+from eos.db.saveddata.drone import drones_table
+from eos.db.saveddata.fighter import fighters_table
+from eos.db.saveddata.cargo import cargo_table
+from eos.db.saveddata.booster import boosters_table
+from eos.db.saveddata.implant import implants_table, fitImplants_table, charImplants_table
+from eos.db.saveddata.character import characters_table
+from eos.db.saveddata.skill import skills_table
+from eos.db.saveddata.price import prices_table
+from eos.db.saveddata.fitStats import fitStats_table
+from eos.db.gamedata.queries import getItems, BATCH_SIZE
+from eos.db.saveddata.summary import fitSummaries, fitRevisions
+from sqlalchemy.sql import and_, select
+import atexit
+import hashlib
+import threading
+import time
+import logging
+from sqlalchemy.orm.util import identity_key
 import eos.config
 
+logger = logging.getLogger(__name__)
+
 configVal = getattr(eos.config, "saveddataCache", None)
 if configVal is True:
     import weakref
@@ -35,33 +57,40 @@ if configVal is True:
         itemCache[type] = localItemCache = weakref.WeakValueDictionary()
         queryCache[type] = typeQueryCache = {}
         def deco(function):
-            localQueryCache = typeQueryCache[function] = {}
+            localQueryCache = typeQueryCache[function] = QueryCache(
+                "saveddata.%s" % function.__name__,
+                getattr(eos.config, "saveddataCacheEntries", None),
+                getattr(eos.config, "saveddataCacheWeight", None))
             def setCache(cacheKey, args, kwargs):
                 items = function(*args, **kwargs)
-                IDs = set()
-                localQueryCache[cacheKey] = (isinstance(items, list), IDs)
+                IDs = []
                 stuff = items if isinstance(items, list) else (items,)
                 for item in stuff:
                     ID = getattr(item, "ID", None)
                     if ID is None:
                         #Some uncachable data, don't cache this query
-                        del localQueryCache[cacheKey]
-                        break
+                        localQueryCache.pop(cacheKey)
+                        return items
                     localItemCache[ID] = item
-                    IDs.add(ID)
+                    IDs.append(ID)
 
+                # Tag entry with IDs it refers to, so removeCachedEntry can find it
+                localQueryCache.set(cacheKey, (isinstance(items, list), tuple(IDs)), IDs, max(len(IDs), 1))
                 return items
 
             def checkAndReturn(*args, **kwargs):
                 useCache = kwargs.pop("useCache", True)
+                if isThreadSession():
+                    # Cache holds objects of shared session only
+                    return function(*args, **kwargs)
                 cacheKey = []
-                cacheKey.extend(args)
+                cacheKey.extend(args[:amount])
                 for keyword in keywords:
                     cacheKey.append(kwargs.get(keyword))
 
                 cacheKey = tuple(cacheKey)
-                info = localQueryCache.get(cacheKey)
-                if info is None or not useCache:
+                info = localQueryCache.get(cacheKey) if useCache else MISSING
+                if info is MISSING:
                     items = setCache(cacheKey, args, kwargs)
                 else:
                     l, IDs = info
@@ -82,25 +111,28 @@ if configVal is True:
                             break
 
                 return items
+
+            checkAndReturn.cache = localQueryCache
             return checkAndReturn
         return deco
 
-    def removeCachedEntry(type, ID):
+    def removeCachedEntry(type, ID=None):
+        """
+        Drop cached queries referring to entity of given type with given ID.
+        If no ID is passed, drop all cached queries for given type.
+        """
         if not type in queryCache:
             return
-        functionCache = queryCache[type]
-        for _, localCache in functionCache.iteritems():
-            toDelete = set()
-            for cacheKey, info in localCache.iteritems():
-                IDs = info[1]
-                if ID in IDs:
-                    toDelete.add(cacheKey)
-
-            for cacheKey in toDelete:
-                del localCache[cacheKey]
+        for localCache in queryCache[type].itervalues():
+            if ID is None:
+                localCache.clear()
+            else:
+                localCache.invalidate(ID)
 
-            if ID in itemCache[type]:
-                del itemCache[type][ID]
+        if ID is None:
+            itemCache[type].clear()
+        elif ID in itemCache[type]:
+            del itemCache[type][ID]
 
 elif callable(configVal):
     cachedQuery, removeCachedEntry = eos.config.gamedataCache
@@ -194,6 +226,30 @@ def getFit(lookfor, eager=None):
 
     return fit
 
+# Relations of fits needed to export them, loaded along with fits by getFits
+EXPORT_EAGER = ("modules", "drones", "fighters", "cargo", "implants", "boosters")
+
+def getFits(fitIDs, eager=EXPORT_EAGER):
+    """
+    Load many fits at once, in batches of BATCH_SIZE, with requested relations
+    loaded in one extra query per relation and batch. Returns {fitID: fit} of
+    valid fits; IDs which don't exist are left out.
+    """
+    fitIDs = list(set(fitIDs))
+    for fitID in fitIDs:
+        if not isinstance(fitID, int):
+            raise TypeError("All passed fit IDs must be integers")
+
+    fits = {}
+    options = processEager(eager, subquery=True)
+    for i in xrange(0, len(fitIDs), BATCH_SIZE):
+        chunk = fitIDs[i:i + BATCH_SIZE]
+        with sd_lock:
+            loaded = removeInvalid(saveddata_session.query(Fit).options(*options).filter(Fit.ID.in_(chunk)).all())
+        for fit in loaded:
+            fits[fit.ID] = fit
+    return fits
+
 @cachedQuery(Fleet, 1, "fleetID")
 def getFleet(fleetID, eager=None):
     if isinstance(fleetID, int):
@@ -301,6 +357,32 @@ def countFitsWithShip(shipID, ownerID=None, where=None, eager=None):
         raise TypeError("ShipID must be integer")
     return count
 
+def getFitSummaries(shipID=None, ownerID=None, booster=None):
+    """
+    Get FitSummary rows of fits matching all passed criteria, ordered by ID.
+    Answered from in-memory index, no fits are loaded.
+    """
+    if shipID is not None and not isinstance(shipID, int):
+        raise TypeError("ShipID must be integer")
+    if ownerID is not None and not isinstance(ownerID, int):
+        raise TypeError("OwnerID must be integer")
+    return fitSummaries.getFits(shipID=shipID, ownerID=ownerID, booster=booster)
+
+def countFitsWithShips(shipIDs):
+    """Count fits using any of given ships, without loading them"""
+    return fitSummaries.countFitsWithShips(shipIDs)
+
+def countFitsByShip(shipIDs):
+    """Map {shipID: number of fits} of given ships, without loading them"""
+    return fitSummaries.countFitsByShip(shipIDs)
+
+def getFitRevisions(fitIDs):
+    """
+    Map {fitID: revision} of given fits; revision changes whenever changes
+    to the fit are committed, see eos.db.saveddata.summary.FitRevisions
+    """
+    return dict((fitID, fitRevisions.get(fitID)) for fitID in fitIDs)
+
 def getFitList(eager=None):
     eager = processEager(eager)
     with sd_lock:
@@ -308,6 +390,66 @@ def getFitList(eager=None):
 
     return fits
 
+def isFitLoaded(fitID):
+    """Check if fit is already present in session, so getting it won't touch database"""
+    with sd_lock:
+        return identity_key(Fit, fitID) in saveddata_session.identity_map
+
+def getFitItemIDs(fitIDs, projected=True):
+    """
+    Collect typeIDs of everything used by given fits: ship, mode, modules and
+    their charges, drones, fighters, cargo, implants (including character ones)
+    and boosters. If projected is True, fits projected onto them are followed too.
+    Works on raw rows, no fit objects are constructed.
+    """
+    fitIDs = set(fitIDs)
+    for fitID in fitIDs:
+        if not isinstance(fitID, int):
+            raise TypeError("All passed fit IDs must be integers")
+
+    typeIDs = set()
+    seen = set()
+    pending = fitIDs
+    with sd_lock:
+        while pending:
+            seen.update(pending)
+            pending = list(pending)
+            projectedIDs = set()
+            for i in xrange(0, len(pending), BATCH_SIZE):
+                ids = tuple(pending[i:i + BATCH_SIZE])
+                queries = (
+                    select((fits_table.c.shipID, fits_table.c.modeID), fits_table.c.ID.in_(ids)),
+                    select((modules_table.c.itemID, modules_table.c.chargeID), modules_table.c.fitID.in_(ids)),
+                    select((drones_table.c.itemID,), drones_table.c.fitID.in_(ids)),
+                    select((fighters_table.c.itemID,), fighters_table.c.fitID.in_(ids)),
+                    select((cargo_table.c.itemID,), cargo_table.c.fitID.in_(ids)),
+                    select((boosters_table.c.itemID,), boosters_table.c.fitID.in_(ids)),
+                    select((implants_table.c.itemID,), and_(fitImplants_table.c.fitID.in_(ids),
+                                                            fitImplants_table.c.implantID == implants_table.c.ID)),
+                    select((implants_table.c.itemID,), and_(fits_table.c.ID.in_(ids),
+                                                            charImplants_table.c.charID == fits_table.c.characterID,
+                                                            charImplants_table.c.implantID == implants_table.c.ID)))
+                for query in queries:
+                    for row in saveddata_session.execute(query):
+                        typeIDs.update(row)
+
+                if projected:
+                    query = select((projectedFits_table.c.sourceID,), projectedFits_table.c.victimID.in_(ids))
+                    projectedIDs.update(row[0] for row in saveddata_session.execute(query))
+
+            pending = projectedIDs - seen
+
+    typeIDs.discard(None)
+    return typeIDs
+
+def prefetchFitItems(fitIDs, projected=True):
+    """
+    Load gamedata for all items used by given fits in a few batched queries,
+    see getFitItemIDs and getItems. Returned dictionary {typeID: item} must be
+    kept alive until fits are loaded, otherwise loaded items may be discarded.
+    """
+    return getItems(getFitItemIDs(fitIDs, projected))
+
 def getFleetList(eager=None):
     eager = processEager(eager)
     with sd_lock:
@@ -323,12 +465,166 @@ def getPrice(typeID):
         raise TypeError("Need integer as argument")
     return price
 
+def getPrices(typeIDs):
+    """
+    Load stored prices of many types at once, in batches of BATCH_SIZE.
+    Returns {typeID: price}; types without stored price are left out.
+    """
+    typeIDs = list(set(typeIDs))
+    for typeID in typeIDs:
+        if not isinstance(typeID, (int, long)):
+            raise TypeError("All passed type IDs must be integers")
+
+    prices = {}
+    with sd_lock:
+        for i in xrange(0, len(typeIDs), BATCH_SIZE):
+            chunk = typeIDs[i:i + BATCH_SIZE]
+            for price in saveddata_session.query(Price).filter(Price.typeID.in_(chunk)).all():
+                prices[price.typeID] = price
+    return prices
+
 def clearPrices():
     with sd_lock:
         deleted_rows = saveddata_session.query(Price).delete()
     commit()
     return deleted_rows
 
+def getPriceValues(typeIDs):
+    """Map {typeID: price} of stored prices of given types, without loading Price objects"""
+    typeIDs = list(set(typeIDs))
+    prices = {}
+    with sd_lock:
+        for i in xrange(0, len(typeIDs), BATCH_SIZE):
+            query = select([prices_table.c.typeID, prices_table.c.price]).where(
+                prices_table.c.typeID.in_(typeIDs[i:i + BATCH_SIZE]))
+            prices.update(saveddata_session.execute(query).fetchall())
+    return prices
+
+def getSkillsStamps(characterIDs=None):
+    """
+    Map {characterID: stamp} of saved skill levels of characters (all of them
+    if no IDs are given). Stamp changes whenever any saved skill level does.
+    """
+    charQuery = select([characters_table.c.ID, characters_table.c.defaultLevel])
+    skillQuery = select([skills_table.c.characterID, skills_table.c.itemID, skills_table.c._Skill__level])
+    if characterIDs is not None:
+        characterIDs = list(characterIDs)
+        if not characterIDs:
+            return {}
+        charQuery = charQuery.where(characters_table.c.ID.in_(characterIDs))
+        skillQuery = skillQuery.where(skills_table.c.characterID.in_(characterIDs))
+    with sd_lock:
+        chars = saveddata_session.execute(charQuery).fetchall()
+        skills = saveddata_session.execute(skillQuery.order_by(skills_table.c.characterID,
+                                                               skills_table.c.itemID)).fetchall()
+    hashes = dict((charID, hashlib.md5(repr(defaultLevel))) for charID, defaultLevel in chars)
+    for charID, itemID, level in skills:
+        if charID in hashes:
+            hashes[charID].update("%d:%r;" % (itemID, level))
+    return dict((charID, h.hexdigest()) for charID, h in hashes.iteritems())
+
+FIT_STATS_COLUMNS = ("gamedataVersion", "characterID", "skillsStamp", "dps", "volley", "ehp", "capStable",
+                     "capState", "price")
+
+def saveFitStats(fitID, characterID, dps=None, volley=None, ehp=None, capStable=None, capState=None, price=None):
+    """
+    Store summary stats of fit calculated with given character, stamped with
+    current gamedata version and saved skills of that character. Nothing is
+    written if stored stats are the same. Returns if row was written.
+    """
+    if not isinstance(fitID, int):
+        raise TypeError("FitID must be integer")
+    if isReadOnlySession():
+        return False
+    stamp = getSkillsStamps((characterID,)).get(characterID) if characterID is not None else None
+    row = {"fitID": fitID,
+           "gamedataVersion": unicode(eos.config.gamedata_version),
+           "characterID": characterID,
+           "skillsStamp": stamp,
+           "dps": dps,
+           "volley": volley,
+           "ehp": ehp,
+           "capStable": capStable,
+           "capState": capState,
+           "price": price,
+           "timestamp": int(time.time())}
+    with sd_lock:
+        stored = saveddata_session.execute(
+            select([fitStats_table], fitStats_table.c.fitID == fitID)).fetchone()
+        if stored is not None and all(stored[column] == row[column] for column in FIT_STATS_COLUMNS):
+            return False
+        saveddata_session.execute(fitStats_table.insert().prefix_with("OR REPLACE"), row)
+    return True
+
+def getFitStats(fitIDs=None, orderBy=None, descending=True, limit=None):
+    """
+    Get stored stats of fits as list of dictionaries, optionally only of
+    given fits, sorted by stat column orderBy. Rows left behind by deleted
+    fits are never returned.
+    """
+    query = select([fitStats_table], from_obj=fitStats_table.join(fits_table))
+    wanted = None
+    if fitIDs is not None:
+        fitIDs = list(fitIDs)
+        for fitID in fitIDs:
+            if not isinstance(fitID, int):
+                raise TypeError("All passed fit IDs must be integers")
+        if len(fitIDs) <= BATCH_SIZE:
+            query = query.where(fitStats_table.c.fitID.in_(fitIDs))
+        else:
+            # Too many for one IN clause, pick them out of all rows instead
+            wanted = set(fitIDs)
+    if orderBy is not None:
+        column = fitStats_table.c[orderBy]
+        query = query.order_by(column.desc() if descending else column.asc())
+    if limit is not None and wanted is None:
+        query = query.limit(limit)
+    with sd_lock:
+        rows = saveddata_session.execute(query).fetchall()
+    if wanted is not None:
+        rows = [row for row in rows if row["fitID"] in wanted][:limit]
+    return [dict(row) for row in rows]
+
+def getStaleFitStatsIDs(fitIDs=None):
+    """
+    Get IDs of fits whose stored stats are missing or out of date: made with
+    other gamedata, another character, or before its skills were changed.
+    If fitIDs are given, only those fits are looked at.
+    """
+    version = unicode(eos.config.gamedata_version)
+    query = select([fits_table.c.ID, fits_table.c.characterID, fitStats_table.c.gamedataVersion,
+                    fitStats_table.c.characterID, fitStats_table.c.skillsStamp],
+                   from_obj=fits_table.outerjoin(fitStats_table))
+    wanted = None
+    if fitIDs is not None:
+        fitIDs = list(fitIDs)
+        if not fitIDs:
+            return []
+        if len(fitIDs) <= BATCH_SIZE:
+            query = query.where(fits_table.c.ID.in_(fitIDs))
+        else:
+            wanted = set(fitIDs)
+    with sd_lock:
+        rows = saveddata_session.execute(query).fetchall()
+    if wanted is not None:
+        rows = [row for row in rows if row[0] in wanted]
+    # Skills only need to be hashed for characters stats were made with
+    stamps = getSkillsStamps(set(row[3] for row in rows if row[3] is not None))
+    stale = []
+    for fitID, fitCharID, statsVersion, statsCharID, statsStamp in rows:
+        # Fits without character are calculated with All 0, whatever its ID is
+        if fitCharID is not None and statsCharID != fitCharID:
+            stale.append(fitID)
+        elif statsVersion != version or statsStamp != stamps.get(statsCharID):
+            stale.append(fitID)
+    return stale
+
+def deleteOrphanFitStats():
+    """Drop stats of fits which no longer exist"""
+    with sd_lock:
+        saveddata_session.execute(fitStats_table.delete().where(
+            ~fitStats_table.c.fitID.in_(select([fits_table.c.ID]))))
+
 def getMiscData(field):
     if isinstance(field, basestring):
         with sd_lock:
@@ -485,8 +781,9 @@ def removeInvalid(fits):
 
     if invalids:
         map(fits.remove, invalids)
-        map(saveddata_session.delete, invalids)
-        saveddata_session.commit()
+        if not isReadOnlySession():
+            map(saveddata_session.delete, invalids)
+            saveddata_session.commit()
 
     return fits
 
@@ -505,7 +802,114 @@ def remove(stuff):
     commit()
 
 
-def commit():
+# Deferred commits, see setCommitScheduler() and commit()
+commitScheduler = None
+commitThread = None
+commitErrorHandler = None
+commitHandle = None
+commitPendingSince = None
+commitLock = threading.Lock()
+
+def setCommitScheduler(schedule, onError=None):
+    """
+    Let commit() hold back commits of shared session. schedule(delay, func)
+    has to run func after delay seconds on the thread calling this, which is
+    the one making changes to shared session (GUI event loop, for example
+    wx.CallLater), and return a handle whose Stop() cancels it. Commits made
+    from other threads are never deferred. If a deferred commit fails, its
+    transaction is rolled back and onError is called with the exception.
+    """
+    global commitScheduler, commitThread, commitErrorHandler
+    commitScheduler = schedule
+    commitThread = threading.current_thread()
+    commitErrorHandler = onError
+
+def commit(immediate=False):
+    """
+    Flush changes to database and commit them. Unless immediate is set, the
+    commit itself is held back for saveddataCommitDelay seconds (restarted on
+    each call, but never past saveddataCommitMaxDelay), so bursts of changes
+    end up in one transaction. Flushed changes are visible to our session
+    right away; use flushPendingCommit() to make sure they've hit the disk.
+    Commits are only deferred on the thread given to setCommitScheduler().
+    """
+    global commitHandle, commitPendingSince
+    if isReadOnlySession():
+        return
+    if isThreadSession():
+        # Own session of background thread: commit at once, not to keep
+        # database write-locked while shared session wants to write
+        with sd_lock:
+            saveddata_session.commit()
+        return
+
+    delay = getattr(eos.config, "saveddataCommitDelay", 0)
+    if immediate or not delay or commitScheduler is None or threading.current_thread() is not commitThread:
+        flushPendingCommit()
+        return
+
     with sd_lock:
-        saveddata_session.commit()
         saveddata_session.flush()
+
+    with commitLock:
+        now = time.time()
+        if commitPendingSince is None:
+            commitPendingSince = now
+        maxDelay = getattr(eos.config, "saveddataCommitMaxDelay", delay)
+        delay = max(0, min(delay, commitPendingSince + maxDelay - now))
+    # Handle is only ever touched on scheduler thread
+    if commitHandle is not None:
+        commitHandle.Stop()
+    commitHandle = commitScheduler(delay, deferredCommit)
+
+def commitPending():
+    """Return if there are flushed changes waiting for deferred commit"""
+    return commitPendingSince is not None
+
+def cancelPendingCommit():
+    global commitPendingSince
+    # Scheduled deferredCommit() finds nothing pending and does nothing
+    with commitLock:
+        commitPendingSince = None
+
+def deferredCommit():
+    global commitHandle
+    commitHandle = None
+    if not commitPending():
+        # Committed meanwhile
+        return
+    try:
+        flushPendingCommit()
+    except Exception, e:
+        logger.exception("Could not commit saveddata changes")
+        if commitErrorHandler is not None:
+            commitErrorHandler(e)
+
+def flushPendingCommit():
+    """
+    Commit everything right away, cancelling any deferred commit. If commit
+    fails, session is rolled back so it stays usable, and error is raised.
+    """
+    cancelPendingCommit()
+    with sd_lock:
+        try:
+            saveddata_session.commit()
+        except:
+            saveddata_session.rollback()
+            raise
+
+def discardUnflushed():
+    """
+    Drop changes to shared session made since last flush, leaving flushed
+    ones (which may be waiting for deferred commit) alone
+    """
+    with sd_lock:
+        for obj in list(saveddata_session.new):
+            saveddata_session.expunge(obj)
+        for obj in list(saveddata_session.deleted):
+            saveddata_session.expunge(obj)
+            saveddata_session.add(obj)
+        saveddata_session.expire_all()
+
+# Never lose deferred changes on interpreter shutdown
+atexit.register(flushPendingCommit)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+import itertools
+import threading
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.sql import select
+
+from eos.db import saveddata_session, saveddata_sessionmaker, gamedata_session, sd_lock
+from eos.db.saveddata.fit import fits_table
+from eos.db.gamedata.item import items_table
+from eos.db.gamedata.group import groups_table
+from eos.db.gamedata.category import categories_table
+from eos.db.gamedata.queries import BATCH_SIZE
+from eos.types import Fit, Implant
+
+# Categories of items fits can be made for, see eos.saveddata.ship/citadel
+SHIP_CATEGORIES = (u"舰船", u"建筑")
+
+
+class FitSummary(object):
+    """Plain row of fit data needed to list fits, no Fit object is built for it"""
+    __slots__ = ("ID", "shipID", "groupID", "name", "booster", "timestamp", "ownerID")
+
+    def __init__(self, ID, shipID, groupID, name, booster, timestamp, ownerID):
+        self.ID = ID
+        self.shipID = shipID
+        # None if ship is gone from gamedata or isn't a ship anymore; such
+        # fits are invalid and left out of all results
+        self.groupID = groupID
+        self.name = name
+        self.booster = bool(booster)
+        self.timestamp = timestamp
+        self.ownerID = ownerID
+
+    def __repr__(self):
+        return "FitSummary(%r, %r, %r)" % (self.ID, self.shipID, self.name)
+
+
+class FitSummaryIndex(object):
+    """
+    In-memory index of all fits, by ship. It is read from the fits table
+    in one query on first use, and kept up to date by watching flushes of
+    the saveddata session, so saving, renaming, toggling booster flag and
+    deleting fits are all reflected without reloading.
+
+    Flushes of every session, shared or per thread, are watched. Lock
+    order is sd_lock first, then index lock: flushes happen under sd_lock,
+    and loading needs it for its query.
+    """
+
+    def __init__(self):
+        self.__fits = None
+        self.__byShip = {}
+        self.__lock = threading.RLock()
+
+    def __ensureLoaded(self):
+        if self.__fits is not None:
+            return
+        with sd_lock:
+            with self.__lock:
+                if self.__fits is not None:
+                    return
+                rows = saveddata_session.execute(
+                    select([fits_table.c.ID, fits_table.c.shipID, fits_table.c.name, fits_table.c.booster,
+                            fits_table.c.timestamp, fits_table.c.ownerID])).fetchall()
+                groups = self.__shipGroups(set(row[1] for row in rows))
+                self.__fits = {}
+                self.__byShip = {}
+                for ID, shipID, name, booster, timestamp, ownerID in rows:
+                    self.__add(FitSummary(ID, shipID, groups.get(shipID), name, booster, timestamp, ownerID))
+
+    def __shipGroups(self, shipIDs):
+        """Map {typeID: groupID} of given items which are ships or structures"""
+        shipIDs = list(shipIDs)
+        result = {}
+        join = items_table.join(groups_table).join(categories_table)
+        for i in xrange(0, len(shipIDs), BATCH_SIZE):
+            chunk = shipIDs[i:i + BATCH_SIZE]
+            query = select([items_table.c.typeID, items_table.c.groupID], from_obj=join).where(
+                items_table.c.typeID.in_(chunk)).where(categories_table.c.categoryName.in_(SHIP_CATEGORIES))
+            result.update(gamedata_session.execute(query).fetchall())
+        return result
+
+    def __add(self, summary):
+        self.__fits[summary.ID] = summary
+        self.__byShip.setdefault(summary.shipID, {})[summary.ID] = summary
+
+    def __discard(self, fitID):
+        summary = self.__fits.pop(fitID, None)
+        if summary is not None:
+            shipFits = self.__byShip.get(summary.shipID)
+            shipFits.pop(fitID, None)
+            if not shipFits:
+                del self.__byShip[summary.shipID]
+
+    def update(self, fit):
+        with self.__lock:
+            if self.__fits is None or fit.ID is None:
+                return
+            self.__discard(fit.ID)
+            groupID = fit.ship.item.groupID if not fit.isInvalid else None
+            self.__add(FitSummary(fit.ID, fit.shipID, groupID, fit.name, fit.booster, fit.timestamp, fit.ownerID))
+
+    def discard(self, fitID):
+        with self.__lock:
+            if self.__fits is not None:
+                self.__discard(fitID)
+
+    def reset(self):
+        """Forget everything, index is re-read on next use"""
+        with self.__lock:
+            self.__fits = None
+            self.__byShip = {}
+
+    def getFits(self, shipID=None, ownerID=None, booster=None):
+        """Return summaries of valid fits matching all given criteria, by fit ID"""
+        self.__ensureLoaded()
+        with self.__lock:
+            if shipID is not None:
+                fits = self.__byShip.get(shipID, {}).values()
+            else:
+                fits = self.__fits.values()
+            return sorted((f for f in fits if f.groupID is not None and
+                           (ownerID is None or f.ownerID == ownerID) and
+                           (booster is None or f.booster == booster)),
+                          key=lambda f: f.ID)
+
+    def __countValid(self, shipID):
+        return sum(1 for f in self.__byShip.get(shipID, {}).itervalues() if f.groupID is not None)
+
+    def countFitsWithShips(self, shipIDs):
+        """Number of valid fits of all given ships together"""
+        self.__ensureLoaded()
+        with self.__lock:
+            return sum(self.__countValid(shipID) for shipID in shipIDs)
+
+    def countFitsByShip(self, shipIDs):
+        """Map {shipID: number of valid fits} of given ships"""
+        self.__ensureLoaded()
+        with self.__lock:
+            return dict((shipID, self.__countValid(shipID)) for shipID in shipIDs)
+
+    def countAll(self):
+        self.__ensureLoaded()
+        with self.__lock:
+            return len(self.__fits)
+
+
+fitSummaries = FitSummaryIndex()
+
+
+@event.listens_for(saveddata_sessionmaker, "after_flush")
+def updateFitSummaries(session, flushContext):
+    for obj in session.deleted:
+        if isinstance(obj, Fit):
+            fitSummaries.discard(obj.ID)
+    for obj in session.new.union(session.dirty):
+        if isinstance(obj, Fit):
+            fitSummaries.update(obj)
+
+
+@event.listens_for(saveddata_sessionmaker, "after_rollback")
+def resetFitSummaries(session):
+    # Flushed changes seen by the index may have been rolled back
+    fitSummaries.reset()
+
+
+class FitRevisions(object):
+    """
+    Revision number of every fit, which changes each time a change to the
+    fit or anything on it (modules, drones, cargo...) gets committed. Caches
+    of data derived from fits compare revisions to tell if they're still
+    current, without loading fits. Revisions only live as long as the
+    process; fits not changed since start are all at revision 0.
+    """
+
+    def __init__(self):
+        self.__revisions = {}
+        self.__counter = itertools.count(1)
+        # {session: set of fitIDs flushed but not yet committed by it}
+        self.__pending = weakref.WeakKeyDictionary()
+        self.__lock = threading.Lock()
+
+    def get(self, fitID):
+        return self.__revisions.get(fitID, 0)
+
+    def flushed(self, session, fitIDs):
+        with self.__lock:
+            self.__pending.setdefault(session, set()).update(fitIDs)
+
+    def committed(self, session):
+        with self.__lock:
+            fitIDs = self.__pending.pop(session, None)
+            if fitIDs:
+                revision = next(self.__counter)
+                for fitID in fitIDs:
+                    self.__revisions[fitID] = revision
+
+    def rolledBack(self, session):
+        with self.__lock:
+            self.__pending.pop(session, None)
+
+
+fitRevisions = FitRevisions()
+
+
+def _fitIDs(obj):
+    if isinstance(obj, Fit):
+        return (obj.ID,)
+    if isinstance(obj, Implant):
+        # Implants are linked to fits through association table
+        fits = getattr(obj, "fit", None) or ()
+        return [fit.ID for fit in fits]
+    # Modules, drones, fighters, cargo, boosters
+    fitID = getattr(obj, "fitID", None)
+    return (fitID,) if fitID is not None else ()
+
+
+@event.listens_for(saveddata_sessionmaker, "after_flush")
+def collectFitRevisions(session, flushContext):
+    fitIDs = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        fitIDs.update(_fitIDs(obj))
+    fitIDs.discard(None)
+    if fitIDs:
+        fitRevisions.flushed(session, fitIDs)
+
+
+@event.listens_for(saveddata_sessionmaker, "after_commit")
+def bumpFitRevisions(session):
+    fitRevisions.committed(session)
+
+
+@event.listens_for(saveddata_sessionmaker, "after_rollback")
+def dropFitRevisions(session):
+    fitRevisions.rolledBack(session)
@@ -0,0 +1,182 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+"""
+Saveddata sessions per thread.
+
+By default every thread works with the shared saveddata session, guarded by
+sd_lock, as it always did. A background thread can instead take a session of
+its own for a while with threadSession() (read-write) or snapshotSession()
+(read-only, consistent view of database as of its start). While it does,
+eos.db.saveddata_session and sd_lock used anywhere in that thread refer to
+its own session and lock, so it never waits for the shared one.
+
+Objects belong to the session which loaded them. To use an object from
+another thread's session, pass it through handoff() in the receiving thread,
+which returns the same database row as loaded by the receiving session.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import instance_state
+
+_local = threading.local()
+
+
+def currentScope():
+    """Key of session used by calling thread, None for the shared session"""
+    return getattr(_local, "scope", None)
+
+
+def isThreadSession():
+    return currentScope() is not None
+
+
+def isReadOnlySession():
+    scope = currentScope()
+    return scope is not None and scope[0] == "snapshot"
+
+
+class ScopedLock(object):
+    """Lock of the session calling thread uses; this is what eos.db.sd_lock is"""
+
+    def __init__(self):
+        self.__locks = {None: threading.RLock()}
+        self.__guard = threading.Lock()
+        self.__held = threading.local()
+
+    def current(self):
+        scope = currentScope()
+        with self.__guard:
+            lock = self.__locks.get(scope)
+            if lock is None:
+                lock = self.__locks[scope] = threading.RLock()
+        return lock
+
+    def shared(self):
+        """Lock of the shared session, whichever thread asks"""
+        return self.__locks[None]
+
+    def discard(self, scope):
+        with self.__guard:
+            self.__locks.pop(scope, None)
+
+    def __enter__(self):
+        lock = self.current()
+        lock.acquire()
+        # Release exactly what was acquired, whatever scope is current by then
+        self.__held.__dict__.setdefault("stack", []).append(lock)
+        return lock
+
+    def __exit__(self, *args):
+        self.__held.stack.pop().release()
+        return False
+
+
+@contextmanager
+def _scope(kind, session=None):
+    from eos.db import saveddata_session, sd_lock
+    if currentScope() is not None:
+        raise RuntimeError("Thread already uses its own saveddata session")
+    scope = (kind, threading.current_thread().ident)
+    _local.scope = scope
+    try:
+        if session is not None:
+            saveddata_session.registry.set(session)
+        yield saveddata_session()
+    finally:
+        # remove() closes session, objects loaded by it stay usable but detached
+        saveddata_session.remove()
+        sd_lock.discard(scope)
+        del _local.scope
+
+
+@contextmanager
+def threadSession():
+    """
+    Give calling thread a session of its own for duration of the block.
+    Its commits are done right away rather than deferred, so changes are
+    visible to other sessions as soon as eos.db.commit() returns.
+    """
+    with _scope("thread") as session:
+        yield session
+
+
+def _refuseFlush(session, flushContext, instances):
+    from eos.db import ReadOnlyException
+    raise ReadOnlyException("Snapshot sessions are read-only")
+
+
+@contextmanager
+def snapshotSession():
+    """
+    Give calling thread a read-only session for duration of the block. All
+    its reads see database as it was when the first of them ran, regardless
+    of what other sessions commit meanwhile, so exports are consistent.
+    eos.db.commit() does nothing for it, and flushing raises.
+    """
+    from eos.db import saveddata_engine, saveddata_session
+    connection = saveddata_engine.connect()
+    dbapiConnection = connection.connection.connection
+    # Reads only share a snapshot inside an explicit transaction, and pysqlite
+    # only opens those for writes; open and close it ourselves instead
+    isolation = dbapiConnection.isolation_level
+    dbapiConnection.isolation_level = None
+    try:
+        connection.execute("BEGIN")
+        session = saveddata_session.session_factory(bind=connection)
+        event.listen(session, "before_flush", _refuseFlush)
+        try:
+            with _scope("snapshot", session) as session:
+                yield session
+        finally:
+            try:
+                connection.execute("ROLLBACK")
+            except exc.OperationalError:
+                # Already ended by session itself when it was closed
+                pass
+    finally:
+        dbapiConnection.isolation_level = isolation
+        connection.close()
+
+
+def handoff(obj):
+    """
+    Return obj as loaded by the calling thread's session: obj itself if it
+    belongs there already, else the instance of the same row, expired if
+    it was loaded before so it's read again. obj must have been committed
+    by the other session. None is passed through.
+    """
+    from eos.db import saveddata_session
+    if obj is None:
+        return None
+    session = saveddata_session()
+    if object_session(obj) is session:
+        return obj
+    state = instance_state(obj)
+    if state.key is None:
+        raise ValueError("Only objects saved to database can be handed off")
+    existing = session.identity_map.get(state.key)
+    if existing is not None:
+        session.expire(existing)
+        return existing
+    return session.query(state.class_).get(state.key[1])
@@ -17,7 +17,7 @@
 # along with eos.  If not, see <http://www.gnu.org/licenses/>.
 #===============================================================================
 
-from sqlalchemy.orm import eagerload
+from sqlalchemy.orm import eagerload, subqueryload
 from sqlalchemy.sql import and_, or_
 
 replace = {"attributes": "_Item__attributes",
@@ -25,13 +25,20 @@ replace = {"attributes": "_Item__attributes",
            "projectedModules": "_Fit__projectedModules",
            "boosters": "_Fit__boosters",
            "drones": "_Fit__drones",
+           "fighters": "_Fit__fighters",
+           "cargo": "_Fit__cargo",
            "projectedDrones": "_Fit__projectedDrones",
            "implants": "_Fit__implants",
            "character": "_Fit__character",
            "damagePattern": "_Fit__damagePattern",
            "projectedFits": "_Fit__projectedFits"}
 
-def processEager(eager):
+def processEager(eager, subquery=False):
+    """
+    Convert eager load paths into query options. With subquery set, related
+    collections are loaded by one extra query each instead of joins, which
+    avoids row multiplication when several collections are requested at once.
+    """
     if eager == None:
         return tuple()
     else:
@@ -39,8 +46,9 @@ def processEager(eager):
         if isinstance(eager, basestring):
             eager = (eager,)
 
+        loader = subqueryload if subquery else eagerload
         for e in eager:
-            l.append(eagerload(_replacements(e)))
+            l.append(loader(_replacements(e)))
 
         return l
 
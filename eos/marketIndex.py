@@ -0,0 +1,225 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+"""
+Precomputed market structure: which items every market group lists, item
+variations (meta parent -> children), meta groups and publicity flags.
+
+Market service applies a few override tables on top of gamedata (forced
+groups, publicity, meta groups and market groups, keyed by item names). The index
+is built with them already applied, from three plain table scans, and only
+holds IDs. It is stored next to eve.db and reused as long as both client
+build and override tables stay the same, see eos.db.getMarketIndex().
+"""
+
+import cPickle
+import hashlib
+import os
+
+from utils.fileutils import replaceFile
+
+FORMAT_VERSION = 1
+
+
+def _unicode(name):
+    if not isinstance(name, unicode):
+        name = unicode(name, "utf-8")
+    return name
+
+
+def overridesKey(overrides):
+    """Fingerprint of override tables, index is rebuilt when it changes"""
+    data = []
+    for key in sorted(overrides):
+        data.append((key, sorted((_unicode(name), value) for name, value in overrides[key].iteritems())))
+    return hashlib.md5(repr(data)).hexdigest()
+
+
+class MarketIndex(object):
+    def __init__(self, buildKey, published, metaGroups, parents, children, marketGroups, groupTypes, groupItems,
+                 overrideIDs):
+        # (client build, overridesKey()) index was built for
+        self.buildKey = buildKey
+        # Set of typeIDs of published items
+        self.published = published
+        # {typeID: metaGroupID}, parents {typeID: parent typeID},
+        # children {parent typeID: tuple of typeIDs}
+        self.metaGroups = metaGroups
+        self.parents = parents
+        self.children = children
+        # {typeID: marketGroupID}, forced or assigned in gamedata
+        self.marketGroups = marketGroups
+        # {marketGroupID: tuple of typeIDs} of all items in the group, and
+        # {marketGroupID: tuple of typeIDs} of published items and their
+        # variations, as market browser lists them
+        self.groupTypes = groupTypes
+        self.groupItems = groupItems
+        # {item name: typeID} of items named in override tables, so Market
+        # needs no name lookups of its own
+        self.overrideIDs = overrideIDs
+
+    @classmethod
+    def build(cls, items, metaTypes, metaGroupNames, overrides, buildKey=None):
+        """
+        Build index from rows of (typeID, typeName, marketGroupID, published),
+        (typeID, parentTypeID, metaGroupID) and (metaGroupID, metaGroupName).
+        overrides is a dictionary of Market's override tables:
+        "published" {name: bool}, "metaGroups" {name: (meta group name,
+        parent name)}, "marketGroups" {name: marketGroupID} and "groups"
+        {name: groupID}. Groups are only resolved to typeIDs, see overrideIDs.
+        """
+        nameIDs = {}
+        published = set()
+        marketGroups = {}
+        for typeID, typeName, marketGroupID, isPublished in items:
+            if typeName is not None:
+                nameIDs.setdefault(typeName, typeID)
+            if isPublished:
+                published.add(typeID)
+            if marketGroupID is not None:
+                marketGroups[typeID] = marketGroupID
+
+        overrideIDs = {}
+
+        def resolve(name):
+            typeID = nameIDs.get(_unicode(name))
+            if typeID is not None:
+                overrideIDs[name] = typeID
+            return typeID
+
+        for name in overrides.get("groups", {}):
+            resolve(name)
+
+        for name, isPublished in overrides.get("published", {}).iteritems():
+            typeID = resolve(name)
+            if typeID is None:
+                continue
+            if isPublished:
+                published.add(typeID)
+            else:
+                published.discard(typeID)
+
+        metaGroups = {}
+        parents = {}
+        for typeID, parentTypeID, metaGroupID in metaTypes:
+            metaGroups[typeID] = metaGroupID
+            if parentTypeID is not None:
+                parents[typeID] = parentTypeID
+        metaGroupIDs = dict((_unicode(name), metaGroupID) for metaGroupID, name in metaGroupNames if name is not None)
+        for name, (metaGroupName, parentName) in overrides.get("metaGroups", {}).iteritems():
+            typeID = resolve(name)
+            parentTypeID = resolve(parentName)
+            if typeID is None or parentTypeID is None:
+                continue
+            metaGroups[typeID] = metaGroupIDs.get(_unicode(metaGroupName))
+            parents[typeID] = parentTypeID
+        children = {}
+        for typeID, parentTypeID in parents.iteritems():
+            children.setdefault(parentTypeID, []).append(typeID)
+
+        for name, marketGroupID in overrides.get("marketGroups", {}).iteritems():
+            typeID = resolve(name)
+            if typeID is not None:
+                marketGroups[typeID] = marketGroupID
+        groupTypes = {}
+        for typeID, marketGroupID in marketGroups.iteritems():
+            groupTypes.setdefault(marketGroupID, []).append(typeID)
+
+        # Market groups list their own items, plus variations of those which
+        # are meta parents and have no market group of their own
+        groupItems = {}
+        for marketGroupID, typeIDs in groupTypes.iteritems():
+            result = set(typeIDs)
+            for typeID in typeIDs:
+                if typeID not in parents:
+                    result.update(child for child in children.get(typeID, ()) if child not in marketGroups)
+            groupItems[marketGroupID] = tuple(sorted(result.intersection(published)))
+
+        return cls(buildKey, frozenset(published), metaGroups, parents,
+                   dict((parentTypeID, tuple(sorted(typeIDs))) for parentTypeID, typeIDs in children.iteritems()),
+                   marketGroups, dict((marketGroupID, tuple(sorted(typeIDs))) for marketGroupID, typeIDs in groupTypes.iteritems()),
+                   groupItems, overrideIDs)
+
+    def save(self, path):
+        # Write into temporary file first so readers never see a half-written index
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as f:
+            cPickle.dump((FORMAT_VERSION, self.buildKey, self.published, self.metaGroups, self.parents,
+                          self.children, self.marketGroups, self.groupTypes, self.groupItems, self.overrideIDs),
+                         f, cPickle.HIGHEST_PROTOCOL)
+        replaceFile(tmpPath, path)
+
+    def isPublished(self, typeID):
+        return typeID in self.published
+
+    def getMetaGroupID(self, typeID, fallback=0):
+        metaGroupID = self.metaGroups.get(typeID)
+        return fallback if metaGroupID is None else metaGroupID
+
+    def getParentID(self, typeID):
+        return self.parents.get(typeID)
+
+    def getMarketGroupID(self, typeID, parentcheck=True):
+        """Market group of item; if it has none, that of its parent if parentcheck is set"""
+        marketGroupID = self.marketGroups.get(typeID)
+        if marketGroupID is None and parentcheck:
+            parentTypeID = self.parents.get(typeID)
+            if parentTypeID is not None:
+                marketGroupID = self.marketGroups.get(parentTypeID)
+        return marketGroupID
+
+    def getVariationIDs(self, parentTypeIDs):
+        """typeIDs of given parents and all their variations"""
+        result = set(parentTypeIDs)
+        for parentTypeID in parentTypeIDs:
+            result.update(self.children.get(parentTypeID, ()))
+        return result
+
+    def getMarketGroupItemIDs(self, marketGroupID, vars=True):
+        """typeIDs of published items listed in market group, with their variations if vars is set"""
+        if vars:
+            return set(self.groupItems.get(marketGroupID, ()))
+        return set(typeID for typeID in self.groupTypes.get(marketGroupID, ()) if typeID in self.published)
+
+    def hasTypes(self, marketGroupID):
+        return marketGroupID in self.groupTypes
+
+
+def load(path, buildKey=None):
+    """
+    Load index stored at path. Returns None if there is no usable index, or if
+    buildKey is given and the index was built for another one.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = cPickle.load(f)
+        version = data[0]
+        if version != FORMAT_VERSION:
+            return None
+        (version, key, published, metaGroups, parents, children, marketGroups, groupTypes, groupItems,
+         overrideIDs) = data
+    except (cPickle.UnpicklingError, EnvironmentError, EOFError, ValueError, TypeError,
+            AttributeError, ImportError, IndexError):
+        return None
+    if buildKey is not None and key != buildKey:
+        return None
+    return MarketIndex(key, published, metaGroups, parents, children, marketGroups, groupTypes, groupItems,
+                       overrideIDs)
@@ -19,7 +19,7 @@
 
 
 from sqlalchemy.orm import validates, reconstructor
-from itertools import chain
+from itertools import chain, count
 
 from eos.effectHandlerHelpers import HandledItem, HandledImplantBoosterList
 import eos.db
@@ -29,6 +29,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Source of Character.skillsRevision values, unique across characters
+_skillsRevisions = count(1)
+
 class Character(object):
     __itemList = None
     __itemIDMap = None
@@ -97,6 +100,8 @@ class Character(object):
         self.__skills = []
         self.__skillIdMap = {}
         self.dirtySkills = set()
+        # Changes whenever a skill level changes, see skillsChanged()
+        self.skillsRevision = next(_skillsRevisions)
 
         if initSkills:
             for item in self.getSkillList():
@@ -111,12 +116,21 @@ class Character(object):
         for skill in self.__skills:
             self.__skillIdMap[skill.itemID] = skill
         self.dirtySkills = set()
+        self.skillsRevision = next(_skillsRevisions)
+
+    def skillsChanged(self):
+        """
+        Give character new skillsRevision. Revisions of all characters are
+        unique, so caches of data derived from skill levels can key on them.
+        """
+        self.skillsRevision = next(_skillsRevisions)
 
     def apiUpdateCharSheet(self, skills):
         del self.__skills[:]
         self.__skillIdMap.clear()
         for skillRow in skills:
             self.addSkill(Skill(skillRow["typeID"], skillRow["level"]))
+        self.skillsChanged()
 
     @property
     def ro(self):
@@ -143,6 +157,10 @@ class Character(object):
         return self.__skills
 
     def addSkill(self, skill):
+        self.__addSkill(skill)
+        self.skillsChanged()
+
+    def __addSkill(self, skill):
         if skill.itemID in self.__skillIdMap:
             oldSkill = self.__skillIdMap[skill.itemID]
             if skill.level > oldSkill.level:
@@ -157,6 +175,7 @@ class Character(object):
     def removeSkill(self, skill):
         self.__skills.remove(skill)
         del self.__skillIdMap[skill.itemID]
+        self.skillsChanged()
 
     def getSkill(self, item):
         if isinstance(item, basestring):
@@ -167,8 +186,9 @@ class Character(object):
         skill = self.__skillIdMap.get(item.ID)
 
         if skill is None:
+            # Skill at default level, nothing changes for skillsRevision
             skill = Skill(item, self.defaultLevel, False, True)
-            self.addSkill(skill)
+            self.__addSkill(skill)
 
         return skill
 
@@ -300,6 +320,7 @@ class Skill(HandledItem):
 
         self.activeLevel = level
         self.character.dirtySkills.add(self)
+        self.character.skillsChanged()
 
         if self.activeLevel == self.__level and self in self.character.dirtySkills:
             self.character.dirtySkills.remove(self)
@@ -0,0 +1,289 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+"""
+Full-text index over item names.
+
+Names are normalized (NFKC, lower case, collapsed whitespace) and every
+character and character pair of a name is indexed. Pairs instead of words
+are used as item names are mostly CJK text, which has no word separators;
+they still allow any substring of a name to be looked up with a couple of
+posting list intersections. Search terms are split on whitespace, and all
+terms have to match, same as the LIKE based eos.db.searchItems.
+
+The index is built once per gamedata client build and stored next to
+eve.db, see eos.db.getSearchIndex().
+
+Extending a search text by more characters or terms can only narrow its
+results, so as-you-type searches can look at the previous results only,
+see SearchIndex.match(). Fuzzy matches are the exception: they're only
+made when a term has no exact matches, and aren't narrowed from.
+"""
+
+import array
+import cPickle
+import os
+import re
+import unicodedata
+
+from utils.fileutils import replaceFile
+
+FORMAT_VERSION = 1
+
+# Minimum share of a term's character pairs a name needs to have to be
+# considered a fuzzy match, used only when a term has no exact matches
+FUZZY_OVERLAP = 0.6
+FUZZY_MIN_LENGTH = 3
+
+_whitespace = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize(text):
+    if not isinstance(text, unicode):
+        text = unicode(text, "utf-8")
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _whitespace.sub(u" ", text).strip()
+
+
+def grams(text):
+    """Characters and character pairs of text"""
+    result = set(text)
+    result.update(text[i:i + 2] for i in xrange(len(text) - 1))
+    result.discard(u" ")
+    return result
+
+
+def _queryGrams(term):
+    # Pairs are selective enough on their own, single characters are only
+    # needed for one character terms
+    if len(term) == 1:
+        return set((term,))
+    return set(term[i:i + 2] for i in xrange(len(term) - 1))
+
+
+class SearchIndex(object):
+    def __init__(self, clientBuild, names, postings, categories, groups):
+        self.clientBuild = clientBuild
+        # {typeID: normalized name}
+        self.names = names
+        # {gram: sorted array of typeIDs}
+        self.postings = postings
+        # {category or group name: set of typeIDs}
+        self.categories = categories
+        self.groups = groups
+        # {normalized name: typeID}, see getNameMap()
+        self._nameMap = None
+
+    @classmethod
+    def build(cls, rows, clientBuild=None):
+        """Build index from (typeID, typeName, groupName, categoryName) rows"""
+        names = {}
+        postings = {}
+        categories = {}
+        groups = {}
+        for typeID, typeName, groupName, categoryName in rows:
+            if typeName is None:
+                continue
+            name = normalize(typeName)
+            names[typeID] = name
+            for gram in grams(name):
+                postings.setdefault(gram, []).append(typeID)
+            if groupName is not None:
+                groups.setdefault(groupName, set()).add(typeID)
+            if categoryName is not None:
+                categories.setdefault(categoryName, set()).add(typeID)
+
+        for gram, typeIDs in postings.iteritems():
+            postings[gram] = array.array("i", sorted(typeIDs))
+
+        if clientBuild is not None:
+            clientBuild = unicode(clientBuild)
+        return cls(clientBuild, names, postings, categories, groups)
+
+    def save(self, path):
+        # Write into temporary file first so readers never see a half-written index
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "wb") as f:
+            cPickle.dump((FORMAT_VERSION, self.clientBuild, self.names, self.postings,
+                          self.categories, self.groups), f, cPickle.HIGHEST_PROTOCOL)
+        replaceFile(tmpPath, path)
+
+    def getNameMap(self):
+        """
+        Return {normalized name: typeID} of all items. Names are unique in
+        gamedata; should two normalize to the same text, lower typeID wins.
+        """
+        if self._nameMap is None:
+            nameMap = {}
+            for typeID in sorted(self.names):
+                nameMap.setdefault(self.names[typeID], typeID)
+            self._nameMap = nameMap
+        return self._nameMap
+
+    def _allowed(self, categories, groups):
+        if categories is None and groups is None:
+            return None
+        allowed = set()
+        for names, typeIDs in ((categories, self.categories), (groups, self.groups)):
+            for name in names or ():
+                # Keys are unicode as returned by database, callers often pass utf-8 str
+                if not isinstance(name, unicode):
+                    name = unicode(name, "utf-8")
+                allowed.update(typeIDs.get(name, ()))
+        return allowed
+
+    def _candidates(self, gramSet, allowed):
+        lists = []
+        for gram in gramSet:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return set()
+            lists.append(posting)
+        lists.sort(key=len)
+        candidates = set(lists[0]) if allowed is None else allowed.intersection(lists[0])
+        for posting in lists[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return candidates
+
+    def _matchTerm(self, term, allowed):
+        """
+        Return ({typeID: rank}, fuzzy) of names matching term, lower ranks are
+        better; fuzzy is set if they're fuzzy matches
+        """
+        names = self.names
+        matches = {}
+        if "*" in term:
+            # Generic wildcard, same meaning as in eos.db.searchItems
+            parts = [part for part in term.split("*") if part]
+            if not parts:
+                return dict.fromkeys(allowed if allowed is not None else names, 3), False
+            pattern = re.compile(u".*".join(re.escape(part) for part in parts), re.UNICODE)
+            gramSet = set()
+            for part in parts:
+                gramSet.update(_queryGrams(part))
+            for typeID in self._candidates(gramSet, allowed):
+                if pattern.search(names[typeID]):
+                    matches[typeID] = 3
+            return matches, False
+
+        for typeID in self._candidates(_queryGrams(term), allowed):
+            name = names[typeID]
+            pos = name.find(term)
+            if pos == -1:
+                continue
+            if name == term:
+                matches[typeID] = 0
+            elif pos == 0:
+                matches[typeID] = 1
+            elif not name[pos - 1].isalnum():
+                matches[typeID] = 2
+            else:
+                matches[typeID] = 3
+
+        if not matches and len(term) >= FUZZY_MIN_LENGTH:
+            return self._fuzzyTerm(term, allowed), True
+        return matches, False
+
+    def _fuzzyTerm(self, term, allowed):
+        gramSet = _queryGrams(term)
+        counts = {}
+        for gram in gramSet:
+            for typeID in self.postings.get(gram, ()):
+                counts[typeID] = counts.get(typeID, 0) + 1
+        needed = max(1, int(len(gramSet) * FUZZY_OVERLAP + 0.5))
+        matches = {}
+        for typeID, count in counts.iteritems():
+            if count >= needed and (allowed is None or typeID in allowed):
+                # Rank behind every exact match, closer names first
+                matches[typeID] = 4 + len(gramSet) - count
+        return matches
+
+    def match(self, text, categories=None, groups=None, within=None, cancelled=None):
+        """
+        Return ({typeID: rank}, narrowable) of all items matching text, see
+        search(). If within is given, only those typeIDs are looked at. Texts
+        extending this one can be matched within its results if narrowable
+        is set. cancelled is called between terms; once it returns true,
+        matching is given up and None is returned.
+        """
+        terms = [term for term in normalize(text).split(u" ") if term]
+        if not terms:
+            return {}, False
+
+        allowed = self._allowed(categories, groups)
+        if within is not None:
+            allowed = set(within) if allowed is None else allowed.intersection(within)
+        ranks = None
+        narrowable = True
+        for term in terms:
+            if cancelled is not None and cancelled():
+                return None
+            matches, fuzzy = self._matchTerm(term, allowed)
+            if fuzzy:
+                narrowable = False
+            if ranks is None:
+                ranks = matches
+            else:
+                ranks = dict((typeID, rank + matches[typeID]) for typeID, rank in ranks.iteritems()
+                             if typeID in matches)
+            if not ranks:
+                return {}, narrowable
+            # Further terms only need to look at what matched so far
+            allowed = set(ranks)
+        return ranks, narrowable
+
+    def order(self, ranks, limit=100):
+        """Return typeIDs of match() results, best matches first"""
+        names = self.names
+        result = sorted(ranks, key=lambda typeID: (ranks[typeID], len(names[typeID]), names[typeID]))
+        if limit is not None:
+            del result[limit:]
+        return result
+
+    def search(self, text, categories=None, groups=None, limit=100):
+        """
+        Return typeIDs of items matching text, best matches first. If
+        categories or groups (names) are given, only items in any of them
+        are returned.
+        """
+        ranks, narrowable = self.match(text, categories, groups)
+        return self.order(ranks, limit)
+
+
+def load(path, clientBuild=None):
+    """
+    Load index stored at path. Returns None if there is no usable index, or if
+    clientBuild is given and the index was built from another client build.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = cPickle.load(f)
+        version, build, names, postings, categories, groups = data
+    except (cPickle.UnpicklingError, EnvironmentError, EOFError, ValueError, TypeError,
+            AttributeError, ImportError, IndexError):
+        return None
+    if version != FORMAT_VERSION:
+        return None
+    if clientBuild is not None and build != unicode(clientBuild):
+        return None
+    return SearchIndex(build, names, postings, categories, groups)
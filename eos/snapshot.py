@@ -0,0 +1,718 @@
+#===============================================================================
+# Copyright (C) 2010 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+"""
+Compact, memory-mapped snapshot of the gamedata database.
+
+The snapshot is a single binary file made of named columns. Every table
+(types, groups, categories, attribute and effect definitions) is stored
+column by column, type attributes and effects are stored as CSR-style
+ranges per type, and all text lives in one shared string table. Nothing
+is unpacked on load: views read their fields straight from the mapping
+when they are accessed. Attributes whose value is NULL in eve.db are left
+out, as if the row was missing.
+
+Views are read-only and carry no effect handlers or ORM relations, so
+fitting keeps using SQLAlchemy objects; eos.db.getItem, getGroup,
+getCategory and getAttributeInfo return views only when
+eos.config.gamedata_snapshot_views is set. getAttributeMatrix always
+reads from the snapshot when there is one.
+
+Snapshots are produced by build() (see scripts/gamedataSnapshot.py) and
+are stamped with the client build of the eve.db they were exported from.
+"""
+
+import bisect
+import mmap
+import os
+import sqlite3
+import struct
+
+from utils.fileutils import replaceFile
+
+MAGIC = "PYFASNAP"
+FORMAT_VERSION = 3
+
+_HEADER = struct.Struct("<8sII")
+# Column name, array typecode, byte offset in file, element count
+_SECTION = struct.Struct("<24sc3xQQ")
+
+# Map containing attribute IDs we may need for required skills
+# { requiredSkillX : requiredSkillXLevel }, same as eos.gamedata.Item
+SRQ_ATTRS = {182: 277, 183: 278, 184: 279, 1285: 1286, 1289: 1287, 1290: 1288}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Column(object):
+    """Read-only sequence view over one column of the snapshot"""
+    __slots__ = ("buffer", "offset", "count", "typecode", "_struct")
+
+    def __init__(self, buffer, offset, count, typecode):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.typecode = typecode
+        self._struct = struct.Struct("<" + typecode)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.count)
+            return self.range(start, stop)[::step]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("column index out of range")
+        return self._struct.unpack_from(self.buffer, self.offset + index * self._struct.size)[0]
+
+    def range(self, start, stop):
+        """Unpack a contiguous run of values in one call"""
+        if stop <= start:
+            return ()
+        fmt = "<%d%s" % (stop - start, self.typecode)
+        return struct.unpack_from(fmt, self.buffer, self.offset + start * self._struct.size)
+
+    def find(self, value, lo=0, hi=None):
+        """Return index of value in a sorted column (or its sorted part), -1 if missing"""
+        if hi is None:
+            hi = self.count
+        index = bisect.bisect_left(self, value, lo, hi)
+        if index < hi and self[index] == value:
+            return index
+        return -1
+
+
+class Snapshot(object):
+    """Memory-mapped gamedata snapshot"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise SnapshotError("Unsupported snapshot file: %s" % path)
+
+        self.columns = {}
+        for i in xrange(count):
+            name, typecode, offset, length = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            self.columns[name.rstrip("\0")] = Column(self._mmap, offset, length, typecode)
+
+        self._strOffsets = self.columns["strings.offsets"]
+        self._strData = self.columns["strings.data"]
+
+        # Small lookup maps, built on first use
+        self.__attrNameMap = None
+        self.__groupNameMap = None
+        self.__categoryNameMap = None
+        self.__effectNameMap = None
+
+        self.clientBuild = self.getMetaData("client_build")
+
+    def close(self):
+        self._mmap.close()
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def string(self, index):
+        if index < 0:
+            return None
+        start, end = self._strOffsets.range(index, index + 2)
+        base = self._strData.offset
+        return self._mmap[base + start:base + end].decode("utf-8")
+
+    def getMetaData(self, field):
+        names = self.columns["metadata.name"]
+        for i in xrange(len(names)):
+            if self.string(names[i]) == field:
+                return self.string(self.columns["metadata.value"][i])
+        return None
+
+    # Items
+
+    def itemCount(self):
+        return len(self.columns["types.typeID"])
+
+    def _typeRowByName(self, name):
+        byName = self.columns["types.byName"]
+        names = self.columns["types.name"]
+        lo, hi = 0, len(byName)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(names[byName[mid]]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(byName) and self.string(names[byName[lo]]) == name:
+            return byName[lo]
+        return -1
+
+    def getItem(self, lookfor):
+        if isinstance(lookfor, (int, long)):
+            row = self.columns["types.typeID"].find(lookfor)
+        elif isinstance(lookfor, basestring):
+            row = self._typeRowByName(unicode(lookfor))
+        else:
+            raise TypeError("Need integer or string as argument")
+        return SnapshotItem(self, row) if row >= 0 else None
+
+    def getItems(self, typeIDs):
+        """Resolve many typeIDs at once, missing ones are skipped"""
+        typeIDCol = self.columns["types.typeID"]
+        items = []
+        for typeID in sorted(set(typeIDs)):
+            row = typeIDCol.find(typeID)
+            if row >= 0:
+                items.append(SnapshotItem(self, row))
+        return items
+
+    def getAttributeRows(self, typeIDs, attrIDs=None):
+        """
+        Yield (typeID, attributeID, value) of given items, for all their
+        attributes or only those in attrIDs. Each item's attributes are
+        read in one go from the CSR columns.
+        """
+        typeIDCol = self.columns["types.typeID"]
+        attrStart = self.columns["types.attrStart"]
+        attrIDCol = self.columns["typeattribs.attributeID"]
+        valueCol = self.columns["typeattribs.value"]
+        if attrIDs is not None:
+            attrIDs = frozenset(attrIDs)
+        for typeID in sorted(set(typeIDs)):
+            row = typeIDCol.find(typeID)
+            if row < 0:
+                continue
+            start, stop = attrStart.range(row, row + 2)
+            for attrID, value in zip(attrIDCol.range(start, stop), valueCol.range(start, stop)):
+                if attrIDs is None or attrID in attrIDs:
+                    yield typeID, attrID, value
+
+    def getItemsWithEffect(self, effect):
+        if isinstance(effect, basestring):
+            effect = self._effectNameMap().get(effect)
+            if effect is None:
+                return []
+        row = self.columns["effects.effectID"].find(effect)
+        if row < 0:
+            return []
+        start, stop = self.columns["effects.typeStart"].range(row, row + 2)
+        return [SnapshotItem(self, r) for r in self.columns["effects.types"].range(start, stop)]
+
+    # Groups and categories
+
+    def getGroup(self, lookfor):
+        if isinstance(lookfor, basestring):
+            if self.__groupNameMap is None:
+                names = self.columns["groups.name"]
+                self.__groupNameMap = dict((self.string(names[r]), r) for r in xrange(len(names)))
+            row = self.__groupNameMap.get(lookfor, -1)
+        elif isinstance(lookfor, (int, long)):
+            row = self.columns["groups.groupID"].find(lookfor)
+        else:
+            raise TypeError("Need integer or string as argument")
+        return SnapshotGroup(self, row) if row >= 0 else None
+
+    def getCategory(self, lookfor):
+        if isinstance(lookfor, basestring):
+            if self.__categoryNameMap is None:
+                names = self.columns["categories.name"]
+                self.__categoryNameMap = dict((self.string(names[r]), r) for r in xrange(len(names)))
+            row = self.__categoryNameMap.get(lookfor, -1)
+        elif isinstance(lookfor, (int, long)):
+            row = self.columns["categories.categoryID"].find(lookfor)
+        else:
+            raise TypeError("Need integer or string as argument")
+        return SnapshotCategory(self, row) if row >= 0 else None
+
+    # Attribute and effect definitions
+
+    def _attrNameMap(self):
+        if self.__attrNameMap is None:
+            ids = self.columns["attribs.attributeID"]
+            names = self.columns["attribs.name"]
+            self.__attrNameMap = dict((self.string(names[r]), ids[r]) for r in xrange(len(ids)))
+        return self.__attrNameMap
+
+    def _effectNameMap(self):
+        if self.__effectNameMap is None:
+            ids = self.columns["effects.effectID"]
+            names = self.columns["effects.name"]
+            self.__effectNameMap = dict((self.string(names[r]), ids[r]) for r in xrange(len(ids)))
+        return self.__effectNameMap
+
+    def getAttributeID(self, name):
+        return self._attrNameMap().get(name)
+
+    def getAttributeInfo(self, attr):
+        if isinstance(attr, basestring):
+            attr = self.getAttributeID(attr)
+            if attr is None:
+                return None
+        elif not isinstance(attr, (int, long)):
+            raise TypeError("Need integer or string as argument")
+        row = self.columns["attribs.attributeID"].find(attr)
+        return SnapshotAttributeInfo(self, row) if row >= 0 else None
+
+    def getEffectName(self, effectID):
+        row = self.columns["effects.effectID"].find(effectID)
+        return self.string(self.columns["effects.name"][row]) if row >= 0 else None
+
+
+class _View(object):
+    __slots__ = ("_snapshot", "_row")
+    _idColumn = None
+
+    def __init__(self, snapshot, row):
+        self._snapshot = snapshot
+        self._row = row
+
+    def _get(self, column):
+        return self._snapshot.columns[column][self._row]
+
+    @property
+    def ID(self):
+        return self._get(self._idColumn)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.ID == other.ID
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(type(self)) + self.ID
+
+
+class SnapshotItem(_View):
+    __slots__ = ()
+    _idColumn = "types.typeID"
+
+    typeID = _View.ID
+
+    @property
+    def name(self):
+        return self._snapshot.string(self._get("types.name"))
+
+    typeName = name
+
+    @property
+    def groupID(self):
+        return self._get("types.groupID")
+
+    @property
+    def group(self):
+        return self._snapshot.getGroup(self.groupID)
+
+    @property
+    def category(self):
+        group = self.group
+        return group.category if group is not None else None
+
+    @property
+    def marketGroupID(self):
+        value = self._get("types.marketGroupID")
+        return value if value >= 0 else None
+
+    @property
+    def iconID(self):
+        value = self._get("types.iconID")
+        return value if value >= 0 else None
+
+    @property
+    def raceID(self):
+        value = self._get("types.raceID")
+        return value if value >= 0 else None
+
+    @property
+    def factionID(self):
+        value = self._get("types.factionID")
+        return value if value >= 0 else None
+
+    @property
+    def parentTypeID(self):
+        value = self._get("types.parentTypeID")
+        return value if value >= 0 else None
+
+    @property
+    def metaGroupID(self):
+        value = self._get("types.metaGroupID")
+        return value if value >= 0 else None
+
+    @property
+    def published(self):
+        return bool(self._get("types.published"))
+
+    @property
+    def volume(self):
+        return self._get("types.volume")
+
+    @property
+    def mass(self):
+        return self._get("types.mass")
+
+    @property
+    def capacity(self):
+        return self._get("types.capacity")
+
+    def _attrRange(self):
+        return self._snapshot.columns["types.attrStart"].range(self._row, self._row + 2)
+
+    @property
+    def attributes(self):
+        """Dictionary of attribute name: value"""
+        snapshot = self._snapshot
+        start, stop = self._attrRange()
+        ids = snapshot.columns["typeattribs.attributeID"].range(start, stop)
+        values = snapshot.columns["typeattribs.value"].range(start, stop)
+        attributes = {}
+        for attrID, value in zip(ids, values):
+            info = snapshot.getAttributeInfo(attrID)
+            if info is not None:
+                attributes[info.name] = value
+        return attributes
+
+    def getAttribute(self, key):
+        if isinstance(key, basestring):
+            key = self._snapshot.getAttributeID(key)
+            if key is None:
+                return None
+        start, stop = self._attrRange()
+        index = self._snapshot.columns["typeattribs.attributeID"].find(key, start, stop)
+        if index < 0:
+            return None
+        return self._snapshot.columns["typeattribs.value"][index]
+
+    @property
+    def effectIDs(self):
+        start, stop = self._snapshot.columns["types.effectStart"].range(self._row, self._row + 2)
+        return self._snapshot.columns["typeeffects.effectID"].range(start, stop)
+
+    @property
+    def effects(self):
+        """Dictionary of effect name: effect ID"""
+        snapshot = self._snapshot
+        return dict((snapshot.getEffectName(effectID), effectID) for effectID in self.effectIDs)
+
+    @property
+    def requiredSkills(self):
+        """Dictionary of required skill typeID: level"""
+        requiredSkills = {}
+        for srqIDAttr, srqLvlAttr in SRQ_ATTRS.iteritems():
+            skillID = self.getAttribute(srqIDAttr)
+            skillLvl = self.getAttribute(srqLvlAttr)
+            if skillID is not None and skillLvl is not None:
+                requiredSkills[int(skillID)] = skillLvl
+        return requiredSkills
+
+    def __repr__(self):
+        return u"SnapshotItem(ID={}, name={}) at {}".format(self.ID, self.name, hex(id(self))).encode("utf-8")
+
+
+class SnapshotGroup(_View):
+    __slots__ = ()
+    _idColumn = "groups.groupID"
+
+    groupID = _View.ID
+
+    @property
+    def name(self):
+        return self._snapshot.string(self._get("groups.name"))
+
+    groupName = name
+
+    @property
+    def categoryID(self):
+        return self._get("groups.categoryID")
+
+    @property
+    def category(self):
+        return self._snapshot.getCategory(self.categoryID)
+
+    @property
+    def published(self):
+        return bool(self._get("groups.published"))
+
+    @property
+    def items(self):
+        snapshot = self._snapshot
+        start, stop = snapshot.columns["groups.typeStart"].range(self._row, self._row + 2)
+        return [SnapshotItem(snapshot, r) for r in snapshot.columns["groups.types"].range(start, stop)]
+
+
+class SnapshotCategory(_View):
+    __slots__ = ()
+    _idColumn = "categories.categoryID"
+
+    categoryID = _View.ID
+
+    @property
+    def name(self):
+        return self._snapshot.string(self._get("categories.name"))
+
+    categoryName = name
+
+    @property
+    def published(self):
+        return bool(self._get("categories.published"))
+
+    @property
+    def groups(self):
+        snapshot = self._snapshot
+        start, stop = snapshot.columns["categories.groupStart"].range(self._row, self._row + 2)
+        return [SnapshotGroup(snapshot, r) for r in snapshot.columns["categories.groups"].range(start, stop)]
+
+
+class SnapshotAttributeInfo(_View):
+    __slots__ = ()
+    _idColumn = "attribs.attributeID"
+
+    attributeID = _View.ID
+
+    @property
+    def name(self):
+        return self._snapshot.string(self._get("attribs.name"))
+
+    attributeName = name
+
+    @property
+    def displayName(self):
+        return self._snapshot.string(self._get("attribs.displayName"))
+
+    @property
+    def defaultValue(self):
+        return self._get("attribs.defaultValue")
+
+    @property
+    def unitID(self):
+        value = self._get("attribs.unitID")
+        return value if value >= 0 else None
+
+    @property
+    def iconID(self):
+        value = self._get("attribs.iconID")
+        return value if value >= 0 else None
+
+    @property
+    def highIsGood(self):
+        return bool(self._get("attribs.highIsGood"))
+
+    @property
+    def published(self):
+        return bool(self._get("attribs.published"))
+
+
+def load(path, clientBuild=None):
+    """
+    Open snapshot at path. Returns None if there is no usable snapshot, or if
+    clientBuild is given and the snapshot was exported from another build.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (SnapshotError, struct.error, KeyError, EnvironmentError, ValueError):
+        return None
+    if clientBuild is not None and snapshot.clientBuild != unicode(clientBuild):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+class _StringTable(object):
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, value):
+        if value is None:
+            return -1
+        value = unicode(value)
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return idx
+
+    def columns(self):
+        offsets = [0]
+        data = []
+        size = 0
+        for value in self.strings:
+            encoded = value.encode("utf-8")
+            data.append(encoded)
+            size += len(encoded)
+            offsets.append(size)
+        return ("I", offsets), ("c", "".join(data))
+
+
+def _csr(rows, keyCount, keyIndex):
+    """Group (key, value) pairs by key index into start offsets and flat values"""
+    buckets = [[] for _ in xrange(keyCount)]
+    for key, value in rows:
+        index = keyIndex.get(key)
+        if index is not None:
+            buckets[index].append(value)
+    starts = [0]
+    values = []
+    for bucket in buckets:
+        values.extend(bucket)
+        starts.append(len(values))
+    return starts, values
+
+
+def _opt(value):
+    return -1 if value is None else value
+
+
+def build(dbPath, outPath):
+    """Export gamedata database at dbPath into snapshot file at outPath"""
+    db = sqlite3.connect(dbPath)
+    cursor = db.cursor()
+    strings = _StringTable()
+    columns = []
+
+    def add(name, typecode, values):
+        columns.append((name, typecode, values))
+
+    # Metadata
+    metadata = cursor.execute("SELECT field_name, field_value FROM metadata").fetchall()
+    add("metadata.name", "i", [strings.add(r[0]) for r in metadata])
+    add("metadata.value", "i", [strings.add(r[1]) for r in metadata])
+
+    # Types, with their meta type info folded in
+    types = cursor.execute(
+        "SELECT t.typeID, t.typeName, t.groupID, t.marketGroupID, t.iconID, t.raceID, t.factionID, "
+        "t.published, t.volume, t.mass, t.capacity, m.parentTypeID, m.metaGroupID "
+        "FROM invtypes t LEFT JOIN invmetatypes m ON m.typeID = t.typeID ORDER BY t.typeID").fetchall()
+    typeRow = dict((r[0], i) for i, r in enumerate(types))
+    add("types.typeID", "i", [r[0] for r in types])
+    add("types.name", "i", [strings.add(r[1]) for r in types])
+    add("types.groupID", "i", [_opt(r[2]) for r in types])
+    add("types.marketGroupID", "i", [_opt(r[3]) for r in types])
+    add("types.iconID", "i", [_opt(r[4]) for r in types])
+    add("types.raceID", "i", [_opt(r[5]) for r in types])
+    add("types.factionID", "i", [_opt(r[6]) for r in types])
+    add("types.published", "b", [1 if r[7] else 0 for r in types])
+    add("types.volume", "d", [r[8] or 0.0 for r in types])
+    add("types.mass", "d", [r[9] or 0.0 for r in types])
+    add("types.capacity", "d", [r[10] or 0.0 for r in types])
+    add("types.parentTypeID", "i", [_opt(r[11]) for r in types])
+    add("types.metaGroupID", "i", [_opt(r[12]) for r in types])
+    add("types.byName", "i", sorted(xrange(len(types)), key=lambda i: unicode(types[i][1] or u"")))
+
+    # Type attributes, sorted by attributeID within each type; NULL values
+    # are left out rather than stored as some number
+    attribs = cursor.execute(
+        "SELECT typeID, attributeID, value FROM dgmtypeattribs WHERE value IS NOT NULL "
+        "ORDER BY typeID, attributeID").fetchall()
+    starts, values = _csr(((r[0], (r[1], r[2])) for r in attribs), len(types), typeRow)
+    add("types.attrStart", "I", starts)
+    add("typeattribs.attributeID", "i", [v[0] for v in values])
+    add("typeattribs.value", "d", [v[1] for v in values])
+
+    # Type effects
+    typeEffects = cursor.execute(
+        "SELECT typeID, effectID FROM dgmtypeeffects ORDER BY typeID, effectID").fetchall()
+    starts, values = _csr(typeEffects, len(types), typeRow)
+    add("types.effectStart", "I", starts)
+    add("typeeffects.effectID", "i", values)
+
+    # Effect definitions, with reverse index effect -> type rows
+    effects = cursor.execute("SELECT effectID, effectName FROM dgmeffects ORDER BY effectID").fetchall()
+    effectRow = dict((r[0], i) for i, r in enumerate(effects))
+    add("effects.effectID", "i", [r[0] for r in effects])
+    add("effects.name", "i", [strings.add(r[1]) for r in effects])
+    starts, values = _csr(((r[1], typeRow[r[0]]) for r in typeEffects if r[0] in typeRow), len(effects), effectRow)
+    add("effects.typeStart", "I", starts)
+    add("effects.types", "i", values)
+
+    # Attribute definitions
+    attrInfos = cursor.execute(
+        "SELECT attributeID, attributeName, displayName, defaultValue, unitID, iconID, highIsGood, published "
+        "FROM dgmattribs ORDER BY attributeID").fetchall()
+    add("attribs.attributeID", "i", [r[0] for r in attrInfos])
+    add("attribs.name", "i", [strings.add(r[1]) for r in attrInfos])
+    add("attribs.displayName", "i", [strings.add(r[2]) for r in attrInfos])
+    add("attribs.defaultValue", "d", [r[3] or 0.0 for r in attrInfos])
+    add("attribs.unitID", "i", [_opt(r[4]) for r in attrInfos])
+    add("attribs.iconID", "i", [_opt(r[5]) for r in attrInfos])
+    add("attribs.highIsGood", "b", [1 if r[6] else 0 for r in attrInfos])
+    add("attribs.published", "b", [1 if r[7] else 0 for r in attrInfos])
+
+    # Groups, with index group -> type rows
+    groups = cursor.execute(
+        "SELECT groupID, groupName, categoryID, published FROM invgroups ORDER BY groupID").fetchall()
+    groupRow = dict((r[0], i) for i, r in enumerate(groups))
+    add("groups.groupID", "i", [r[0] for r in groups])
+    add("groups.name", "i", [strings.add(r[1]) for r in groups])
+    add("groups.categoryID", "i", [_opt(r[2]) for r in groups])
+    add("groups.published", "b", [1 if r[3] else 0 for r in groups])
+    starts, values = _csr(((r[2], i) for i, r in enumerate(types)), len(groups), groupRow)
+    add("groups.typeStart", "I", starts)
+    add("groups.types", "i", values)
+
+    # Categories, with index category -> group rows
+    categories = cursor.execute(
+        "SELECT categoryID, categoryName, published FROM invcategories ORDER BY categoryID").fetchall()
+    categoryRow = dict((r[0], i) for i, r in enumerate(categories))
+    add("categories.categoryID", "i", [r[0] for r in categories])
+    add("categories.name", "i", [strings.add(r[1]) for r in categories])
+    add("categories.published", "b", [1 if r[2] else 0 for r in categories])
+    starts, values = _csr(((r[2], i) for i, r in enumerate(groups)), len(categories), categoryRow)
+    add("categories.groupStart", "I", starts)
+    add("categories.groups", "i", values)
+
+    db.close()
+
+    for typecode, values in strings.columns():
+        add("strings.%s" % ("offsets" if typecode == "I" else "data"), typecode, values)
+
+    _write(outPath, columns)
+
+
+def _write(outPath, columns):
+    # Write into temporary file first so readers never see a half-written snapshot
+    tmpPath = outPath + ".tmp"
+    dataOffset = _HEADER.size + _SECTION.size * len(columns)
+    with open(tmpPath, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(columns)))
+        offset = dataOffset
+        blobs = []
+        for name, typecode, values in columns:
+            if typecode == "c":
+                blob = values
+            else:
+                blob = struct.pack("<%d%s" % (len(values), typecode), *values)
+            # Keep every column 8-byte aligned
+            offset += -offset % 8
+            f.write(_SECTION.pack(name, typecode, offset, len(values)))
+            blobs.append((offset, blob))
+            offset += len(blob)
+        for offset, blob in blobs:
+            f.write("\0" * (offset - f.tell()))
+            f.write(blob)
+    replaceFile(tmpPath, outPath)
@@ -507,6 +507,11 @@ class APIView (wx.Panel):
         self.btnFetchSkills.Bind(wx.EVT_BUTTON, self.fetchSkills)
         self.btnFetchSkills.Enable(False)
 
+        self.btnFetchAll = wx.Button(self, wx.ID_ANY, u"Fetch All Skills")
+        self.btnFetchAll.SetToolTipString(u"Fetch skills of all characters with API details set")
+        btnSizer.Add(self.btnFetchAll, 0, wx.ALL, 2)
+        self.btnFetchAll.Bind(wx.EVT_BUTTON, self.fetchAllSkills)
+
         btnSizer.AddStretchSpacer()
         pmainSizer.Add(btnSizer, 0, wx.EXPAND, 5)
 
@@ -608,6 +613,26 @@ class APIView (wx.Panel):
             except Exception, e:
                 self.stStatus.SetLabel("Unable to retrieve %s\'s skills. Error message:\n%s" % (charName, e))
 
+    def fetchAllSkills(self, event):
+        self.btnFetchAll.Enable(False)
+        self.stStatus.SetLabel("Fetching skills of all API characters...")
+        sChar = service.Character.getInstance()
+        sChar.apiFetchAll(self.fetchAllSkillsCallback)
+
+    def fetchAllSkillsCallback(self, errors):
+        try:
+            self.btnFetchAll.Enable(True)
+            if errors:
+                sChar = service.Character.getInstance()
+                names = ", ".join(sChar.getCharName(charID) for charID in errors)
+                self.stStatus.SetLabel("Unable to retrieve skills of: %s" % names)
+            else:
+                self.stStatus.SetLabel("Successfully fetched skills of all API characters.")
+            wx.PostEvent(self.charEditor, GE.CharListUpdated())
+        except wx._core.PyDeadObjectError:
+            # Character editor got closed while fetching
+            pass
+
 class SaveCharacterAs(wx.Dialog):
 
     def __init__(self, parent, charID):
@@ -482,35 +482,23 @@ class ItemCompare(wx.Panel):
         self.toggleView = 1
         self.stuff = stuff
         self.item = item
-        self.items = sorted(items, key=lambda x: x.attributes['metaLevel'].value if 'metaLevel' in x.attributes else None)
+        items = list(items)
+
+        sMkt = service.Market.getInstance()
+        sAttr = service.Attribute.getInstance()
+        # Base values of every attribute of every item, fetched in one go
+        self.matrix = sMkt.getAttributeMatrix(items)
+
+        metaLevel = sAttr.getAttributeInfo("metaLevel")
+        metaLevelID = metaLevel.ID if metaLevel is not None else None
+        self.items = sorted(items, key=lambda x: self.matrix.get(x.ID, metaLevelID))
         self.attrs = {}
 
-        # get a dict of attrName: attrInfo of all unique attributes across all items
-        for item in self.items:
-            for attr in item.attributes.keys():
-                if item.attributes[attr].info.displayName:
-                    self.attrs[attr] = item.attributes[attr].info
-
-        # Process attributes for items and find ones that differ
-        for attr in self.attrs.keys():
-            value = None
-
-            for item in self.items:
-                # we can automatically break here if this item doesn't have the attribute,
-                # as that means at least one item did
-                if attr not in item.attributes:
-                    break
-
-                # this is the first attribute for the item set, set the initial value
-                if value is None:
-                    value = item.attributes[attr].value
-                    continue
-
-                if attr not in item.attributes or item.attributes[attr].value != value:
-                    break
-            else:
-                # attribute values were all the same, delete
-                del self.attrs[attr]
+        # get a dict of attrName: attrInfo of attributes which differ between items
+        for attrID in self.matrix.varying():
+            info = sAttr.getAttributeInfo(attrID)
+            if info is not None and info.displayName:
+                self.attrs[info.name] = info
 
         self.m_staticline = wx.StaticLine(self, wx.ID_ANY, wx.DefaultPosition, wx.DefaultSize,
                                           wx.LI_HORIZONTAL)
@@ -574,9 +562,9 @@ class ItemCompare(wx.Panel):
         for item in self.items:
             i = self.paramList.InsertStringItem(sys.maxint, item.name)
             for x, attr in enumerate(self.attrs.keys()):
-                if attr in item.attributes:
-                    info = self.attrs[attr]
-                    value = item.attributes[attr].value
+                info = self.attrs[attr]
+                value = self.matrix.get(item.ID, info.ID)
+                if value is not None:
                     if self.toggleView != 1:
                         valueUnit = str(value)
                     if info and info.unit:
@@ -60,6 +60,7 @@ from gui.updateDialog import UpdateDialog
 from gui.builtinViews import *
 
 # import this to access override setting
+import eos.db
 from eos.modifiedAttributeDict import ModifiedAttributeDict
 from eos.db.saveddata.loadDefaultDatabaseValues import DefaultDatabaseValues
 
@@ -124,6 +125,10 @@ class MainFrame(wx.Frame):
 
         MainFrame.__instance = self
 
+        # Deferred saveddata commits run on GUI thread, where changes they commit are made
+        eos.db.setCommitScheduler(lambda delay, func: wx.CallLater(max(1, int(delay * 1000)), func),
+                                  self.OnCommitError)
+
         #Load stored settings (width/height/maximized..)
         self.LoadMainFrameAttribs()
 
@@ -308,6 +313,13 @@ class MainFrame(wx.Frame):
         if page is not None:
             ms.DeletePage(page)
 
+    def OnCommitError(self, error):
+        dlg = wx.MessageDialog(self,
+                               "Could not save latest changes to fits and characters:\n\n%s" % error,
+                               "Error", wx.OK | wx.ICON_ERROR)
+        dlg.ShowModal()
+        dlg.Destroy()
+
     def OnClose(self, event):
         self.UpdateMainFrameAttribs()
 
@@ -320,6 +332,8 @@ class MainFrame(wx.Frame):
 
         # save all teh settingz
         service.SettingsProvider.getInstance().saveAll()
+        # write out database changes which are still waiting for batched commit
+        eos.db.flushPendingCommit()
         event.Skip()
 
     def ExitApp(self, event):
@@ -740,6 +754,7 @@ class MainFrame(wx.Frame):
         sFit = service.Fit.getInstance()
         dlg = wx.FileDialog(self, "Open One Or More Fitting Files",
                     wildcard = "EVE XML fitting files (*.xml)|*.xml|" \
+                                "Compressed fit backups (*.xml.gz)|*.xml.gz|" \
                                 "EFT text fitting files (*.cfg)|*.cfg|" \
                                 "All Files (*)|*",
                     style = wx.FD_OPEN | wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE)
@@ -758,14 +773,16 @@ class MainFrame(wx.Frame):
         defaultFile = "pyfa-fits-%s.xml"%strftime("%Y%m%d_%H%M%S", gmtime())
 
         saveDialog = wx.FileDialog(self, "Save Backup As...",
-                            wildcard = "EVE XML fitting file (*.xml)|*.xml",
+                            wildcard = "EVE XML fitting file (*.xml)|*.xml|" \
+                                       "Compressed EVE XML fitting file (*.xml.gz)|*.xml.gz",
                             style = wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
                             defaultFile=defaultFile)
 
         if saveDialog.ShowModal() == wx.ID_OK:
             filePath = saveDialog.GetPath()
             if '.' not in os.path.basename(filePath):
-                filePath += ".xml"
+                # Per ordering of wildcards above
+                filePath += ".xml.gz" if saveDialog.GetFilterIndex() == 1 else ".xml"
 
             sFit = service.Fit.getInstance()
             max = sFit.countAllFits()
@@ -833,7 +850,7 @@ class MainFrame(wx.Frame):
                 self._openAfterImport(data)
             elif action == -2:
                 dlg = wx.MessageDialog(self,
-                                       "The following error was generated\n\n%s\n\nBe aware that already processed fits were not saved"%data,
+                                       "The following error was generated\n\n%s\n\nBe aware that fits processed before the error have been saved"%data,
                                        "Import Error", wx.OK | wx.ICON_ERROR)
                 if dlg.ShowModal() == wx.ID_OK:
                     return
@@ -282,7 +282,7 @@ class ItemView(d.Display):
                 if self.marketView.ItemHasChildren(sel) is False:
                     sMkt = self.sMkt
                     # Get current market group
-                    mg = sMkt.getMarketGroup(seldata, eager=("items", "items.metaGroup"))
+                    mg = sMkt.getMarketGroup(seldata)
                     # Get all its items
                     items = sMkt.getItemsByMarketGroup(mg)
                 else:
@@ -353,6 +353,7 @@ class ItemView(d.Display):
         realsearch = search.replace("*", "")
         # Re-select market group if search query has zero length
         if len(realsearch) == 0:
+            self.sMkt.cancelSearch()
             self.selectionMade()
             return
         # Show nothing if query is too short
@@ -370,6 +371,8 @@ class ItemView(d.Display):
         if event:
             self.marketBrowser.search.Clear()
 
+        # Results of search still running are of no use anymore
+        self.sMkt.cancelSearch()
         self.marketBrowser.searchMode = False
         self.updateItemStore(set())
         self.setToggles()
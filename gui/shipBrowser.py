@@ -13,6 +13,7 @@ import gui.utils.colorUtils as colorUtils
 import gui.utils.drawUtils as drawUtils
 import gui.utils.animUtils as animUtils
 import gui.utils.animEffects as animEffects
+from gui.utils.numberFormatter import formatAmount
 
 import gui.sfBrowserItem as SFItem
 from gui.contextMenu import ContextMenu
@@ -20,6 +21,9 @@ import gui.utils.fonts as fonts
 
 import service
 import gui.utils.fonts as fonts
+import logging
+
+logger = logging.getLogger(__name__)
 
 FitRenamed, EVT_FIT_RENAMED = wx.lib.newevent.NewEvent()
 FitSelected, EVT_FIT_SELECTED = wx.lib.newevent.NewEvent()
@@ -542,6 +546,55 @@ class NavigationPanel(SFItem.SFBrowserItem):
             wx.PostEvent(self.Parent, Stage1Selected())
 
 
+class FitStatsBar(wx.Panel):
+    """Controls to sort and filter listed fits by their stored stats"""
+    # (label, fitStats column or None for name, descending)
+    SORT_ORDERS = (("Name", None, False),
+                   ("DPS", "dps", True),
+                   ("Volley", "volley", True),
+                   ("EHP", "ehp", True),
+                   ("Price", "price", False))
+
+    def __init__(self, parent):
+        wx.Panel.__init__(self, parent, style=0)
+        self.shipBrowser = parent
+
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        sizer.Add(wx.StaticText(self, wx.ID_ANY, "Sort:"), 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 4)
+        self.sortChoice = wx.Choice(self, wx.ID_ANY, choices=[label for label, column, descending in self.SORT_ORDERS])
+        self.sortChoice.SetSelection(0)
+        sizer.Add(self.sortChoice, 0, wx.ALL, 2)
+
+        self.capStableCheck = wx.CheckBox(self, wx.ID_ANY, "Cap stable")
+        sizer.Add(self.capStableCheck, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 4)
+
+        sizer.Add(wx.StaticText(self, wx.ID_ANY, "Min DPS:"), 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 4)
+        self.minDpsCtrl = wx.SpinCtrl(self, wx.ID_ANY, size=(70, -1), min=0, max=100000, initial=0)
+        sizer.Add(self.minDpsCtrl, 0, wx.ALL, 2)
+
+        self.SetSizer(sizer)
+
+        self.sortChoice.Bind(wx.EVT_CHOICE, self.OnChanged)
+        self.capStableCheck.Bind(wx.EVT_CHECKBOX, self.OnChanged)
+        self.minDpsCtrl.Bind(wx.EVT_SPINCTRL, self.OnChanged)
+
+    def GetOptions(self):
+        """Keyword arguments for Fit.filterFitsByStats"""
+        label, orderBy, descending = self.SORT_ORDERS[self.sortChoice.GetSelection()]
+        return {"orderBy": orderBy,
+                "descending": descending,
+                "capStable": self.capStableCheck.GetValue(),
+                "minDps": self.minDpsCtrl.GetValue()}
+
+    def IsActive(self):
+        options = self.GetOptions()
+        return options["orderBy"] is not None or options["capStable"] or options["minDps"] > 0
+
+    def OnChanged(self, event):
+        self.shipBrowser.RefreshContent()
+        event.Skip()
+
+
 class ShipBrowser(wx.Panel):
     def __init__(self, parent):
         wx.Panel.__init__ (self, parent,style = 0)
@@ -553,8 +606,6 @@ class ShipBrowser(wx.Panel):
         self.lastStage = (0,0)
         self.mainFrame = gui.mainFrame.MainFrame.getInstance()
 
-        self.categoryList=[]
-        self.categoryFitCache = {}
 
         self._stage1Data = -1
         self._stage2Data = -1
@@ -580,6 +631,9 @@ class ShipBrowser(wx.Panel):
 
         self.navpanel = NavigationPanel(self)
         mainSizer.Add(self.navpanel, 0 , wx.EXPAND)
+        self.statsbar = FitStatsBar(self)
+        self.statsbar.Show(False)
+        mainSizer.Add(self.statsbar, 0, wx.EXPAND)
         self.raceselect = RaceSelector(self, layout = layout, animate = False)
         container = wx.BoxSizer(wx.VERTICAL if layout == wx.HORIZONTAL else wx.HORIZONTAL)
 
@@ -603,9 +657,23 @@ class ShipBrowser(wx.Panel):
         self.Bind(EVT_SB_IMPORT_SEL, self.importStage)
 
         self.mainFrame.Bind(GE.FIT_CHANGED, self.RefreshList)
+        # Build ship lists of remaining groups while there's nothing else to do
+        self.Bind(wx.EVT_IDLE, self.OnIdleWarmup)
 
         self.stage1(None)
 
+    def OnIdleWarmup(self, event):
+        try:
+            more = service.Market.getInstance().shipCatalog.warmupStep()
+        except Exception:
+            logger.exception("Could not build ship list")
+            more = False
+        if more:
+            event.RequestMore()
+        else:
+            self.Unbind(wx.EVT_IDLE, handler=self.OnIdleWarmup)
+        event.Skip()
+
     def GetBrowserContainer(self):
         return self.lpane
 
@@ -635,6 +703,40 @@ class ShipBrowser(wx.Panel):
     def GetActiveStage(self):
         return self._activeStage
 
+    def showFitStats(self, fitIDs, refresh=True):
+        """Show stored stats of listed fits, and have outdated ones refreshed in background"""
+        sFit = service.Fit.getInstance()
+        stats = dict((row["fitID"], row) for row in sFit.getFitStats(fitIDs))
+        for widget in self.lpane.GetWidgetList():
+            if isinstance(widget, FitItem) and widget.fitID in stats:
+                widget.SetStats(stats[widget.fitID])
+        if refresh:
+            sFit.refreshFitStats(fitIDs, self.fitStatsRefreshed)
+
+    def fitStatsRefreshed(self, fitIDs):
+        if self.statsbar.IsShown() and self.statsbar.IsActive():
+            # Changed stats may change which fits are listed and their order
+            self.RefreshContent()
+            return
+        listed = set(widget.fitID for widget in self.lpane.GetWidgetList() if isinstance(widget, FitItem))
+        fitIDs = [fitID for fitID in fitIDs if fitID in listed]
+        if fitIDs:
+            self.showFitStats(fitIDs, refresh=False)
+
+    def filterFits(self, fitList):
+        """Sort and filter listed fits, tuples starting with fit ID, as set in stats bar"""
+        if not self.statsbar.IsActive():
+            return fitList
+        sFit = service.Fit.getInstance()
+        fits = dict((fit[0], fit) for fit in fitList)
+        fitIDs = [fit[0] for fit in fitList]
+        return [fits[fitID] for fitID in sFit.filterFitsByStats(fitIDs, **self.statsbar.GetOptions())]
+
+    def ShowFitStatsBar(self, show):
+        if self.statsbar.IsShown() != show:
+            self.statsbar.Show(show)
+            self.Layout()
+
     def GetLastStage(self):
         return self._lastStage
 
@@ -669,28 +771,21 @@ class ShipBrowser(wx.Panel):
 
         self.navpanel.ShowNewFitButton(False)
         self.navpanel.ShowSwitchEmptyGroupsButton(False)
+        self.ShowFitStatsBar(False)
 
-        sMkt = service.Market.getInstance()
-        sFit = service.Fit.getInstance()
+        # Groups and their ships are kept in memory by the catalog, and fit
+        # counts follow fits being saved or deleted
+        catalog = service.Market.getInstance().shipCatalog
         self.lpane.ShowLoading(False)
 
         self.lpane.Freeze()
         self.lpane.RemoveAllChildren()
 
-        if len(self.categoryList) == 0:
-            # set cache of category list
-            self.categoryList = list(sMkt.getShipRoot())
-            self.categoryList.sort(key=lambda ship: ship.name)
-
-            # set map & cache of fittings per category
-            for cat in self.categoryList:
-                self.categoryFitCache[cat.ID] = sFit.groupHasFits(cat.ID)
-
-        for ship in self.categoryList:
-            if self.filterShipsWithNoFits and not self.categoryFitCache[ship.ID]:
+        for groupID, name in catalog.getGroups():
+            if self.filterShipsWithNoFits and not catalog.groupHasFits(groupID):
                 continue
             else:
-                self.lpane.AddWidget(CategoryItem(self.lpane, ship.ID, (ship.name, 0)))
+                self.lpane.AddWidget(CategoryItem(self.lpane, groupID, (name, 0)))
 
         self.navpanel.ShowSwitchEmptyGroupsButton(True)
 
@@ -717,12 +812,11 @@ class ShipBrowser(wx.Panel):
 
         categoryID = self._stage2Data
         ships = list(data[1])
-        sFit = service.Fit.getInstance()
+        fitCounts = service.Market.getInstance().shipCatalog.countFits(categoryID)
 
         ships.sort(key=self.raceNameKey)
         racesList = []
         subRacesFilter = {}
-        t_fits = 0  # total number of fits in this category
 
         for ship in ships:
             if ship.race:
@@ -740,8 +834,7 @@ class ShipBrowser(wx.Panel):
                 break
 
         for ship in ships:
-            fits = sFit.countFitsWithShip(ship.ID)
-            t_fits += fits
+            fits = fitCounts.get(ship.ID, 0)
             filter = subRacesFilter[ship.race] if ship.race else True
 
             if override:
@@ -757,12 +850,6 @@ class ShipBrowser(wx.Panel):
 
         self.raceselect.RebuildRaces(racesList)
 
-        # refresh category cache
-        if t_fits == 0:
-            self.categoryFitCache[categoryID] = False
-        else:
-            self.categoryFitCache[categoryID] = True
-
         self.lpane.ShowLoading(False)
 
         self.lpane.RefreshList()
@@ -787,13 +874,19 @@ class ShipBrowser(wx.Panel):
         self.lpane.RemoveAllChildren()
 
 
-        sMkt = service.Market.getInstance()
-        sMkt.getShipListDelayed(categoryID, self.stage2Callback)
-
         self._stage2Data = categoryID
 
+        sMkt = service.Market.getInstance()
+        ships = sMkt.shipCatalog.getLoadedShips(categoryID)
+        if ships is not None:
+            # Already in memory, no need to go through worker thread
+            self.stage2Callback((categoryID, ships))
+        else:
+            sMkt.getShipListDelayed(categoryID, self.stage2Callback)
+
         self.navpanel.ShowNewFitButton(False)
         self.navpanel.ShowSwitchEmptyGroupsButton(True)
+        self.ShowFitStatsBar(False)
 
     def nameKey(self, info):
         return info[1]
@@ -833,10 +926,9 @@ class ShipBrowser(wx.Panel):
             self.navpanel.gotoStage(stage,data)
             return
 
-        self.categoryFitCache[categoryID] = True
-
         self.navpanel.ShowNewFitButton(True)
         self.navpanel.ShowSwitchEmptyGroupsButton(False)
+        self.ShowFitStatsBar(True)
 
         if self.showRacesFilterInStage2Only:
             self.raceselect.Show(False)
@@ -848,9 +940,16 @@ class ShipBrowser(wx.Panel):
         self._stage3ShipName = shipName
         self._stage3Data = shipID
 
+        # Stats of all fits of ship are looked at, filtered out ones included
+        fitIDs = [fit[0] for fit in fitList]
+        fitList = self.filterFits(fitList)
+
         for ID, name, booster, timestamp in fitList:
             self.lpane.AddWidget(FitItem(self.lpane, ID, (shipName, name, booster, timestamp),shipID))
+        if not fitList:
+            self.lpane.AddWidget(PFStaticText(self.lpane, label = u"No fits match filters."))
 
+        self.showFitStats(fitIDs)
         self.lpane.RefreshList()
         self.lpane.Thaw()
         self.raceselect.RebuildRaces(self.RACE_ORDER)
@@ -861,6 +960,7 @@ class ShipBrowser(wx.Panel):
 
         self.navpanel.ShowNewFitButton(False)
         self.navpanel.ShowSwitchEmptyGroupsButton(False)
+        self.ShowFitStatsBar(True)
 
         if not event.back:
             if self._activeStage != 4:
@@ -881,12 +981,16 @@ class ShipBrowser(wx.Panel):
         if query:
             ships = sMkt.searchShips(query)
             fitList = sFit.searchFits(query)
+            fitIDs = [fit[0] for fit in fitList]
+            fitList = self.filterFits(fitList)
 
             for ship in ships:
-                self.lpane.AddWidget(ShipItem(self.lpane, ship.ID, (ship.name, len(sFit.getFitsWithShip(ship.ID))), ship.race))
+                self.lpane.AddWidget(ShipItem(self.lpane, ship.ID, (ship.name, sFit.countFitsWithShip(ship.ID)), ship.race))
 
             for ID, name, shipID, shipName, booster, timestamp in fitList:
                 self.lpane.AddWidget(FitItem(self.lpane, ID, (shipName, name, booster, timestamp), shipID))
+            if fitIDs:
+                self.showFitStats(fitIDs)
             if len(ships) == 0 and len(fitList) == 0 :
                 self.lpane.AddWidget(PFStaticText(self.lpane, label = u"No matching results."))
             self.lpane.RefreshList(doFocus = False)
@@ -903,6 +1007,7 @@ class ShipBrowser(wx.Panel):
 
         self.navpanel.ShowNewFitButton(False)
         self.navpanel.ShowSwitchEmptyGroupsButton(False)
+        self.ShowFitStatsBar(False)
 
         if getattr(event, "back", False):
             self.browseHist.append((self._activeStage, self.lastdata))
@@ -912,8 +1017,15 @@ class ShipBrowser(wx.Panel):
 
         fits = event.fits
 
+        # Imported fits may be fit summaries rather than fits, look ship names up
+        sMkt = service.Market.getInstance()
+        shipNames = {}
+        for fit in fits:
+            if fit.shipID not in shipNames:
+                shipNames[fit.shipID] = sMkt.getItem(fit.shipID).name
+
         # sort by ship name, then fit name
-        fits.sort(key=lambda fit: (fit.ship.item.name, fit.name))
+        fits.sort(key=lambda fit: (shipNames[fit.shipID], fit.name))
 
         self.lastdata = fits
         self.lpane.Freeze()
@@ -924,11 +1036,11 @@ class ShipBrowser(wx.Panel):
                 self.lpane.AddWidget(FitItem(
                     self.lpane,
                     fit.ID, (
-                        fit.ship.item.name,
+                        shipNames[fit.shipID],
                         fit.name,
                         fit.booster,
                         fit.timestamp),
-                    fit.ship.item.ID))
+                    fit.shipID))
             self.lpane.RefreshList(doFocus=False)
         self.lpane.Thaw()
 
@@ -1527,6 +1639,15 @@ class FitItem(SFItem.SFBrowserItem):
         wx.PostEvent(self.mainFrame, BoosterListUpdated())
         event.Skip()
 
+    def SetStats(self, stats):
+        """Show stored stats of fit, see Fit.getFitStats(), as tooltip"""
+        lines = []
+        for label, key, currency in (("DPS", "dps", False), ("Volley", "volley", False),
+                                     ("EHP", "ehp", False), ("Price", "price", True)):
+            if stats.get(key) is not None:
+                lines.append("%s: %s" % (label, formatAmount(stats[key], 3, 0, 9, currency=currency)))
+        self.SetToolTipString("\n".join(lines))
+
     def OnMouseCaptureLost(self, event):
         ''' Destroy drag information (GH issue #479)'''
         if self.dragging and self.dragged:
@@ -1,7 +1,13 @@
 import threading
 import time
 import service
+import eos.db
+from service.port import Port
 import wx
+import logging
+from utils.fileutils import replaceFile
+
+logger = logging.getLogger(__name__)
 
 class exportHtml():
     _instance = None
@@ -14,20 +20,50 @@ class exportHtml():
 
     def __init__(self):
         self.thread = exportHtmlThread()
+        # Kept across exports so only fits changed since are exported again:
+        # {fitID: (fit revision, DNA string or None if fit can't be exported)}
+        self.dnaCache = {}
+        # {(fitID, fit revision): (layout, HTML of the fit's entry)}
+        self.fragmentCache = {}
+        # Each export thread works on copies of caches and hands them back
+        # when done, as a stopped thread may still be running
+        self.cacheLock = threading.Lock()
 
     def refreshFittingHtml(self, force=False, callback=False):
         settings = service.settings.HTMLExportSettings.getInstance()
 
         if force or settings.getEnabled():
+            if eos.db.commitPending():
+                # Export reads fits through a session of its own, which only
+                # sees changes once they are committed; commit them here on
+                # GUI thread rather than from export thread
+                try:
+                    eos.db.flushPendingCommit()
+                except Exception:
+                    logger.exception("Could not commit changes before HTML export")
             self.thread.stop()
-            self.thread = exportHtmlThread(callback)
+            self.thread = exportHtmlThread(callback, self)
             self.thread.start()
 
+    def getCaches(self):
+        with self.cacheLock:
+            return dict(self.dnaCache), dict(self.fragmentCache)
+
+    def storeCaches(self, dnaCache, fragmentCache):
+        with self.cacheLock:
+            self.dnaCache = dnaCache
+            self.fragmentCache = fragmentCache
+
 class exportHtmlThread(threading.Thread):
 
-    def __init__(self, callback=False):
+    def __init__(self, callback=False, exporter=None):
         threading.Thread.__init__(self)
         self.callback = callback
+        self.exporter = exporter
+        self.dnaCache = {}
+        self.fragmentCache = {}
+        # Fragments used by this export, which become the cache afterwards
+        self.fragments = {}
         self.stopRunning = False
 
     def stop(self):
@@ -39,6 +75,9 @@ class exportHtmlThread(threading.Thread):
         if self.stopRunning:
             return
 
+        if self.exporter is not None:
+            self.dnaCache, self.fragmentCache = self.exporter.getCaches()
+
         sMkt = service.Market.getInstance()
         sFit = service.Fit.getInstance()
         settings = service.settings.HTMLExportSettings.getInstance()
@@ -53,25 +92,113 @@ class exportHtmlThread(threading.Thread):
         elif website == "null-sec.com":
             dnaUrl = "https://null-sec.com/hangar/?dna="
         
+        groups = self.collectFits(sMkt, sFit)
+        if not self.updateDna(sFit, [fit[0] for group, ships in groups for ship, fits in ships for fit in fits]):
+            return
+
         if minimal:
-            HTML = self.generateMinimalHTML(sMkt,sFit, dnaUrl)
+            HTML = self.generateMinimalHTML(groups, dnaUrl)
         else:
-            HTML = self.generateFullHTML(sMkt,sFit, dnaUrl)
+            HTML = self.generateFullHTML(groups, dnaUrl)
+        if HTML is None:
+            return
 
-        try:
-            FILE = open(settings.getPath(), "w")
-            FILE.write(HTML.encode('utf-8'))
-            FILE.close()
-        except IOError:
-            print "Failed to write to " + settings.getPath()
-            pass
+        if self.exporter is not None:
+            self.exporter.storeCaches(self.dnaCache, self.fragments)
+
+        self.writeFile(settings.getPath(), HTML.encode('utf-8'))
 
         if self.callback:
             wx.CallAfter(self.callback, -1)
 
+    def collectFits(self, sMkt, sFit):
+        """
+        List market groups of ships which have fits, as (group, [(ship, fits)])
+        sorted by name, fits as given by sFit.getFitsWithShip. Fit listings
+        come from memory, no fits are loaded.
+        """
+        categoryList = list(sMkt.getShipRoot())
+        categoryList.sort(key=lambda ship: ship.name)
 
+        groups = []
+        for group in categoryList:
+            ships = list(sMkt.shipCatalog.getShips(group.ID))
+            ships.sort(key=lambda ship: ship.name)
 
-    def generateFullHTML(self,sMkt,sFit,dnaUrl):
+            shipFits = []
+            for ship in ships:
+                fits = sFit.getFitsWithShip(ship.ID)
+                if len(fits) > 0:
+                    shipFits.append((ship, fits))
+            if shipFits:
+                groups.append((group, shipFits))
+        return groups
+
+    def updateDna(self, sFit, fitIDs):
+        """
+        Export DNA of fits which changed since they were last exported, or
+        weren't yet. Returns False if export got stopped meanwhile.
+        """
+        cache = self.dnaCache
+        # Take revisions before reading fits: should a fit change meanwhile,
+        # it is just exported again next time
+        revisions = eos.db.getFitRevisions(fitIDs)
+        for fitID in set(cache).difference(revisions):
+            cache.pop(fitID, None)
+        stale = [fitID for fitID in fitIDs if cache.get(fitID, (None,))[0] != revisions[fitID]]
+        if not stale:
+            return True
+
+        # Read fits through read-only session of our own, so export sees one
+        # consistent state and doesn't hold up fitting
+        with eos.db.snapshotSession():
+            for fit in sFit.iterFits(stale):
+                if self.stopRunning:
+                    return False
+                try:
+                    dna = Port.exportDna(fit)
+                except:
+                    dna = None
+                cache[fit.ID] = (revisions[fit.ID], dna)
+        # Fits which could not be loaded at all
+        for fitID in stale:
+            if fitID not in cache or cache[fitID][0] != revisions[fitID]:
+                cache[fitID] = (revisions[fitID], None)
+        return True
+
+    def getDna(self, fitID):
+        return self.dnaCache.get(fitID, (None, None))[1]
+
+    def getFragment(self, fitID, layout, render):
+        """
+        HTML of entry of fit, as rendered by render(dna) for given layout;
+        rendered again only if fit changed since or layout differs. Empty
+        if fit can't be exported.
+        """
+        revision, dna = self.dnaCache.get(fitID, (None, None))
+        key = (fitID, revision)
+        cached = self.fragmentCache.get(key)
+        if cached is None or cached[0] != layout:
+            cached = (layout, render(dna) if dna is not None else '')
+        self.fragments[key] = cached
+        return cached[1]
+
+    def writeFile(self, path, data):
+        # Write into temporary file and swap it in, so the browser never
+        # sees a half-written page
+        tmpPath = path + ".tmp"
+        try:
+            FILE = open(tmpPath, "wb")
+            FILE.write(data)
+            FILE.close()
+            replaceFile(tmpPath, path)
+        except (IOError, OSError):
+            print "Failed to write to " + path
+            pass
+
+
+
+    def generateFullHTML(self, groups, dnaUrl):
         """ Generate the complete HTML with styling and javascript """
         timestamp = time.localtime(time.time())
         localDate = "%d/%02d/%02d %02d:%02d" % (timestamp[0], timestamp[1], timestamp[2], timestamp[3], timestamp[4])
@@ -170,117 +297,83 @@ class exportHtmlThread(threading.Thread):
   <div style="text-align: center;"><strong>Last updated:</strong> %s <small>(<span class="timer"></span>)</small></div>
 
 """ % (time.time(), dnaUrl, localDate)
-        HTML += '  <ul data-role="listview" class="ui-listview-outer" data-inset="true" data-filter="true">\n'
-        categoryList = list(sMkt.getShipRoot())
-        categoryList.sort(key=lambda ship: ship.name)
-
+        parts = [HTML, '  <ul data-role="listview" class="ui-listview-outer" data-inset="true" data-filter="true">\n']
         count = 0
 
-        for group in categoryList:
-            # init market group string to give ships something to attach to
-            HTMLgroup = ''
-
-            ships = list(sMkt.getShipList(group.ID))
-            ships.sort(key=lambda ship: ship.name)
+        for group, shipFits in groups:
+            # init market group parts to give ships something to attach to
+            groupParts = []
 
             # Keep track of how many ships per group
             groupFits = 0
-            for ship in ships:
-                fits = sFit.getFitsWithShip(ship.ID)
-                if len(fits) > 0:
-                    groupFits += len(fits)
+            for ship, fits in shipFits:
+                groupFits += len(fits)
 
-                    if len(fits) == 1:
+                if len(fits) == 1:
+                    if self.stopRunning:
+                        return
+                    fit = fits[0]
+                    groupParts.append(self.getFragment(fit[0], "single", lambda dna:
+                        '        <li><a data-dna="' + dna + '" target="_blank">' + ship.name + ": " + fit[1] + '</a></li>\n'))
+                    if self.callback:
+                        wx.CallAfter(self.callback, count)
+                    count += 1
+                else:
+                    # Ship group header
+                    groupParts.append(
+                    '        <li data-role="collapsible" data-iconpos="right" data-shadow="false" data-corners="false">\n'
+                    '        <h2>' + ship.name + ' <span class="ui-li-count">'+str(len(fits))+'</span></h2>\n'
+                    '          <ul data-role="listview" data-shadow="false" data-inset="true" data-corners="false">\n')
+
+                    for fit in fits:
                         if self.stopRunning:
                             return
-                        fit = fits[0]
-                        try:
-                            dnaFit = sFit.exportDna(fit[0])
-                            HTMLgroup += (
-                            '        <li><a data-dna="' + dnaFit + '" target="_blank">' + ship.name + ": " + fit[1] + '</a></li>\n')
-                        except:
-                            pass
-                        finally:
-                            if self.callback:
-                                wx.CallAfter(self.callback, count)
-                            count += 1
-                    else:
-                        # Ship group header
-                        HTMLship = (
-                        '        <li data-role="collapsible" data-iconpos="right" data-shadow="false" data-corners="false">\n'
-                        '        <h2>' + ship.name + ' <span class="ui-li-count">'+str(len(fits))+'</span></h2>\n'
-                        '          <ul data-role="listview" data-shadow="false" data-inset="true" data-corners="false">\n')
-
-                        for fit in fits:
-                            if self.stopRunning:
-                                return
-                            try:
-                                dnaFit = sFit.exportDna(fit[0])
-                                HTMLship += '          <li><a data-dna="' + dnaFit + '" target="_blank">' + fit[1] + '</a></li>\n'
-                            except:
-                                continue
-                            finally:
-                                if self.callback:
-                                    wx.CallAfter(self.callback, count)
-                                count += 1
-                        HTMLgroup += HTMLship + ('          </ul>\n'
-                                                 '        </li>\n')
+                        groupParts.append(self.getFragment(fit[0], "grouped", lambda dna:
+                            '          <li><a data-dna="' + dna + '" target="_blank">' + fit[1] + '</a></li>\n'))
+                        if self.callback:
+                            wx.CallAfter(self.callback, count)
+                        count += 1
+                    groupParts.append('          </ul>\n'
+                                      '        </li>\n')
 
             if groupFits > 0:
                 # Market group header
-                HTML += (
+                parts.append(
                 '    <li data-role="collapsible" data-iconpos="right" data-shadow="false" data-corners="false">\n'
                 '      <h2>' + group.groupName + ' <span class="ui-li-count">'+str(groupFits)+'</span></h2>\n'
-                '      <ul data-role="listview" data-shadow="false" data-inset="true" data-corners="false">\n'
-                + HTMLgroup +
+                '      <ul data-role="listview" data-shadow="false" data-inset="true" data-corners="false">\n')
+                parts.extend(groupParts)
+                parts.append(
                 '      </ul>\n'
                 '    </li>')
 
-        HTML += """
+        parts.append("""
   </ul>
  </div>
 </div>
 </body>
-</html>"""        
+</html>""")
 
 
-        return HTML
+        return ''.join(parts)
         
         
         
         
-    def generateMinimalHTML(self,sMkt,sFit,dnaUrl):
+    def generateMinimalHTML(self, groups, dnaUrl):
         """ Generate a minimal HTML version of the fittings, without any javascript or styling"""
-        categoryList = list(sMkt.getShipRoot())
-        categoryList.sort(key=lambda ship: ship.name)
-
         count = 0
-        HTML = ''
-        for group in categoryList:
-            # init market group string to give ships something to attach to
-            
-
-            ships = list(sMkt.getShipList(group.ID))
-            ships.sort(key=lambda ship: ship.name)
-
-            ships.sort(key=lambda ship: ship.name)
-
-            for ship in ships:
-                fits = sFit.getFitsWithShip(ship.ID)
+        parts = []
+        for group, shipFits in groups:
+            for ship, fits in shipFits:
                 for fit in fits:
                     if self.stopRunning:
                         return
-                    try:
-                        dnaFit = sFit.exportDna(fit[0])                  
-                        HTML += '<a class="inGameBrowserLink" target="_blank" href=javascript:CCPEVE.showFitting("'+dnaFit+'");>IGB</a>' +\
-								' / <a class="outOfGameBrowserLink" target="_blank" href="' + dnaUrl + dnaFit + '">OOGB</a>    '+ship.name +': '+ fit[1]+ '<br> \n'
-                    except:
-                        continue
-                    finally:
-                        if self.callback:
-                            wx.CallAfter(self.callback, count)
-                        count += 1
-        return HTML;
-                 
-    
-        
+                    # Links depend on website, render again when it changes
+                    parts.append(self.getFragment(fit[0], ("minimal", dnaUrl), lambda dna:
+                        '<a class="inGameBrowserLink" target="_blank" href=javascript:CCPEVE.showFitting("'+dna+'");>IGB</a>' +
+                        ' / <a class="outOfGameBrowserLink" target="_blank" href="' + dnaUrl + dna + '">OOGB</a>    '+ship.name +': '+ fit[1]+ '<br> \n'))
+                    if self.callback:
+                        wx.CallAfter(self.callback, count)
+                    count += 1
+        return ''.join(parts)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#======================================================================
+# Copyright (C) 2012 Diego Duclos
+#
+# This file is part of eos.
+#
+# eos is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# eos is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with eos.  If not, see <http://www.gnu.org/licenses/>.
+#======================================================================
+
+'''
+Exports eve.db into the compact memory-mapped gamedata snapshot
+(eve.snap) which is loaded by eos.db when it matches the client build.
+'''
+
+import os
+import sys
+import argparse
+
+# Add eos root path to sys.path so we can import ourselves
+path = os.path.dirname(unicode(__file__, sys.getfilesystemencoding()))
+sys.path.append(os.path.realpath(os.path.join(path, "..")))
+
+import eos.snapshot
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(__file__)
+    default_db = os.path.join(script_dir, "..", "eve.db")
+    default_out = os.path.join(script_dir, "..", "eve.snap")
+
+    parser = argparse.ArgumentParser(description="Export gamedata database into memory-mapped snapshot")
+    parser.add_argument("-d", "--db", default=default_db, type=str, help="path to eve.db, default: %(default)s")
+    parser.add_argument("-o", "--out", default=default_out, type=str, help="path to snapshot file, default: %(default)s")
+    args = parser.parse_args()
+
+    eos.snapshot.build(os.path.expanduser(args.db), os.path.expanduser(args.out))
+    snapshot = eos.snapshot.Snapshot(os.path.expanduser(args.out))
+    print "Exported {0} types for client build {1}".format(snapshot.itemCount(), snapshot.clientBuild)
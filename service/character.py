@@ -20,11 +20,14 @@
 import copy
 import itertools
 import json
+import os
 import threading
+import time
 from codecs import open
 from xml.etree import ElementTree
 from xml.dom import minidom
 import gzip
+from multiprocessing.pool import ThreadPool
 
 import wx
 
@@ -33,9 +36,42 @@ import eos.types
 import service
 import config
 import logging
+from eos.db.cache import QueryCache
+from service.pycrest.eve import FileCache
 
 logger = logging.getLogger(__name__)
 
+# Max amount of characters fetched from EVE API at once by apiFetchAll
+API_WORKERS = 4
+
+class ApiCache(object):
+    """
+    eveapi cache handler, see service.eveapi.EVEAPIConnection. Raw XML
+    responses are kept on disk until their cachedUntil, in a file cache
+    bounded like the CREST one.
+    """
+
+    def __init__(self, path):
+        self.files = FileCache(path, maxEntries=500, maxSize=16 * 1024 * 1024)
+
+    def __key(self, host, path, params):
+        return (host, path, frozenset((key, unicode(value)) for key, value in params.iteritems()))
+
+    def retrieve(self, host, path, params):
+        cached = self.files.get(self.__key(host, path, params))
+        if cached is None:
+            return None
+        return cached["xml"].encode("utf-8")
+
+    def store(self, host, path, params, doc, obj):
+        # Server clock may differ from ours, keep it for as long as server says
+        expires = obj.cachedUntil - obj.currentTime
+        if expires <= 0:
+            return
+        if not isinstance(doc, unicode):
+            doc = doc.decode("utf-8")
+        self.files.put(self.__key(host, path, params), {"xml": doc, "cached_until": time.time() + expires})
+
 class CharacterImportThread(threading.Thread):
     def __init__(self, paths, callback):
         threading.Thread.__init__(self)
@@ -43,6 +79,13 @@ class CharacterImportThread(threading.Thread):
         self.callback = callback
 
     def run(self):
+        # Characters are created through session of our own, not to hold up fitting
+        with eos.db.threadSession():
+            self.importCharacters()
+
+        wx.CallAfter(self.callback)
+
+    def importCharacters(self):
         paths = self.paths
         sCharacter = Character.getInstance()
         for path in paths:
@@ -74,7 +117,33 @@ class CharacterImportThread(threading.Thread):
                     print e.message
                     continue
 
-        wx.CallAfter(self.callback)
+class CharacterFetchThread(threading.Thread):
+    """Fetches skills of characters from EVE API, see Character.apiFetchAll"""
+    def __init__(self, chars, callback):
+        threading.Thread.__init__(self)
+        # [(characterID, apiID, apiKey, character name)]
+        self.chars = chars
+        self.callback = callback
+
+    def run(self):
+        sCharacter = Character.getInstance()
+
+        def fetch(details):
+            charID, apiID, apiKey, charName = details
+            try:
+                return charID, sCharacter.apiFetchSkills(apiID, apiKey, charName), None
+            except Exception, e:
+                logger.warning("Could not fetch skills of %s: %s", charName, e)
+                return charID, None, e
+
+        pool = ThreadPool(min(API_WORKERS, len(self.chars)))
+        try:
+            results = pool.map(fetch, self.chars)
+        finally:
+            pool.close()
+
+        # Characters are owned by the GUI thread session, update them there
+        wx.CallAfter(sCharacter.apiUpdateFetched, results, self.callback)
 
 class SkillBackupThread(threading.Thread):
     def __init__(self, path, saveFmt, activeFit, callback):
@@ -119,6 +188,17 @@ class Character(object):
         # Simply initializes default characters in case they aren't in the database yet
         self.all0()
         self.all5()
+        # Shared by connections of all threads, see apiFetchAll()
+        self.__apiCache = ApiCache(os.path.join(config.savePath, "api_cache"))
+        # {typeID: ((skill, level), ...)}, see getSkillClosure()
+        self.__skillClosures = {}
+        self.__skillClosuresLock = threading.RLock()
+        # Results of checkRequirements() by character skills and fit items
+        self.__requirements = QueryCache("character.requirements", 100)
+
+    def getApiConnection(self):
+        """EVE API connection which caches responses on disk, see ApiCache"""
+        return service.EVEAPIConnection(cacheHandler=self.__apiCache)
 
     def exportText(self):
         data  = "Pyfa exported plan for \""+self.skillReqsDict['charname']+"\"\n"
@@ -284,7 +364,7 @@ class Character(object):
         char.apiID = userID
         char.apiKey = apiKey
 
-        api = service.EVEAPIConnection()
+        api = self.getApiConnection()
         auth = api.auth(keyID=userID, vCode=apiKey)
         apiResult = auth.account.Characters()
         charList = map(lambda c: unicode(c.name), apiResult.characters)
@@ -292,12 +372,14 @@ class Character(object):
         char.chars = json.dumps(charList)
         return charList
 
-    def apiFetch(self, charID, charName):
-        dbChar = eos.db.getCharacter(charID)
-        dbChar.defaultChar = charName
-
-        api = service.EVEAPIConnection()
-        auth = api.auth(keyID=dbChar.apiID, vCode=dbChar.apiKey)
+    def apiFetchSkills(self, apiID, apiKey, charName):
+        """
+        Return skill rows of character sheet of charName from EVE API, None
+        if API key has no such character. Needs no database, so it's safe to
+        call from any thread.
+        """
+        api = self.getApiConnection()
+        auth = api.auth(keyID=apiID, vCode=apiKey)
         apiResult = auth.account.Characters()
         charID = None
         for char in apiResult.characters:
@@ -305,13 +387,53 @@ class Character(object):
                 charID = char.characterID
 
         if charID == None:
-            return
+            return None
 
         sheet = auth.character(charID).CharacterSheet()
+        return sheet.skills
 
-        dbChar.apiUpdateCharSheet(sheet.skills)
+    def apiFetch(self, charID, charName):
+        dbChar = eos.db.getCharacter(charID)
+        dbChar.defaultChar = charName
+
+        skills = self.apiFetchSkills(dbChar.apiID, dbChar.apiKey, charName)
+        if skills is None:
+            return
+
+        dbChar.apiUpdateCharSheet(skills)
         eos.db.commit()
 
+    def apiFetchAll(self, callback):
+        """
+        Refresh skills of all characters with API details set. Character
+        sheets are fetched concurrently in the background, then all skills
+        are updated and committed at once on the GUI thread. Callback gets
+        {characterID: error} of characters which couldn't be refreshed.
+        """
+        chars = [(char.ID, char.apiID, char.apiKey, char.defaultChar) for char in eos.db.getCharacterList()
+                 if char.apiID and char.apiKey and char.defaultChar]
+        if not chars:
+            wx.CallAfter(callback, {})
+            return
+        thread = CharacterFetchThread(chars, callback)
+        thread.start()
+
+    def apiUpdateFetched(self, results, callback):
+        errors = {}
+        updated = False
+        for charID, skills, error in results:
+            if error is not None:
+                errors[charID] = error
+            elif skills is not None:
+                char = eos.db.getCharacter(charID)
+                # May have been deleted while fetching
+                if char is not None:
+                    char.apiUpdateCharSheet(skills)
+                    updated = True
+        if updated:
+            eos.db.commit()
+        callback(errors)
+
     def apiUpdateCharSheet(self, charID, skills):
         char = eos.db.getCharacter(charID)
         char.apiUpdateCharSheet(skills)
@@ -360,8 +482,14 @@ class Character(object):
         return char.implants
 
     def checkRequirements(self, fit):
-        toCheck = []
-        reqs = {}
+        """
+        Return {item: {skill name: (level, skill ID, {...})}} of items on fit
+        whose skill requirements fit's character doesn't meet, nested by
+        skills' own requirements. Results are cached by character's skills
+        revision and fit's items, and shouldn't be changed by callers.
+        """
+        char = fit.character
+        things = []
         for thing in itertools.chain(fit.modules, fit.drones, fit.fighters, (fit.ship,)):
             if isinstance(thing, eos.types.Module) and thing.slot == eos.types.Slot.RIG:
                 continue
@@ -371,16 +499,52 @@ class Character(object):
                     # These have skill requirements attached, but aren't used in EVE.
                     continue
                 subThing = getattr(thing, attr, None)
-                subReqs = {}
                 if subThing is not None:
                     if isinstance(thing, eos.types.Fighter) and attr == "charge":
                         continue
-                    self._checkRequirements(fit, fit.character, subThing, subReqs)
-                    if subReqs:
-                        reqs[subThing] = subReqs
+                    things.append(subThing)
+
+        key = (char.skillsRevision if char is not None else None, frozenset(subThing.ID for subThing in things))
+        reqs = self.__requirements.get(key, None)
+        if reqs is None:
+            reqs = {}
+            for subThing in things:
+                # Most items' requirements are all met, which is told from
+                # skill closure alone; only others need the full tree
+                if char is not None and all(char.getSkill(req).level >= level
+                                            for req, level in self.getSkillClosure(subThing)):
+                    continue
+                subReqs = {}
+                self._checkRequirements(fit, char, subThing, subReqs)
+                if subReqs:
+                    reqs[subThing] = subReqs
+            self.__requirements.set(key, reqs)
 
         return reqs
 
+    def getSkillClosure(self, item):
+        """
+        Return all skills item requires, directly or through requirements of
+        required skills, as ((skill, level), ...) with highest level needed
+        of each. Built once per item, gamedata doesn't change while running.
+        """
+        closure = self.__skillClosures.get(item.ID)
+        if closure is None:
+            with self.__skillClosuresLock:
+                closure = self.__skillClosures.get(item.ID)
+                if closure is not None:
+                    return closure
+                # Guard against loops in requirements
+                self.__skillClosures[item.ID] = ()
+                skills = {}
+                for req, level in item.requiredSkills.iteritems():
+                    for skill, skillLevel in itertools.chain(((req, level),), self.getSkillClosure(req)):
+                        known = skills.get(skill.ID)
+                        if known is None or skillLevel > known[1]:
+                            skills[skill.ID] = (skill, skillLevel)
+                self.__skillClosures[item.ID] = closure = tuple(skills.itervalues())
+        return closure
+
     def _checkRequirements(self, fit, char, subThing, reqs):
         for req, level in subThing.requiredSkills.iteritems():
             name = req.name
@@ -1,4 +1,5 @@
 import wx
+import os
 import thread
 import logging
 import threading
@@ -6,6 +7,7 @@ import copy
 import uuid
 import time
 
+import config
 import eos.db
 from eos.enum import Enum
 from eos.types import CrestChar
@@ -77,7 +79,9 @@ class Crest():
             client_id=self.settings.get('clientID') if self.settings.get('mode') == CrestModes.USER else self.clientIDs.get(self.settings.get('server')),
             api_key=self.settings.get('clientSecret') if self.settings.get('mode') == CrestModes.USER else None,
             redirect_uri=self.clientCallback,
-            testing=self.isTestServer
+            testing=self.isTestServer,
+            # Responses are kept on disk, shared by copies made for characters
+            cache_dir=os.path.join(config.savePath, "crest_cache")
         )
 
         self.implicitCharacter = None
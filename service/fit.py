@@ -17,17 +17,22 @@
 # along with pyfa.  If not, see <http://www.gnu.org/licenses/>.
 # ===============================================================================
 
-import locale
+import os
+import io
+import gzip
 import copy
 import threading
+import collections
+import time
 import logging
 import wx
-from codecs import open
 
 import xml.parsers.expat
+from xml.etree.cElementTree import ParseError
 
 import eos.db
 import eos.types
+from eos.db.saveddata.summary import FitSummary
 
 from eos.types import State, Slot
 
@@ -40,6 +45,11 @@ from service.port import Port
 
 logger = logging.getLogger(__name__)
 
+# Imported fits are saved in transactions of this many
+IMPORT_BATCH_SIZE = 100
+# Bulk exports load fits and their gamedata in chunks of this many
+EXPORT_CHUNK_SIZE = 200
+
 
 class FitBackupThread(threading.Thread):
     def __init__(self, path, callback):
@@ -50,11 +60,10 @@ class FitBackupThread(threading.Thread):
     def run(self):
         path = self.path
         sFit = Fit.getInstance()
-        allFits = map(lambda x: x[0], sFit.getAllFits())
-        backedUpFits = sFit.exportXml(self.callback, *allFits)
-        backupFile = open(path, "w", encoding="utf-8")
-        backupFile.write(backedUpFits)
-        backupFile.close()
+        # Read-only session of our own: consistent backup, and fitting goes on meanwhile
+        with eos.db.snapshotSession():
+            fitIDs = [summary.ID for summary in eos.db.getFitSummaries()]
+            sFit.exportFitsToFile(path, fitIDs, "XML", callback=self.callback)
 
         # Send done signal to GUI
         wx.CallAfter(self.callback, -1)
@@ -68,7 +77,9 @@ class FitImportThread(threading.Thread):
 
     def run(self):
         sFit = Fit.getInstance()
-        success, result = sFit.importFitFromFiles(self.paths, self.callback)
+        # Save imported fits through session of our own, not to hold up fitting
+        with eos.db.threadSession():
+            success, result = sFit.importFitFromFiles(self.paths, self.callback)
 
         if not success:  # there was an error during processing
             logger.error("Error while processing file import: %s", result)
@@ -77,6 +88,56 @@ class FitImportThread(threading.Thread):
             wx.CallAfter(self.callback, -1, result)
 
 
+class FitStatsRefreshThread(threading.Thread):
+    """
+    Recalculates given fits, found stale or edited by Fit.refreshFitStats().
+    Fits are loaded through a read-only session of our own and stats written
+    through another, so shared session used for fitting is never touched.
+    """
+    def __init__(self, queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        # {fitID: set of callbacks}, for Fit.fitStatsRefreshed()
+        self.queue = queue
+        self.fitIDs = queue.keys()
+
+    def run(self):
+        sFit = Fit.getInstance()
+        try:
+            with eos.db.threadSession():
+                eos.db.deleteOrphanFitStats()
+                eos.db.commit()
+        except Exception:
+            logger.exception("Could not drop stats of deleted fits")
+
+        staleIDs = self.fitIDs
+        changed = False
+        for i in xrange(0, len(staleIDs), EXPORT_CHUNK_SIZE):
+            chunk = staleIDs[i:i + EXPORT_CHUNK_SIZE]
+            stats = []
+            with eos.db.snapshotSession():
+                for fit in sFit.iterFits(chunk):
+                    if fit.isInvalid:
+                        continue
+                    try:
+                        fit.calculateModifiedAttributes(withBoosters=False)
+                        stats.append(sFit.getFitStatsValues(fit))
+                    except Exception:
+                        logger.exception("Could not refresh stats of fit %d", fit.ID)
+                    # Give way to GUI thread between fits
+                    time.sleep(0.01)
+            try:
+                with eos.db.threadSession():
+                    for values in stats:
+                        if eos.db.saveFitStats(**values):
+                            changed = True
+                    eos.db.commit()
+            except Exception:
+                logger.exception("Could not store fit stats")
+
+        wx.CallAfter(sFit.fitStatsRefreshed, self, changed)
+
+
 class Fit(object):
     instance = None
 
@@ -93,6 +154,9 @@ class Fit(object):
         self.character = Character.getInstance().all5()
         self.booster = False
         self.dirtyFitIDs = set()
+        self.fitStatsThread = None
+        self.fitStatsQueue = collections.OrderedDict()
+        self.fitStatsEdited = set()
 
         serviceFittingDefaultOptions = {
             "useGlobalCharacter": False,
@@ -121,7 +185,7 @@ class Fit(object):
 
     def getFitsWithShip(self, shipID):
         """ Lists fits of shipID, used with shipBrowser """
-        fits = eos.db.getFitsWithShip(shipID)
+        fits = eos.db.getFitSummaries(shipID=shipID)
         names = []
         for fit in fits:
             names.append((fit.ID, fit.name, fit.booster, fit.timestamp))
@@ -130,7 +194,7 @@ class Fit(object):
 
     def getBoosterFits(self):
         """ Lists fits flagged as booster """
-        fits = eos.db.getBoosterFits()
+        fits = eos.db.getFitSummaries(booster=True)
         names = []
         for fit in fits:
             names.append((fit.ID, fit.name, fit.shipID))
@@ -141,17 +205,12 @@ class Fit(object):
         return eos.db.countAllFits()
 
     def countFitsWithShip(self, shipID):
-        count = eos.db.countFitsWithShip(shipID)
+        count = eos.db.countFitsWithShips((shipID,))
         return count
 
     def groupHasFits(self, groupID):
-        sMkt = Market.getInstance()
-        grp = sMkt.getGroup(groupID)
-        items = sMkt.getItemsByGroup(grp)
-        for item in items:
-            if self.countFitsWithShip(item.ID) > 0:
-                return True
-        return False
+        # Market may move ships between groups, so ask by its ship list rather than by group ID
+        return Market.getInstance().shipCatalog.groupHasFits(groupID)
 
     def getModule(self, fitID, pos):
         fit = eos.db.getFit(fitID)
@@ -243,6 +302,13 @@ class Fit(object):
         '''
         if fitID is None:
             return None
+
+        prefetched = None
+        if not basic and not eos.db.isFitLoaded(fitID):
+            # Load gamedata for the fit and its projected fits in a few batched
+            # queries, instead of item by item as fit gets reconstructed
+            prefetched = eos.db.prefetchFitItems((fitID,))
+
         fit = eos.db.getFit(fitID)
 
         if basic:
@@ -922,9 +988,60 @@ class Fit(object):
         return Port.exportCrest(fit, callback)
 
     def exportXml(self, callback=None, *fitIDs):
+        # Keep gamedata of all exported fits loaded while we go through them
+        prefetched = eos.db.prefetchFitItems(fitIDs)
         fits = map(lambda fitID: eos.db.getFit(fitID), fitIDs)
         return Port.exportXml(callback, *fits)
 
+    def iterFits(self, fitIDs, chunkSize=EXPORT_CHUNK_SIZE):
+        """
+        Yield fits with given IDs, in that order, for exporting. Fits and
+        gamedata they use are loaded a chunk at a time in a few batched
+        queries, and only the current chunk is kept loaded.
+        """
+        fitIDs = list(fitIDs)
+        for i in xrange(0, len(fitIDs), chunkSize):
+            chunk = fitIDs[i:i + chunkSize]
+            prefetched = eos.db.prefetchFitItems(chunk, projected=False)
+            fits = eos.db.getFits(chunk)
+            for fitID in chunk:
+                fit = fits.pop(fitID, None)
+                if fit is not None:
+                    yield fit
+            del prefetched
+
+    def exportFitsToFile(self, path, fitIDs, format="XML", compress=None, callback=None):
+        """
+        Export fits to file at path, streaming them one by one, see
+        Port.exportFits(). Output is gzip compressed if compress is set, or
+        if it's None and path ends with .gz. File is written under temporary
+        name and renamed once complete, so a failed export leaves no partial
+        file behind.
+        """
+        if compress is None:
+            compress = path.lower().endswith(".gz")
+        tmpPath = path + ".tmp"
+        try:
+            with io.open(tmpPath, "wb") as file:
+                if compress:
+                    # Name stored inside archive, the file it unpacks into
+                    name = os.path.basename(path)
+                    if name.lower().endswith(".gz"):
+                        name = name[:-3]
+                    stream = gzip.GzipFile(filename=name, mode="wb", fileobj=file)
+                    try:
+                        Port.exportFits(stream, self.iterFits(fitIDs), format, callback)
+                    finally:
+                        stream.close()
+                else:
+                    Port.exportFits(file, self.iterFits(fitIDs), format, callback)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
     def exportMultiBuy(self, fitID):
         fit = eos.db.getFit(fitID)
         return Port.exportMultiBuy(fit)
@@ -939,97 +1056,69 @@ class Fit(object):
 
     def importFitFromFiles(self, paths, callback=None):
         """
-        Imports fits from file(s). First processes all provided paths and stores
-        assembled fits into a list. This allows us to call back to the GUI as
-        fits are processed as well as when fits are being saved.
+        Imports fits from file(s). Files are read and parsed incrementally,
+        and fits are saved in batches of IMPORT_BATCH_SIZE as they come, so
+        memory use doesn't depend on file size. Calls back to the GUI as
+        files are started, as fits are processed and as batches are saved.
 
-        returns
+        returns (True, summaries of imported fits) or (False, error message);
+        fits saved before an error stay saved
         """
-        defcodepage = locale.getpreferredencoding()
-
-        fits = []
-        for path in paths:
+        summaries = []
+        batch = []
+        # Items of all fits read so far, so those used by many files are loaded once
+        prefetched = {}
+        # Defaults are loaded by shared session, we may be saving through another one
+        character = eos.db.handoff(self.character)
+        pattern = eos.db.handoff(self.pattern)
+        targetResists = eos.db.handoff(self.targetResists)
+
+        def saveBatch():
+            for fit in batch:
+                # Set some more fit attributes and save
+                fit.character = character
+                fit.damagePattern = pattern
+                fit.targetResists = targetResists
+                eos.db.add(fit)
+            eos.db.commit()
+            # Keep only what is needed to list fits, so saved ones can be freed
+            for fit in batch:
+                summaries.append(FitSummary(fit.ID, fit.shipID, fit.ship.item.groupID, fit.name,
+                                            fit.booster, fit.timestamp, fit.ownerID))
+            del batch[:]
             if callback:  # Pulse
-                wx.CallAfter(callback, 1, "Processing file:\n%s" % path)
-
-            file = open(path, "r")
-            srcString = file.read()
-
-            if len(srcString) == 0:  # ignore blank files
-                continue
-
-            codec_found = None
-            # If file had ANSI encoding, decode it to unicode using detection
-            # of BOM header or if there is no header try default
-            # codepage then fallback to utf-16, cp1252
-
-            if isinstance(srcString, str):
-                encoding_map = (
-                    ('\xef\xbb\xbf', 'utf-8'),
-                    ('\xff\xfe\0\0', 'utf-32'),
-                    ('\0\0\xfe\xff', 'UTF-32BE'),
-                    ('\xff\xfe', 'utf-16'),
-                    ('\xfe\xff', 'UTF-16BE'))
-
-                for bom, encoding in encoding_map:
-                    if srcString.startswith(bom):
-                        codec_found = encoding
-                        savebom = bom
-
-                if codec_found is None:
-                    logger.info("Unicode BOM not found in file %s.", path)
-                    attempt_codecs = (defcodepage, "utf-8", "utf-16", "cp1252")
-
-                    for page in attempt_codecs:
-                        try:
-                            logger.info("Attempting to decode file %s using %s page.", path, page)
-                            srcString = unicode(srcString, page)
-                            codec_found = page
-                            logger.info("File %s decoded using %s page.", path, page)
-                        except UnicodeDecodeError:
-                            logger.info("Error unicode decoding %s from page %s, trying next codec", path, page)
-                        else:
-                            break
-                else:
-                    logger.info("Unicode BOM detected in %s, using %s page.", path, codec_found)
-                    srcString = unicode(srcString[len(savebom):], codec_found)
+                wx.CallAfter(callback, 1, "Saving fits to database\n(%d saved)" % len(summaries))
 
-            else:
-                # nasty hack to detect other transparent utf-16 loading
-                if srcString[0] == '<' and 'utf-16' in srcString[:128].lower():
-                    codec_found = "utf-16"
+        numFiles = len(paths)
+        for i, path in enumerate(paths):
+            if callback:  # Pulse
+                if numFiles > 1:
+                    wx.CallAfter(callback, 1, "Processing file (%d/%d):\n%s" % (i + 1, numFiles, path))
                 else:
-                    codec_found = "utf-8"
-
-            if codec_found is None:
-                return False, "Proper codec could not be established for %s" % path
+                    wx.CallAfter(callback, 1, "Processing file:\n%s" % path)
 
             try:
-                _, fitsImport = Port.importAuto(srcString, path, callback=callback, encoding=codec_found)
-                fits += fitsImport
-            except xml.parsers.expat.ExpatError, e:
+                importFile = Port.prepareImportFile(path)
+                if importFile.empty:  # ignore blank files
+                    continue
+                if importFile.encoding is None:
+                    return False, "Proper codec could not be established for %s" % path
+
+                for fit in Port.iterImportFile(path, importFile.encoding, callback=callback, text=importFile.text,
+                                               prefetched=prefetched):
+                    batch.append(fit)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        saveBatch()
+            except (xml.parsers.expat.ExpatError, ParseError), e:
                 return False, "Malformed XML in %s" % path
             except Exception, e:
                 logger.exception("Unknown exception processing: %s", path)
                 return False, "Unknown Error while processing %s" % path
 
-        IDs = []
-        numFits = len(fits)
-        for i, fit in enumerate(fits):
-            # Set some more fit attributes and save
-            fit.character = self.character
-            fit.damagePattern = self.pattern
-            fit.targetResists = self.targetResists
-            eos.db.save(fit)
-            IDs.append(fit.ID)
-            if callback:  # Pulse
-                wx.CallAfter(
-                    callback, 1,
-                    "Processing complete, saving fits to database\n(%d/%d)" %
-                    (i + 1, numFits)
-                )
+        if batch:
+            saveBatch()
 
-        return True, fits
+        return True, summaries
 
     def importFitFromBuffer(self, bufferStr, activeFit=None):
         _, fits = Port.importAuto(bufferStr, activeFit=activeFit)
@@ -1134,3 +1223,106 @@ class Fit(object):
             fit.factorReload = self.serviceFittingOptions["useGlobalForceReload"]
         fit.clear()
         fit.calculateModifiedAttributes(withBoosters=withBoosters)
+        if fit.ID is not None:
+            # Stored stats get refreshed next time they're asked for
+            self.fitStatsEdited.add(fit.ID)
+
+    def getFitStatsValues(self, fit):
+        """Summary stats of freshly calculated fit, as keyword arguments for eos.db.saveFitStats"""
+        typeIDs = [fit.ship.item.ID]
+        typeIDs.extend(mod.itemID for mod in fit.modules if not mod.isEmpty)
+        for drone in fit.drones:
+            typeIDs.extend([drone.itemID] * drone.amount)
+        for fighter in fit.fighters:
+            typeIDs.extend([fighter.itemID] * fighter.amountActive)
+        for cargo in fit.cargo:
+            typeIDs.extend([cargo.itemID] * cargo.amount)
+        prices = eos.db.getPriceValues(typeIDs)
+        if prices.get(fit.ship.item.ID) is not None:
+            price = sum(prices.get(typeID) or 0 for typeID in typeIDs)
+        else:
+            price = None
+
+        return {"fitID": fit.ID,
+                "characterID": fit.character.ID,
+                "dps": fit.totalDPS,
+                "volley": fit.totalVolley,
+                "ehp": sum(fit.ehp.values()),
+                "capStable": fit.capStable,
+                "capState": fit.capState,
+                "price": price}
+
+    def getFitStats(self, fitIDs=None, orderBy=None, descending=True):
+        """Stored stats of fits, see eos.db.getFitStats"""
+        return eos.db.getFitStats(fitIDs, orderBy=orderBy, descending=descending)
+
+    def filterFitsByStats(self, fitIDs, orderBy=None, descending=True, capStable=False, minDps=0):
+        """
+        Return IDs of given fits whose stored stats pass the filters, ordered
+        by stats column orderBy, or as given if it's None. Fits without stats
+        can't pass filters; when only sorting, they are kept and put last.
+        """
+        fitIDs = list(fitIDs)
+        filtering = capStable or minDps
+        if orderBy is None and not filtering:
+            return fitIDs
+        rows = self.getFitStats(fitIDs, orderBy=orderBy, descending=descending)
+        if orderBy is None:
+            position = dict((fitID, i) for i, fitID in enumerate(fitIDs))
+            rows.sort(key=lambda row: position[row["fitID"]])
+        else:
+            # Database puts NULLs first when sorting ascending, we want them last
+            rows.sort(key=lambda row: row[orderBy] is None)
+        if capStable:
+            rows = [row for row in rows if row["capStable"]]
+        if minDps:
+            rows = [row for row in rows if row["dps"] is not None and row["dps"] >= minDps]
+        result = [row["fitID"] for row in rows]
+        if not filtering:
+            withStats = set(result)
+            result.extend(fitID for fitID in fitIDs if fitID not in withStats)
+        return result
+
+    def refreshFitStats(self, fitIDs, callback=None):
+        """
+        Recalculate, in background, given fits whose stored stats are outdated
+        by gamedata, skill or fit changes. Callback gets called with IDs of
+        the fits once done, if any of their stats changed. Nothing is queued
+        if all are up to date.
+        """
+        stale = set(eos.db.getStaleFitStatsIDs(fitIDs))
+        stale.update(self.fitStatsEdited.intersection(fitIDs))
+        for fitID in fitIDs:
+            if fitID in stale:
+                self.fitStatsQueue.setdefault(fitID, set()).add(callback)
+        if self.fitStatsThread is None:
+            self.startFitStatsRefresh()
+
+    def startFitStatsRefresh(self):
+        if not self.fitStatsQueue:
+            self.fitStatsThread = None
+            return
+        if eos.db.commitPending():
+            # Refresh loads fits through its own session, let it see latest edits
+            try:
+                eos.db.flushPendingCommit()
+            except Exception:
+                logger.exception("Could not commit before refreshing fit stats")
+        queue = self.fitStatsQueue
+        self.fitStatsQueue = collections.OrderedDict()
+        # Queued fits are all recalculated, edits made until now included
+        self.fitStatsEdited.difference_update(queue)
+        self.fitStatsThread = FitStatsRefreshThread(queue)
+        self.fitStatsThread.start()
+
+    def fitStatsRefreshed(self, thread, changed):
+        """Called on GUI thread once FitStatsRefreshThread is done"""
+        if changed:
+            callbacks = {}
+            for fitID, fitCallbacks in thread.queue.iteritems():
+                for callback in fitCallbacks:
+                    if callback is not None:
+                        callbacks.setdefault(callback, []).append(fitID)
+            for callback, fitIDs in callbacks.iteritems():
+                callback(fitIDs)
+        self.startFitStatsRefresh()
@@ -31,6 +31,8 @@ from sqlalchemy.sql import and_, or_
 from service.settings import SettingsProvider, NetworkSettings
 import service
 import service.conversions as conversions
+from eos.searchIndex import normalize
+from eos.db.cache import QueryCache
 import logging
 
 try:
@@ -43,10 +45,12 @@ logger = logging.getLogger(__name__)
 # Event which tells threads dependent on Market that it's initialized
 mktRdy = threading.Event()
 
+# Relations of items listed by market browser and meta swap menus
+MARKET_EAGER = ("icon", "group.category", "metaGroup")
+
 class ShipBrowserWorkerThread(threading.Thread):
     def run(self):
         self.queue = Queue.Queue()
-        self.cache = {}
         # Wait for full market initialization (otherwise there's high risky
         # this thread will attempt to init Market which is already being inited)
         mktRdy.wait(5)
@@ -54,25 +58,90 @@ class ShipBrowserWorkerThread(threading.Thread):
 
     def processRequests(self):
         queue = self.queue
-        cache = self.cache
-        sMkt = Market.getInstance()
+        catalog = Market.getInstance().shipCatalog
         while True:
             try:
                 id, callback = queue.get()
-                set = cache.get(id)
-                if set is None:
-                    set = sMkt.getShipList(id)
-                    cache[id] = set
-
-                wx.CallAfter(callback, (id, set))
+                wx.CallAfter(callback, (id, catalog.getShips(id)))
             except:
-                pass
+                logger.exception("Could not list ships of group")
             finally:
                 try:
                     queue.task_done()
                 except:
                     pass
 
+class ShipEntry(object):
+    """Ship as listed by ship browser, plain data so listing it needs no database"""
+    __slots__ = ("ID", "name", "race", "groupID")
+
+    def __init__(self, ID, name, race, groupID):
+        self.ID = ID
+        self.name = name
+        self.race = race
+        self.groupID = groupID
+
+    def __repr__(self):
+        return "ShipEntry(%r, %r)" % (self.ID, self.name)
+
+class ShipCatalog(object):
+    """
+    Ship groups and their ship lists, as shown by ship browser. Every group's
+    list is built once, on first request or a group at a time by warmupStep()
+    while GUI is idle, and browsing needs no database afterwards. Fit
+    counts aren't stored here: they're read from in-memory fit summaries,
+    which follow every fit saved or deleted, see eos.db.countFitsByShip().
+    """
+
+    def __init__(self, market):
+        self.market = market
+        # [(groupID, name)] sorted by name, and {groupID: tuple of ShipEntry}
+        self.__groups = None
+        self.__ships = {}
+        self.__lock = threading.RLock()
+
+    def getGroups(self):
+        if self.__groups is None:
+            with self.__lock:
+                if self.__groups is None:
+                    groups = [(group.ID, group.name) for group in self.market.getShipRoot()]
+                    groups.sort(key=lambda group: group[1])
+                    self.__groups = groups
+        return self.__groups
+
+    def getShips(self, groupID):
+        ships = self.__ships.get(groupID)
+        if ships is None:
+            with self.__lock:
+                ships = self.__ships.get(groupID)
+                if ships is None:
+                    ships = tuple(ShipEntry(ship.ID, ship.name, ship.race, groupID)
+                                  for ship in self.market.getShipList(groupID))
+                    self.__ships[groupID] = ships
+        return ships
+
+    def warmupStep(self):
+        """
+        Build ship list of one more group, meant to be called from GUI thread
+        while it's idle. Returns False once lists of all groups are built.
+        """
+        for groupID, name in self.getGroups():
+            if groupID not in self.__ships:
+                self.getShips(groupID)
+                return True
+        return False
+
+    def getLoadedShips(self, groupID):
+        """Ship list of group if it's built already, None otherwise"""
+        return self.__ships.get(groupID)
+
+    def countFits(self, groupID):
+        """Map {shipID: number of fits} of all ships in group"""
+        return eos.db.countFitsByShip(ship.ID for ship in self.getShips(groupID))
+
+    def groupHasFits(self, groupID):
+        return eos.db.countFitsWithShips(ship.ID for ship in self.getShips(groupID)) > 0
+
 class PriceWorkerThread(threading.Thread):
     def run(self):
         self.queue = Queue.Queue()
@@ -82,19 +151,32 @@ class PriceWorkerThread(threading.Thread):
     def processUpdates(self):
         queue = self.queue
         while True:
-            # Grab our data
-            callback, requests = queue.get()
+            # Grab our data, along with everything else requested meanwhile,
+            # so overlapping requests are fetched together
+            batch = [queue.get()]
+            while True:
+                try:
+                    batch.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            # Store keeps one price object per type, dedupe on it
+            prices = {}
+            for callback, requests in batch:
+                for price in requests:
+                    prices[price.typeID] = price
 
             # Grab prices, this is the time-consuming part
-            if len(requests) > 0:
-                service.Price.fetchPrices(requests)
+            if len(prices) > 0:
+                service.Price.fetchPrices(prices.values())
 
-            wx.CallAfter(callback)
-            queue.task_done()
+            for callback, requests in batch:
+                wx.CallAfter(callback)
+                queue.task_done()
 
             # After we fetch prices, go through the list of waiting items and call their callbacks
-            for price in requests:
-                callbacks = self.wait.pop(price.typeID, None)
+            for typeID in prices:
+                callbacks = self.wait.pop(typeID, None)
                 if callbacks:
                     for callback in callbacks:
                         wx.CallAfter(callback)
@@ -108,9 +190,21 @@ class PriceWorkerThread(threading.Thread):
         self.wait[itemID].append(callback)
 
 class SearchWorkerThread(threading.Thread):
-    def run(self):
+    """
+    Runs item searches one at a time. Only the latest scheduled search
+    matters: scheduling another one, or cancelling, makes the one being run
+    give up and its results are never passed to its callback.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
         self.cv = threading.Condition()
         self.searchRequest = None
+        # Bumped by every scheduled or cancelled search, running search is
+        # stale once it changes
+        self.generation = 0
+
+    def run(self):
         self.processSearches()
 
     def processSearches(self):
@@ -121,39 +215,55 @@ class SearchWorkerThread(threading.Thread):
             while self.searchRequest is None:
                 cv.wait()
 
-            request, callback, filterOn = self.searchRequest
+            generation, request, callback, filterOn = self.searchRequest
             self.searchRequest = None
             cv.release()
-            sMkt = Market.getInstance()
-            if filterOn is True:
-                # Rely on category data provided by eos as we don't hardcode them much in service
-                filter = or_(eos.types.Category.name.in_(sMkt.SEARCH_CATEGORIES), eos.types.Group.name.in_(sMkt.SEARCH_GROUPS))
-            elif filterOn:  # filter by selected categories
-                filter = eos.types.Category.name.in_(filterOn)
-            else:
-                filter=None
-
-            results = eos.db.searchItems(request, where=filter,
-                                         join=(eos.types.Item.group, eos.types.Group.category),
-                                         eager=("icon", "group.category", "metaGroup", "metaGroup.parent"))
 
-            items = set()
-            # Return only published items, consult with Market service this time
-            for item in results:
-                if sMkt.getPublicityByItem(item):
-                    items.add(item)
-            wx.CallAfter(callback, items)
+            cancelled = lambda: generation != self.generation
+            try:
+                items = Market.getInstance().findItems(request, filterOn, cancelled=cancelled)
+            except Exception:
+                logger.exception("Search for %r failed", request)
+                continue
+            if items is not None and not cancelled():
+                wx.CallAfter(self.deliver, generation, callback, items)
+
+    def deliver(self, generation, callback, items):
+        # Search may have been superseded while results were on their way
+        if generation == self.generation:
+            callback(items)
 
     def scheduleSearch(self, text, callback, filterOn=True):
         self.cv.acquire()
-        self.searchRequest = (text, callback, filterOn)
+        self.generation += 1
+        self.searchRequest = (self.generation, text, callback, filterOn)
         self.cv.notify()
         self.cv.release()
 
+    def cancelSearch(self):
+        self.cv.acquire()
+        self.generation += 1
+        self.searchRequest = None
+        self.cv.release()
+
 class Market():
     instance = None
     def __init__(self):
-        self.priceCache = {}
+        self.priceStore = service.price.PriceStore()
+
+        # {normalized name: typeID} incl. old names of renamed items, see getNameIndex()
+        self.__nameIndex = None
+        self.__nameIndexLock = threading.Lock()
+        # Market structure with overrides applied, see getMarketIndex(), and
+        # sets of items it lists, by their typeIDs
+        self.__marketIndex = None
+        self.__itemSets = QueryCache("market.items", 200, 20000)
+        # Complete results of recent searches, see findItemIDs()
+        self.__searchResults = QueryCache("market.search", 50, 200000)
+        self.__customGroupsLoaded = False
+        self.__customGroupsLock = threading.Lock()
+        # Ship groups and lists for ship browser, see ShipCatalog
+        self.shipCatalog = ShipCatalog(self)
 
         #Init recently used module storage
         serviceMarketRecentlyUsedModules = {"pyfaMarketRecentlyUsedModules": []}
@@ -175,16 +285,14 @@ class Market():
         self.shipBrowserWorkerThread.daemon = True
         self.shipBrowserWorkerThread.start()
 
-        # Items' group overrides
+        # Items' group overrides; their category and items are filled in
+        # on first use, see __loadCustomGroups()
         self.customGroups = set()
         # Limited edition ships
         self.les_grp = eos.types.Group()
         self.les_grp.ID = -1
         self.les_grp.name = "特别版舰船"
         self.les_grp.published = True
-        ships = self.getCategory("舰船")
-        self.les_grp.category = ships
-        self.les_grp.categoryID = ships.ID
         self.les_grp.description = ""
         self.les_grp.icon = None
         self.ITEMS_FORCEGROUP = {
@@ -223,7 +331,6 @@ class Market():
         }
 
         self.ITEMS_FORCEGROUP_R = self.__makeRevDict(self.ITEMS_FORCEGROUP)
-        self.les_grp.addItems = list(self.getItem(itmn) for itmn in self.ITEMS_FORCEGROUP_R[self.les_grp])
         self.customGroups.add(self.les_grp)
 
         # List of items which are forcibly published or hidden
@@ -259,7 +366,7 @@ class Market():
             # Cannot use GROUPS_FORCEPUBLISHED as this does not force items
             # within group to be published, but rather for the group itself
             # to show up on ship list
-            group = self.getGroup("改装件", eager="items")
+            group = eos.db.getGroup("改装件", eager="items")
             for item in group.items:
                 self.ITEMS_FORCEPUBLISHED[item.name] = True
 
@@ -275,13 +382,6 @@ class Market():
             "中型纳米装甲维修组件 I": ("一级科技", "中型装甲维修器 I"),
             "大型回光外壳重塑装置 I": ("故事线", "大型装甲维修器 I"),
             "卡尼迪海军鱼雷发射器": ("势力", "鱼雷发射器 I"),}
-        # Parent type name: set(item names)
-        self.ITEMS_FORCEDMETAGROUP_R = {}
-        for item, value in self.ITEMS_FORCEDMETAGROUP.items():
-            parent = value[1]
-            if not parent in self.ITEMS_FORCEDMETAGROUP_R:
-                self.ITEMS_FORCEDMETAGROUP_R[parent] = set()
-            self.ITEMS_FORCEDMETAGROUP_R[parent].add(item)
         # Dictionary of items with forced market group (service assumes they have no
         # market group assigned in db, otherwise they'll appear in both original and forced groups)
         self.ITEMS_FORCEDMARKETGROUP = {
@@ -319,8 +419,6 @@ class Market():
             "特里蒙数据分析仪 I": 714  # Ship Equipment > Electronics and Sensor Upgrades > Scanners > Data and Composition Scanners
         }
 
-        self.ITEMS_FORCEDMARKETGROUP_R = self.__makeRevDict(self.ITEMS_FORCEDMARKETGROUP)
-
         self.FORCEDMARKETGROUP = {
             685: False, # Ship Equipment > Electronic Warfare > ECCM
             681: False, # Ship Equipment > Electronic Warfare > Sensor Backup Arrays
@@ -371,9 +469,19 @@ class Market():
                 item = eos.db.getItem(identity, *args, **kwargs)
             elif isinstance(identity, basestring):
                 # We normally lookup with string when we are using import/export
-                # features. Check against overrides
-                identity = conversions.all.get(identity, identity)
-                item = eos.db.getItem(identity, *args, **kwargs)
+                # features. Once name index is loaded, it resolves all names;
+                # until then exact names and overrides are looked up directly,
+                # and the index is only loaded when that fails
+                typeID = self.getItemIDByName(identity, load=False)
+                if typeID is None:
+                    try:
+                        item = eos.db.getItem(conversions.all.get(identity, identity), *args, **kwargs)
+                    except AttributeError:
+                        typeID = self.getItemIDByName(identity)
+                        if typeID is None:
+                            raise
+                if typeID is not None:
+                    item = eos.db.getItem(typeID, *args, **kwargs)
             elif isinstance(identity, float):
                 id = int(identity)
                 item = eos.db.getItem(id, *args, **kwargs)
@@ -385,6 +493,108 @@ class Market():
 
         return item
 
+    def getNameIndex(self):
+        """
+        Return {normalized name: typeID} of all items, built once from the
+        search index of current gamedata. Besides current names it holds
+        old names of renamed items from service.conversions, so names from
+        old fits resolve too. See eos.searchIndex.normalize() for matching.
+        """
+        if self.__nameIndex is None:
+            with self.__nameIndexLock:
+                if self.__nameIndex is None:
+                    index = dict(eos.db.getSearchIndex().getNameMap())
+                    renames = conversions.all
+                    for oldName in renames:
+                        # Follow chains of renames to the current name
+                        newName = renames[oldName]
+                        seen = set()
+                        while newName in renames and newName not in seen:
+                            seen.add(newName)
+                            newName = renames[newName]
+                        typeID = index.get(normalize(newName))
+                        if typeID is not None:
+                            # Current names take precedence over old ones
+                            index.setdefault(normalize(oldName), typeID)
+                    self.__nameIndex = index
+        return self.__nameIndex
+
+    def getItemIDByName(self, name, load=True):
+        """
+        Return typeID of item with name, current or from before a rename,
+        ignoring case and extra whitespace. None if there is no such item,
+        or if name index isn't loaded yet and load is False.
+        """
+        index = self.__nameIndex
+        if index is None:
+            if not load:
+                return None
+            index = self.getNameIndex()
+        return index.get(normalize(name))
+
+    def prefetchItemsByName(self, names, prefetched=None):
+        """
+        Load items with given names at once, with all relations needed to
+        build fits with them. Returns {typeID: item}; as long as it's kept,
+        getItem() for these names is a couple of dictionary lookups. Items
+        already in prefetched are not loaded again, it's updated and returned.
+        """
+        if prefetched is None:
+            prefetched = {}
+        index = self.getNameIndex()
+        typeIDs = set()
+        for name in names:
+            typeID = index.get(normalize(name))
+            if typeID is not None and typeID not in prefetched:
+                typeIDs.add(typeID)
+        if typeIDs:
+            prefetched.update(eos.db.getItems(typeIDs))
+        return prefetched
+
+    def getMarketIndex(self):
+        """
+        Return eos.marketIndex.MarketIndex of current gamedata with item
+        publicity, meta group and market group overrides applied. Built once
+        per client build and kept on disk, see eos.db.getMarketIndex().
+        """
+        if self.__marketIndex is None:
+            self.__marketIndex = eos.db.getMarketIndex({"published": self.ITEMS_FORCEPUBLISHED,
+                                                        "metaGroups": self.ITEMS_FORCEDMETAGROUP,
+                                                        "marketGroups": self.ITEMS_FORCEDMARKETGROUP,
+                                                        "groups": dict((name, group.ID) for name, group
+                                                                       in self.ITEMS_FORCEGROUP.iteritems())})
+        return self.__marketIndex
+
+    def __loadCustomGroups(self):
+        """
+        Give custom groups their category and items. Item names are resolved
+        by market index, and items loaded in one query, the first time any
+        custom group is needed rather than when Market starts.
+        """
+        if self.__customGroupsLoaded:
+            return
+        with self.__customGroupsLock:
+            if self.__customGroupsLoaded:
+                return
+            ships = self.getCategory("舰船")
+            self.les_grp.category = ships
+            self.les_grp.categoryID = ships.ID
+            overrideIDs = self.getMarketIndex().overrideIDs
+            for group in self.customGroups:
+                typeIDs = [overrideIDs[name] for name in self.ITEMS_FORCEGROUP_R.get(group, ()) if name in overrideIDs]
+                group.addItems = eos.db.getItems(typeIDs, eager=("group", "marketGroup")).values()
+            self.__customGroupsLoaded = True
+
+    def __getItemSet(self, typeIDs):
+        """Return set of items with given typeIDs, loaded at once and cached"""
+        key = frozenset(typeIDs)
+        items = self.__itemSets.get(key, None)
+        if items is None:
+            items = frozenset(eos.db.getItems(key, eager=MARKET_EAGER).itervalues())
+            self.__itemSets.set(key, items)
+        # Callers are free to change what they get
+        return set(items)
+
     def getGroup(self, identity, *args, **kwargs):
         """Get group by its ID or name"""
         if isinstance(identity, eos.types.Group):
@@ -393,6 +603,7 @@ class Market():
             if isinstance(identity, float):
                 identity = int(identity)
             # Check custom groups
+            self.__loadCustomGroups()
             for cgrp in self.customGroups:
                 # During first comparison we need exact int, not float for matching
                 if cgrp.ID == identity or cgrp.name == identity:
@@ -443,6 +654,7 @@ class Market():
     def getGroupByItem(self, item):
         """Get group by item"""
         if item.name in self.ITEMS_FORCEGROUP:
+            self.__loadCustomGroups()
             group = self.ITEMS_FORCEGROUP[item.name]
         else:
             group = item.group
@@ -479,34 +691,23 @@ class Market():
 
     def getMetaGroupIdByItem(self, item, fallback=0):
         """Get meta group ID by item"""
-        id = getattr(self.getMetaGroupByItem(item), "ID", fallback)
-        return id
+        return self.getMarketIndex().getMetaGroupID(item.ID, fallback)
 
     def getMarketGroupByItem(self, item, parentcheck=True):
-        """Get market group by item, its ID or name"""
-        # Check if we force market group for given item
-        if item.name in self.ITEMS_FORCEDMARKETGROUP:
-            mgid = self.ITEMS_FORCEDMARKETGROUP[item.name]
-            return self.getMarketGroup(mgid)
-        # Check if item itself has market group
-        elif item.marketGroupID:
-            return item.marketGroup
-        elif parentcheck:
-            # If item doesn't have marketgroup, check if it has parent
-            # item and use its market group
-            parent = self.getParentItemByItem(item, selfparent=False)
-            if parent:
-                return parent.marketGroup
-            else:
-                return None
-        else:
+        """
+        Get market group by item; if it has none, that of its parent
+        item when parentcheck is set
+        """
+        mgid = self.getMarketIndex().getMarketGroupID(item.ID, parentcheck)
+        if mgid is None:
             return None
+        return self.getMarketGroup(mgid)
 
     def getParentItemByItem(self, item, selfparent=True):
         """Get parent item by item"""
-        mg = self.getMetaGroupByItem(item)
-        if mg:
-            parent = mg.parent
+        parentID = self.getMarketIndex().getParentID(item.ID)
+        if parentID is not None:
+            parent = self.getItem(parentID)
         # Consider self as parent if item has no parent in database
         elif selfparent is True:
             parent = item
@@ -516,33 +717,19 @@ class Market():
 
     def getVariationsByItems(self, items, alreadyparent=False):
         """Get item variations by item, its ID or name"""
+        index = self.getMarketIndex()
         # Set for IDs of parent items
-        parents = set()
-        # Set-container for variables
-        variations = set()
+        parentIDs = set()
         for item in items:
-            # Get parent item
-            if alreadyparent is False:
-                parent = self.getParentItemByItem(item)
-            else:
-                parent = item
-            # Combine both in the same set
-            parents.add(parent)
-            # Check for overrides and add them if any
-            if parent.name in self.ITEMS_FORCEDMETAGROUP_R:
-                for item in self.ITEMS_FORCEDMETAGROUP_R[parent.name]:
-                    i = self.getItem(item)
-                    if i:
-                        variations.add(i)
-        # Add all parents to variations set
-        variations.update(parents)
-        # Add all variations of parents to the set
-        parentids = tuple(item.ID for item in parents)
-        variations.update(eos.db.getVariations(parentids))
-        return variations
+            parentID = None if alreadyparent else index.getParentID(item.ID)
+            parentIDs.add(parentID if parentID is not None else item.ID)
+        # Parents along with all their variations, overrides included
+        return self.__getItemSet(index.getVariationIDs(parentIDs))
 
     def getGroupsByCategory(self, cat):
         """Get groups from given category"""
+        # Custom groups show up in their category once loaded
+        self.__loadCustomGroups()
         groups = set(filter(lambda grp: self.getPublicityByGroup(grp), cat.groups))
         return groups
 
@@ -557,6 +744,8 @@ class Market():
         """Get items assigned to group"""
         # Return only public items; also, filter out items
         # which were forcibly set to other groups
+        if group in self.customGroups:
+            self.__loadCustomGroups()
         groupItems = set(group.items)
         if hasattr(group, 'addItems'):
             groupItems.update(group.addItems)
@@ -564,43 +753,15 @@ class Market():
         return items
 
     def getItemsByMarketGroup(self, mg, vars=True):
-        """Get items in the given market group"""
-        result = set()
-        # Get items from eos market group
-        baseitms = set(mg.items)
-        # Add hardcoded items to set
-        if mg.ID in self.ITEMS_FORCEDMARKETGROUP_R:
-            forceditms = set(self.getItem(itmn) for itmn in self.ITEMS_FORCEDMARKETGROUP_R[mg.ID])
-            baseitms.update(forceditms)
-        if vars:
-            parents = set()
-            for item in baseitms:
-                # Add one of the base market group items to result
-                result.add(item)
-                parent = self.getParentItemByItem(item, selfparent=False)
-                # If item has no parent, it's base item (or at least should be)
-                if parent is None:
-                    parents.add(item)
-            # Fetch variations only for parent items
-            variations = self.getVariationsByItems(parents, alreadyparent=True)
-            for variation in variations:
-                # Exclude items with their own explicitly defined market groups
-                if self.getMarketGroupByItem(variation, parentcheck=False) is None:
-                    result.add(variation)
-        else:
-            result = baseitms
-        # Get rid of unpublished items
-        result = set(filter(lambda item: self.getPublicityByItem(item), result))
-        return result
+        """
+        Get published items in the given market group, including variations
+        of its base items which have no market group of their own if vars is set
+        """
+        return self.__getItemSet(self.getMarketIndex().getMarketGroupItemIDs(mg.ID, vars))
 
     def marketGroupHasTypesCheck(self, mg):
         """If market group has any items, return true"""
-        if mg and mg.ID in self.ITEMS_FORCEDMARKETGROUP_R:
-            return True
-        elif len(mg.items) > 0:
-            return True
-        else:
-            return False
+        return self.getMarketIndex().hasTypes(mg.ID)
 
     def marketGroupValidityCheck(self, mg):
         """Check market group validity"""
@@ -642,11 +803,7 @@ class Market():
 
     def getPublicityByItem(self, item):
         """Return if an item is published"""
-        if item.name in self.ITEMS_FORCEPUBLISHED:
-            pub = self.ITEMS_FORCEPUBLISHED[item.name]
-        else:
-            pub = item.published
-        return pub
+        return self.getMarketIndex().isPublished(item.ID)
 
     def getPublicityByGroup(self, group):
         """Return if an group is published"""
@@ -685,25 +842,80 @@ class Market():
         return ships
 
     def getShipListDelayed(self, id, callback):
-        """Background version of getShipList"""
+        """Background version of getShipList, callback gets ShipEntry objects from shipCatalog"""
         self.shipBrowserWorkerThread.queue.put((id, callback))
 
+    def findItemIDs(self, text, filterOn=True, limit=100, cancelled=None):
+        """
+        Return typeIDs of published items matching text, best matches first;
+        None if cancelled (see eos.searchIndex.SearchIndex.match) returned
+        true. filterOn is True for market search categories, a list of
+        category names, or False for no filtering.
+
+        Complete results of recent searches are kept, so as the text gets
+        typed in, every search only looks at results of the longest cached
+        text it extends.
+        """
+        if filterOn is True:
+            # Rely on category data provided by eos as we don't hardcode them much in service
+            categories, groups = self.SEARCH_CATEGORIES, self.SEARCH_GROUPS
+            filterKey = True
+        elif filterOn:  # filter by selected categories
+            categories, groups = filterOn, None
+            filterKey = tuple(filterOn)
+        else:
+            categories, groups = None, None
+            filterKey = None
+
+        index = eos.db.getSearchIndex()
+        text = normalize(text)
+        results = self.__searchResults
+        ranks = results.get((filterKey, text), None)
+        if ranks is None:
+            match = None
+            for end in xrange(len(text) - 1, 0, -1):
+                previous = results.get((filterKey, text[:end]), None)
+                if previous is not None:
+                    # Cached results are already filtered and published only
+                    match = index.match(text, within=previous, cancelled=cancelled)
+                    if match is not None and not match[1]:
+                        # Fuzzy matches have to be looked for among all items
+                        match = None
+                    break
+            if match is None:
+                if cancelled is not None and cancelled():
+                    return None
+                match = index.match(text, categories, groups, within=self.getMarketIndex().published,
+                                    cancelled=cancelled)
+                if match is None:
+                    return None
+            ranks, narrowable = match
+            if narrowable:
+                results.set((filterKey, text), ranks, weight=len(ranks))
+        return index.order(ranks, limit)
+
+    def findItems(self, text, filterOn=True, cancelled=None):
+        """Set of published items matching text, see findItemIDs()"""
+        typeIDs = self.findItemIDs(text, filterOn, cancelled=cancelled)
+        if typeIDs is None or (cancelled is not None and cancelled()):
+            return None
+        return set(eos.db.getItems(typeIDs, eager=("icon", "group.category", "metaGroup", "metaGroup.parent")).itervalues())
+
     def searchShips(self, name):
         """Find ships according to given text pattern"""
-        filter = eos.types.Category.name.in_(["舰船", "建筑"])
-        results = eos.db.searchItems(name, where=filter,
-                                     join=(eos.types.Item.group, eos.types.Group.category),
-                                     eager=("icon", "group.category", "metaGroup", "metaGroup.parent"))
-        ships = set()
-        for item in results:
-            if self.getPublicityByItem(item):
-                ships.add(item)
-        return ships
+        return self.findItems(name, ["舰船", "建筑"])
 
     def searchItems(self, name, callback, filterOn=True):
-        """Find items according to given text pattern"""
+        """
+        Find items according to given text pattern, callback is called with
+        set of them. Scheduling another search or calling cancelSearch()
+        before results are in cancels this one.
+        """
         self.searchWorkerThread.scheduleSearch(name, callback, filterOn)
 
+    def cancelSearch(self):
+        self.searchWorkerThread.cancelSearch()
+
     def getItemsWithOverrides(self):
         overrides = eos.db.getAllOverrides()
         items = set()
@@ -715,18 +927,34 @@ class Market():
                 items.add(x.item)
         return list(items)
 
+    def getAttributeMatrix(self, items, attribs=None):
+        """
+        Return eos.attributeMatrix.AttributeMatrix of base values for items
+        (rows, in given order) and attribs (columns; all attributes the
+        items have if None). Both accept objects with an ID or plain IDs.
+        """
+        itemIDs = [getattr(item, "ID", item) for item in items]
+        attrIDs = None
+        if attribs is not None:
+            attrIDs = [getattr(attrib, "ID", attrib) for attrib in attribs]
+        return eos.db.getAttributeMatrix(itemIDs, attrIDs)
+
     def directAttrRequest(self, items, attribs):
         try:
-            itemIDs = tuple(map(lambda i: i.ID, items))
+            items = list(items)
         except TypeError:
-            itemIDs = (items.ID,)
+            items = [items]
         try:
-            attrIDs = tuple(map(lambda i: i.ID, attribs))
+            attribs = list(attribs)
         except TypeError:
-            attrIDs = (attribs.ID,)
+            attribs = [attribs]
+        matrix = self.getAttributeMatrix(items, attribs)
         info = {}
-        for itemID, typeID, val in eos.db.directAttributeRequest(itemIDs, attrIDs):
-            info[itemID] = val
+        for itemID in matrix.itemIDs:
+            for attrID in matrix.attrIDs:
+                val = matrix.get(itemID, attrID)
+                if val is not None:
+                    info[itemID] = val
 
         return info
 
@@ -742,27 +970,15 @@ class Market():
 
     def getPriceNow(self, typeID):
         """Get price for provided typeID"""
-        price = self.priceCache.get(typeID)
-        if price is None:
-            price = eos.db.getPrice(typeID)
-            if price is None:
-                price = eos.types.Price(typeID)
-                eos.db.add(price)
-
-            self.priceCache[typeID] = price
-
-        return price
+        return self.priceStore.get(typeID)
 
     def getPricesNow(self, typeIDs):
-        """Return map of calls to get price against list of typeIDs"""
-        return map(self.getPrice, typeIDs)
+        """Return list of prices for typeIDs, in the same order"""
+        return self.priceStore.getMany(typeIDs)
 
     def getPrices(self, typeIDs, callback):
         """Get prices for multiple typeIDs"""
-        requests = []
-        for typeID in typeIDs:
-            price = self.getPriceNow(typeID)
-            requests.append(price)
+        requests = self.priceStore.getMany(typeIDs)
 
         def cb():
             try:
@@ -789,7 +1005,7 @@ class Market():
         self.priceWorkerThread.setToWait(item.ID, cb)
 
     def clearPriceCache(self):
-        self.priceCache.clear()
+        self.priceStore.clear()
         deleted_rows = eos.db.clearPrices()
 
     def getSystemWideEffects(self):
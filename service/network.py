@@ -18,15 +18,26 @@
 #===============================================================================
 
 from service.settings import NetworkSettings
-import urllib2
-import urllib
+import io
+import time
 import config
 import socket
+import requests
+from requests.adapters import HTTPAdapter
 
 # network timeout, otherwise pyfa hangs for a long while if no internet connection
 timeout = 3
 socket.setdefaulttimeout(timeout)
 
+# Seconds a request may take in total, retries included
+TIMEOUT_BUDGET = 30
+# Attempts per request, and delay before the first retry, doubled for each next one
+RETRIES = 3
+BACKOFF = 0.5
+# Hosts connection pools are kept for, and idle connections kept open per host
+POOL_HOSTS = 10
+POOL_SIZE = 4
+
 class Error(StandardError):
     def __init__(self, msg=None):
         self.message = msg
@@ -59,7 +70,42 @@ class Network():
 
         return cls._instance
 
-    def request(self, url, type, data=None):
+    def __init__(self):
+        # Connection pools of all sessions, so connections to a host are
+        # kept alive and reused by every service talking to it
+        self.adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+        self.session = self.newSession()
+
+    def newSession(self):
+        """
+        Return new requests session using shared connection pools. Services
+        which keep headers of their own (e.g. authorization) use their own
+        session, everything else goes through request().
+        """
+        versionString = "{0} {1} - {2} {3}".format(config.version, config.tag, config.expansionName, config.expansionVersion)
+        session = requests.Session()
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        session.headers["User-Agent"] = "pyfa {0} (Python-requests)".format(versionString)
+        session.proxies.update(self.getProxies())
+        return session
+
+    def getProxies(self):
+        """Proxies for requests as set in preferences, empty if none is set"""
+        proxy = NetworkSettings.getInstance().getProxySettings()
+        if proxy is None:
+            return {}
+        address = "http://{0}:{1}".format(*proxy)
+        return {"http": address, "https": address}
+
+    def request(self, url, type, data=None, budget=TIMEOUT_BUDGET):
+        """
+        Send request to url, POST if there's data (dictionary or list of
+        pairs), else GET. Connection failures, timeouts and server errors
+        are retried with growing delays, until RETRIES attempts or budget
+        seconds are used up. Returns file-like object with the response
+        body, gzip encoding already undone.
+        """
         # URL is required to be https as of right now
         #print "Starting request: %s\n\tType: %s\n\tPost Data: %s"%(url,type,data)
 
@@ -69,28 +115,38 @@ class Network():
         if not self.ENABLED & access or not type & access:
             raise Error("Access not enabled - please enable in Preferences > Network")
 
-        # Set up some things for the request
-        versionString = "{0} {1} - {2} {3}".format(config.version, config.tag, config.expansionName, config.expansionVersion)
-        headers={"User-Agent" : "pyfa {0} (Python-urllib2)".format(versionString)}
-
-        proxy = NetworkSettings.getInstance().getProxySettings()
-        if proxy is not None:
-            proxy = urllib2.ProxyHandler({'https': "{0}:{1}".format(*proxy)})
-            opener = urllib2.build_opener(proxy)
-            urllib2.install_opener(opener)
-
-        request = urllib2.Request(url, headers=headers, data=urllib.urlencode(data) if data else None)
-        try:
-            return urllib2.urlopen(request)
-        except urllib2.HTTPError, error:
-            if error.code == 404:
+        deadline = time.time() + budget
+        proxies = self.getProxies()
+        error = None
+        for attempt in xrange(RETRIES):
+            if attempt > 0:
+                delay = BACKOFF * 2 ** (attempt - 1)
+                if time.time() + delay >= deadline:
+                    break
+                time.sleep(delay)
+            remaining = deadline - time.time()
+            try:
+                response = self.session.request("POST" if data else "GET", url, data=data or None, proxies=proxies,
+                                                timeout=(min(timeout, remaining), remaining))
+            except requests.Timeout:
+                error = TimeoutError()
+                continue
+            except requests.ConnectionError, e:
+                error = Error(e)
+                continue
+            except requests.RequestException, e:
+                raise Error(e)
+
+            if response.status_code == 404:
                 raise RequestError()
-            elif error.code == 403:
+            elif response.status_code == 403:
                 raise AuthenticationError()
-            elif error.code >= 500:
-                raise ServerError()
-        except urllib2.URLError, error:
-            if "timed out" in error.reason:
-                raise TimeoutError()
-            else:
-                raise Error(error)
+            elif response.status_code >= 500:
+                error = ServerError()
+                continue
+            elif response.status_code >= 400:
+                raise Error(response.reason)
+            # Reading the whole body hands connection back to the pool
+            return io.BytesIO(response.content)
+
+        raise error
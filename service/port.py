@@ -19,9 +19,14 @@
 
 import re
 import os
-import xml.dom
+import codecs
+import gzip
+import locale
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
 
 from eos.types import State, Slot, Module, Cargo, Fit, Ship, Drone, Implant, Booster, Citadel
+import eos.db
 import service
 import wx
 import logging
@@ -47,6 +52,69 @@ INV_FLAGS = {
 INV_FLAG_CARGOBAY = 5
 INV_FLAG_DRONEBAY = 87
 
+# Byte order marks of files we import, longest first as they share prefixes.
+# utf-8-sig strips the mark while decoding, the rest we strip ourselves.
+ENCODING_BOMS = (
+    ('\xff\xfe\0\0', 'utf-32'),
+    ('\0\0\xfe\xff', 'UTF-32BE'),
+    ('\xef\xbb\xbf', 'utf-8-sig'),
+    ('\xff\xfe', 'utf-16'),
+    ('\xfe\xff', 'UTF-16BE'))
+
+# Encoding of files without BOM is guessed from this many first bytes
+DETECT_SIZE = 64 * 1024
+# Files up to this size are read whole when prepared for import, bigger ones
+# are streamed when fits are built from them
+PREPARE_MAX_SIZE = 1024 * 1024
+
+
+def _openRaw(path):
+    """Open file for reading bytes, decompressing it if it's gzipped"""
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _xmlEscape(value):
+    # Same escaping minidom applies to attribute values
+    value = unicode(value)
+    return value.replace(u"&", u"&amp;").replace(u"<", u"&lt;").replace(u"\"", u"&quot;").replace(u">", u"&gt;")
+
+
+def _xmlElement(indent, tag, **attrs):
+    """Line with empty XML element, attributes sorted by name like minidom does"""
+    return u'%s<%s%s/>\n' % (indent, tag, u"".join(u' %s="%s"' % (name, _xmlEscape(attrs[name]))
+                                                  for name in sorted(attrs)))
+
+
+def _candidateNames(lines):
+    """Pieces of EFT style lines which may be item names, for prefetching"""
+    names = set()
+    for line in lines:
+        line = line.strip()
+        if line.endswith(" /OFFLINE"):
+            line = line[:-len(" /OFFLINE")]
+        # EFT config store entries, like Drones_Active=Hobgoblin II,5
+        if "=" in line:
+            line = line.split("=", 1)[1]
+        for part in line.split(","):
+            names.add(part.strip())
+            # Drones and cargo, like Hobgoblin II x5
+            names.add(part.split(" x")[0].strip())
+    return names
+
+
+class ImportFile(object):
+    """File to import fits from, as prepared by Port.prepareImportFile()"""
+    def __init__(self, path, encoding=None, text=None, empty=False):
+        self.path = path
+        # None if no encoding could decode the file
+        self.encoding = encoding
+        # Decoded contents, None if file is too big to be kept in memory
+        self.text = text
+        self.empty = empty
+
+
 class Port(object):
     """Service which houses all import/export format functions"""
     @classmethod
@@ -165,6 +233,127 @@ class Port(object):
         # Use DNA format for all other cases
         return "DNA", (cls.importDna(string),)
 
+    @staticmethod
+    def _encodingCandidates(path):
+        """
+        Yield encodings file at path may be in: the one its BOM tells, or if
+        it has none, those of default codepage, utf-8, utf-16 and cp1252 that
+        can decode first DETECT_SIZE bytes of it, in that order.
+        """
+        with _openRaw(path) as file:
+            head = file.read(DETECT_SIZE)
+            complete = not file.read(1)
+        for bom, encoding in ENCODING_BOMS:
+            if head.startswith(bom):
+                logger.info("Unicode BOM detected in %s, using %s page.", path, encoding)
+                yield encoding
+                return
+
+        logger.info("Unicode BOM not found in file %s.", path)
+        for page in (locale.getpreferredencoding(), "utf-8", "utf-16", "cp1252"):
+            logger.info("Attempting to decode file %s using %s page.", path, page)
+            try:
+                # Character cut off at end of a partial read is no error
+                codecs.getincrementaldecoder(page)().decode(head, final=complete)
+            except (UnicodeError, LookupError):
+                logger.info("Error unicode decoding %s from page %s, trying next codec", path, page)
+            else:
+                logger.info("File %s decoded using %s page.", path, page)
+                yield page
+
+    @classmethod
+    def detectFileEncoding(cls, path):
+        """
+        Find out encoding of file at path from its BOM, or if it has none, by
+        trying to decode its beginning with default codepage, then utf-8,
+        utf-16 and cp1252. Returns None if no encoding fits.
+        """
+        return next(cls._encodingCandidates(path), None)
+
+    @classmethod
+    def prepareImportFile(cls, path):
+        """
+        Do the work needed before fits can be built from file at path:
+        detect its encoding and, if it's small, read and decode it.
+        """
+        size = os.path.getsize(path)
+        if size == 0:
+            return ImportFile(path, empty=True)
+        # Size of compressed files says little about their contents, stream them
+        if size > PREPARE_MAX_SIZE or path.lower().endswith(".gz"):
+            return ImportFile(path, cls.detectFileEncoding(path))
+
+        with _openRaw(path) as file:
+            data = file.read()
+        # Encoding which fits beginning of file may still fail further on,
+        # go on with next one then
+        for encoding in cls._encodingCandidates(path):
+            try:
+                return ImportFile(path, encoding, data.decode(encoding).lstrip(u"\ufeff"))
+            except UnicodeError:
+                logger.info("Error unicode decoding %s from page %s, trying next codec", path, encoding)
+        return ImportFile(path)
+
+    @staticmethod
+    def _readLines(path, encoding):
+        """Yield decoded lines of file without line endings, reading it as we go"""
+        with _openRaw(path) as file:
+            first = True
+            for line in codecs.getreader(encoding)(file):
+                if first:
+                    line = line.lstrip(u"\ufeff")
+                    first = False
+                yield line.rstrip(u"\r\n")
+
+    @classmethod
+    def iterImportFile(cls, path, encoding, callback=None, text=None, prefetched=None):
+        """
+        Yield fits from file at path one by one, as they are parsed. Format
+        is detected same way as importAuto() does. XML and EFT config files,
+        which may hold thousands of fits, are read incrementally; other
+        formats describe a single fit and are read whole. If text is given,
+        it is used as decoded contents of the file instead of reading it.
+        Items of EFT config fits are kept in and taken from prefetched, see
+        Market.prefetchItemsByName().
+        """
+        firstLine = None
+        if text is not None:
+            if text.strip():
+                firstLine = re.split("[\n\r]+", text.strip(), maxsplit=1)[0].strip()
+        else:
+            for line in cls._readLines(path, encoding):
+                if line.strip():
+                    firstLine = line.strip()
+                    break
+        if firstLine is None:
+            return
+
+        if firstLine.startswith("<"):
+            if text is not None:
+                for fit in cls.iterXml(StringIO(text.encode(encoding)), callback):
+                    yield fit
+            else:
+                # Parser reads raw bytes and handles encoding by itself
+                with _openRaw(path) as file:
+                    for fit in cls.iterXml(file, callback):
+                        yield fit
+        elif re.match("\[.*\]", firstLine):
+            shipName = os.path.split(path)[1].rsplit('.')[0]
+            if text is not None:
+                lines = re.split('[\n\r]+', text)
+            else:
+                lines = cls._readLines(path, encoding)
+            for fit in cls.iterEftCfg(shipName, lines, callback, prefetched):
+                yield fit
+        else:
+            if text is None:
+                with _openRaw(path) as file:
+                    text = codecs.getreader(encoding)(file).read().lstrip(u"\ufeff")
+            _, fits = cls.importAuto(text, path, callback=callback, encoding=encoding)
+            for fit in fits:
+                if fit is not None:
+                    yield fit
+
     @staticmethod
     def importCrest(str):
         fit = json.loads(str)
@@ -183,6 +372,11 @@ class Port(object):
 
         items = fit['items']
         items.sort(key=lambda k: k['flag'])
+        # Load all referenced items at once rather than one by one
+        try:
+            prefetched = eos.db.getItems(int(module['type']['id']) for module in items)
+        except (KeyError, TypeError, ValueError):
+            prefetched = None
 
         moduleList = []
         for module in items:
@@ -229,6 +423,9 @@ class Port(object):
         sMkt = service.Market.getInstance()
 
         ids = map(int, re.findall(r'\d+', string))
+        # Load all referenced items at once rather than one by one; numbers
+        # which are not type IDs (like amounts) are simply not found
+        prefetched = eos.db.getItems(ids)
         for id in ids:
             try:
                 try:
@@ -319,6 +516,11 @@ class Port(object):
             shipType = info[0].strip()
             fitName = "Imported %s" % shipType
 
+        # Resolve all names at once, lines are then parsed with dictionary lookups
+        names = _candidateNames(lines[1:])
+        names.add(shipType)
+        prefetched = sMkt.prefetchItemsByName(names)
+
         try:
             ship = sMkt.getItem(shipType)
             try:
@@ -364,7 +566,7 @@ class Port(object):
 
             try:
                 # get item information. If we are on a Drone/Cargo line, throw out cargo
-                item = sMkt.getItem(modName, eager="group.category")
+                item = sMkt.getItem(modName)
             except:
                 # if no data can be found (old names)
                 continue
@@ -437,257 +639,295 @@ class Port(object):
 
         return fit
 
-    @staticmethod
-    def importEftCfg(shipname, contents, callback=None):
+    @classmethod
+    def importEftCfg(cls, shipname, contents, callback=None):
         """Handle import from EFT config store file"""
 
-        # Check if we have such ship in database, bail if we don't
-        sMkt = service.Market.getInstance()
-        try:
-            sMkt.getItem(shipname)
-        except:
-            return []  # empty list is expected
-
         # If client didn't take care of encoding file contents into Unicode,
         # do it using fallback encoding ourselves
         if isinstance(contents, str):
             contents = unicode(contents, "cp1252")
 
-        fits = []  # List for fits
-        fitIndices = []  # List for starting line numbers for each fit
-        lines = re.split('[\n\r]+', contents)  # Separate string into lines
+        # Separate string into lines
+        return list(cls.iterEftCfg(shipname, re.split('[\n\r]+', contents), callback))
 
-        for line in lines:
-            # Detect fit header
-            if line[:1] == "[" and line[-1:] == "]":
-                # Line index where current fit starts
-                startPos = lines.index(line)
-                fitIndices.append(startPos)
+    @classmethod
+    def iterEftCfg(cls, shipname, lines, callback=None, prefetched=None):
+        """
+        Yield fits of EFT config store file given as iterable of lines. Items
+        are loaded into prefetched, if given, and lookups stay in memory as
+        long as it's kept.
+        """
 
-        for i, startPos in enumerate(fitIndices):
-            # End position is last file line if we're trying to get it for last fit,
-            # or start position of next fit minus 1
-            endPos = len(lines) if i == len(fitIndices) - 1 else fitIndices[i + 1]
+        # Check if we have such ship in database, bail if we don't
+        sMkt = service.Market.getInstance()
+        try:
+            sMkt.getItem(shipname)
+        except:
+            return
 
-            # Finally, get lines for current fitting
-            fitLines = lines[startPos:endPos]
+        # Items of all fits resolved so far, kept so lookups stay in memory
+        if prefetched is None:
+            prefetched = {}
+        fitLines = None
+        for line in lines:
+            # Detect fit header, lines before first one are ignored
+            if line[:1] == "[" and line[-1:] == "]":
+                if fitLines is not None:
+                    sMkt.prefetchItemsByName(_candidateNames(fitLines[1:]), prefetched)
+                    fit = cls._importEftCfgFit(sMkt, shipname, fitLines)
+                    if fit is not None:
+                        yield fit
+                        if callback:
+                            wx.CallAfter(callback, None)
+                fitLines = [line]
+            elif fitLines is not None:
+                fitLines.append(line)
+
+        if fitLines is not None:
+            sMkt.prefetchItemsByName(_candidateNames(fitLines[1:]), prefetched)
+            fit = cls._importEftCfgFit(sMkt, shipname, fitLines)
+            if fit is not None:
+                yield fit
+                if callback:
+                    wx.CallAfter(callback, None)
 
+    @staticmethod
+    def _importEftCfgFit(sMkt, shipname, fitLines):
+        """Build fit out of its lines in EFT config store file, header first"""
+        try:
+            # Create fit object
+            f = Fit()
+            # Strip square brackets and pull out a fit name
+            f.name = fitLines[0][1:-1]
+            # Assign ship to fitting
             try:
-                # Create fit object
-                f = Fit()
-                # Strip square brackets and pull out a fit name
-                f.name = fitLines[0][1:-1]
-                # Assign ship to fitting
-                try:
-                    f.ship = Ship(sMkt.getItem(shipname))
-                except ValueError:
-                    f.ship = Citadel(sMkt.getItem(shipname))
+                f.ship = Ship(sMkt.getItem(shipname))
+            except ValueError:
+                f.ship = Citadel(sMkt.getItem(shipname))
 
-                moduleList = []
-                for x in range(1, len(fitLines)):
-                    line = fitLines[x]
-                    if not line:
-                        continue
+            moduleList = []
+            for x in range(1, len(fitLines)):
+                line = fitLines[x]
+                if not line:
+                    continue
 
-                    # Parse line into some data we will need
-                    misc = re.match("(Drones|Implant|Booster)_(Active|Inactive)=(.+)", line)
-                    cargo = re.match("Cargohold=(.+)", line)
-
-                    if misc:
-                        entityType = misc.group(1)
-                        entityState = misc.group(2)
-                        entityData = misc.group(3)
-                        if entityType == "Drones":
-                            droneData = re.match("(.+),([0-9]+)", entityData)
-                            # Get drone name and attempt to detect drone number
-                            droneName = droneData.group(1) if droneData else entityData
-                            droneAmount = int(droneData.group(2)) if droneData else 1
-                            # Bail if we can't get item or it's not from drone category
-                            try:
-                                droneItem = sMkt.getItem(droneName, eager="group.category")
-                            except:
-                                continue
-                            if droneItem.category.name != "Drone":
-                                continue
-                            # Add drone to the fitting
-                            d = Drone(droneItem)
-                            d.amount = droneAmount
-                            if entityState == "Active":
-                                d.amountActive = droneAmount
-                            elif entityState == "Inactive":
-                                d.amountActive = 0
-                            f.drones.append(d)
-                        elif entityType == "Implant":
-                            # Bail if we can't get item or it's not from implant category
-                            try:
-                                implantItem = sMkt.getItem(entityData, eager="group.category")
-                            except:
-                                continue
-                            if implantItem.category.name != "Implant":
-                                continue
-                            # Add implant to the fitting
-                            imp = Implant(implantItem)
-                            if entityState == "Active":
-                                imp.active = True
-                            elif entityState == "Inactive":
-                                imp.active = False
-                            f.implants.append(imp)
-                        elif entityType == "Booster":
-                            # Bail if we can't get item or it's not from implant category
-                            try:
-                                boosterItem = sMkt.getItem(entityData, eager="group.category")
-                            except:
-                                continue
-                            # All boosters have implant category
-                            if boosterItem.category.name != "Implant":
-                                continue
-                            # Add booster to the fitting
-                            b = Booster(boosterItem)
-                            if entityState == "Active":
-                                b.active = True
-                            elif entityState == "Inactive":
-                                b.active = False
-                            f.boosters.append(b)
-                    # If we don't have any prefixes, then it's a module
-                    elif cargo:
-                        cargoData = re.match("(.+),([0-9]+)", cargo.group(1))
-                        cargoName = cargoData.group(1) if cargoData else cargo.group(1)
-                        cargoAmount = int(cargoData.group(2)) if cargoData else 1
-                        # Bail if we can't get item
+                # Parse line into some data we will need
+                misc = re.match("(Drones|Implant|Booster)_(Active|Inactive)=(.+)", line)
+                cargo = re.match("Cargohold=(.+)", line)
+
+                if misc:
+                    entityType = misc.group(1)
+                    entityState = misc.group(2)
+                    entityData = misc.group(3)
+                    if entityType == "Drones":
+                        droneData = re.match("(.+),([0-9]+)", entityData)
+                        # Get drone name and attempt to detect drone number
+                        droneName = droneData.group(1) if droneData else entityData
+                        droneAmount = int(droneData.group(2)) if droneData else 1
+                        # Bail if we can't get item or it's not from drone category
                         try:
-                            item = sMkt.getItem(cargoName)
+                            droneItem = sMkt.getItem(droneName)
                         except:
                             continue
-                        # Add Cargo to the fitting
-                        c = Cargo(item)
-                        c.amount = cargoAmount
-                        f.cargo.append(c)
-                    else:
-                        withCharge = re.match("(.+),(.+)", line)
-                        modName = withCharge.group(1) if withCharge else line
-                        chargeName = withCharge.group(2) if withCharge else None
-                        # If we can't get module item, skip it
+                        if droneItem.category.name != "Drone":
+                            continue
+                        # Add drone to the fitting
+                        d = Drone(droneItem)
+                        d.amount = droneAmount
+                        if entityState == "Active":
+                            d.amountActive = droneAmount
+                        elif entityState == "Inactive":
+                            d.amountActive = 0
+                        f.drones.append(d)
+                    elif entityType == "Implant":
+                        # Bail if we can't get item or it's not from implant category
                         try:
-                            modItem = sMkt.getItem(modName)
+                            implantItem = sMkt.getItem(entityData)
                         except:
                             continue
+                        if implantItem.category.name != "Implant":
+                            continue
+                        # Add implant to the fitting
+                        imp = Implant(implantItem)
+                        if entityState == "Active":
+                            imp.active = True
+                        elif entityState == "Inactive":
+                            imp.active = False
+                        f.implants.append(imp)
+                    elif entityType == "Booster":
+                        # Bail if we can't get item or it's not from implant category
+                        try:
+                            boosterItem = sMkt.getItem(entityData)
+                        except:
+                            continue
+                        # All boosters have implant category
+                        if boosterItem.category.name != "Implant":
+                            continue
+                        # Add booster to the fitting
+                        b = Booster(boosterItem)
+                        if entityState == "Active":
+                            b.active = True
+                        elif entityState == "Inactive":
+                            b.active = False
+                        f.boosters.append(b)
+                # If we don't have any prefixes, then it's a module
+                elif cargo:
+                    cargoData = re.match("(.+),([0-9]+)", cargo.group(1))
+                    cargoName = cargoData.group(1) if cargoData else cargo.group(1)
+                    cargoAmount = int(cargoData.group(2)) if cargoData else 1
+                    # Bail if we can't get item
+                    try:
+                        item = sMkt.getItem(cargoName)
+                    except:
+                        continue
+                    # Add Cargo to the fitting
+                    c = Cargo(item)
+                    c.amount = cargoAmount
+                    f.cargo.append(c)
+                else:
+                    withCharge = re.match("(.+),(.+)", line)
+                    modName = withCharge.group(1) if withCharge else line
+                    chargeName = withCharge.group(2) if withCharge else None
+                    # If we can't get module item, skip it
+                    try:
+                        modItem = sMkt.getItem(modName)
+                    except:
+                        continue
 
-                        # Create module
-                        m = Module(modItem)
-
-                        # Add subsystems before modules to make sure T3 cruisers have subsystems installed
-                        if modItem.category.name == "Subsystem":
-                            if m.fits(f):
-                                f.modules.append(m)
-                        else:
-                            m.owner = f
-                            # Activate mod if it is activable
-                            if m.isValidState(State.ACTIVE):
-                                m.state = State.ACTIVE
-                            # Add charge to mod if applicable, on any errors just don't add anything
-                            if chargeName:
-                                try:
-                                    chargeItem = sMkt.getItem(chargeName, eager="group.category")
-                                    if chargeItem.category.name == "Charge":
-                                        m.charge = chargeItem
-                                except:
-                                    pass
-                            # Append module to fit
-                            moduleList.append(m)
+                    # Create module
+                    m = Module(modItem)
 
-                # Recalc to get slot numbers correct for T3 cruisers
-                service.Fit.getInstance().recalc(f)
+                    # Add subsystems before modules to make sure T3 cruisers have subsystems installed
+                    if modItem.category.name == "Subsystem":
+                        if m.fits(f):
+                            f.modules.append(m)
+                    else:
+                        m.owner = f
+                        # Activate mod if it is activable
+                        if m.isValidState(State.ACTIVE):
+                            m.state = State.ACTIVE
+                        # Add charge to mod if applicable, on any errors just don't add anything
+                        if chargeName:
+                            try:
+                                chargeItem = sMkt.getItem(chargeName)
+                                if chargeItem.category.name == "Charge":
+                                    m.charge = chargeItem
+                            except:
+                                pass
+                        # Append module to fit
+                        moduleList.append(m)
 
-                for module in moduleList:
-                    if module.fits(f):
-                        f.modules.append(module)
+            # Recalc to get slot numbers correct for T3 cruisers
+            service.Fit.getInstance().recalc(f)
 
-                # Append fit to list of fits
-                fits.append(f)
+            for module in moduleList:
+                if module.fits(f):
+                    f.modules.append(module)
 
-                if callback:
-                    wx.CallAfter(callback, None)
-            # Skip fit silently if we get an exception
-            except Exception:
-                pass
+            return f
+        # Skip fit silently if we get an exception
+        except Exception:
+            return None
 
-        return fits
+    @classmethod
+    def importXml(cls, text, callback=None, encoding="utf-8"):
+        return list(cls.iterXml(StringIO(text.encode(encoding)), callback))
 
-    @staticmethod
-    def importXml(text, callback=None, encoding="utf-8"):
+    @classmethod
+    def iterXml(cls, source, callback=None):
+        """
+        Yield fits of XML document read from file object source, one by one
+        as their fitting elements are parsed. Fittings already processed are
+        dropped from the tree, so memory use doesn't grow with document size.
+        """
         sMkt = service.Market.getInstance()
 
-        doc = xml.dom.minidom.parseString(text.encode(encoding))
-        fittings = doc.getElementsByTagName("fittings").item(0)
-        fittings = fittings.getElementsByTagName("fitting")
-        fits = []
+        # Items of all fittings resolved so far, kept so lookups stay in memory
+        prefetched = {}
+        root = None
+        for event, elem in iterparse(source, events=("start", "end")):
+            if root is None:
+                root = elem
+            if event != "end" or elem.tag != "fitting":
+                continue
 
-        for i, fitting in enumerate(fittings):
-            f = Fit()
-            f.name = fitting.getAttribute("name")
-            # <localized hint="Maelstrom">Maelstrom</localized>
-            shipType = fitting.getElementsByTagName("shipType").item(0).getAttribute("value")
-            try:
-                try:
-                    f.ship = Ship(sMkt.getItem(shipType))
-                except ValueError:
-                    f.ship = Citadel(sMkt.getItem(shipType))
-            except:
+            names = [hardware.get("type", "") for hardware in elem.iter("hardware")]
+            names.extend(shipType.get("value", "") for shipType in elem.iter("shipType"))
+            sMkt.prefetchItemsByName(names, prefetched)
+            f = cls._importXmlFitting(sMkt, elem)
+            root.clear()
+            if f is None:
                 continue
-            hardwares = fitting.getElementsByTagName("hardware")
-            moduleList = []
-            for hardware in hardwares:
+
+            yield f
+            if callback:
+                wx.CallAfter(callback, None)
+
+    @staticmethod
+    def _importXmlFitting(sMkt, fitting):
+        """Build fit out of fitting element, None if its ship is unknown"""
+        f = Fit()
+        f.name = unicode(fitting.get("name", ""))
+        # <localized hint="Maelstrom">Maelstrom</localized>
+        shipType = fitting.find(".//shipType")
+        shipType = shipType.get("value", "") if shipType is not None else ""
+        try:
+            try:
+                f.ship = Ship(sMkt.getItem(shipType))
+            except ValueError:
+                f.ship = Citadel(sMkt.getItem(shipType))
+        except:
+            return None
+        moduleList = []
+        for hardware in fitting.iter("hardware"):
+            try:
+                moduleName = hardware.get("type", "")
                 try:
-                    moduleName = hardware.getAttribute("type")
-                    try:
-                        item = sMkt.getItem(moduleName, eager="group.category")
-                    except:
-                        continue
-                    if item:
-                        if item.category.name == "Drone":
-                            d = Drone(item)
-                            d.amount = int(hardware.getAttribute("qty"))
-                            f.drones.append(d)
-                        elif hardware.getAttribute("slot").lower() == "cargo":
-                            # although the eve client only support charges in cargo, third-party programs
-                            # may support items or "refits" in cargo. Support these by blindly adding all
-                            # cargo, not just charges
-                            c = Cargo(item)
-                            c.amount = int(hardware.getAttribute("qty"))
-                            f.cargo.append(c)
-                        else:
-                            try:
-                                m = Module(item)
-                            # When item can't be added to any slot (unknown item or just charge), ignore it
-                            except ValueError:
-                                continue
-                            # Add subsystems before modules to make sure T3 cruisers have subsystems installed
-                            if item.category.name == "Subsystem":
-                                if m.fits(f):
-                                    m.owner = f
-                                    f.modules.append(m)
-                            else:
-                                if m.isValidState(State.ACTIVE):
-                                    m.state = State.ACTIVE
-
-                                moduleList.append(m)
-
-                except KeyboardInterrupt:
+                    item = sMkt.getItem(moduleName)
+                except:
                     continue
+                if item:
+                    if item.category.name == "Drone":
+                        d = Drone(item)
+                        d.amount = int(hardware.get("qty"))
+                        f.drones.append(d)
+                    elif hardware.get("slot", "").lower() == "cargo":
+                        # although the eve client only support charges in cargo, third-party programs
+                        # may support items or "refits" in cargo. Support these by blindly adding all
+                        # cargo, not just charges
+                        c = Cargo(item)
+                        c.amount = int(hardware.get("qty"))
+                        f.cargo.append(c)
+                    else:
+                        try:
+                            m = Module(item)
+                        # When item can't be added to any slot (unknown item or just charge), ignore it
+                        except ValueError:
+                            continue
+                        # Add subsystems before modules to make sure T3 cruisers have subsystems installed
+                        if item.category.name == "Subsystem":
+                            if m.fits(f):
+                                m.owner = f
+                                f.modules.append(m)
+                        else:
+                            if m.isValidState(State.ACTIVE):
+                                m.state = State.ACTIVE
 
-            # Recalc to get slot numbers correct for T3 cruisers
-            service.Fit.getInstance().recalc(f)
+                            moduleList.append(m)
 
-            for module in moduleList:
-                if module.fits(f):
-                    module.owner = f
-                    f.modules.append(module)
+            except KeyboardInterrupt:
+                continue
 
-            fits.append(f)
-            if callback:
-                wx.CallAfter(callback, None)
+        # Recalc to get slot numbers correct for T3 cruisers
+        service.Fit.getInstance().recalc(f)
 
-        return fits
+        for module in moduleList:
+            if module.fits(f):
+                module.owner = f
+                f.modules.append(module)
+
+        return f
 
     @staticmethod
     def _exportEftBase(fit):
@@ -813,80 +1053,116 @@ class Port(object):
 
     @classmethod
     def exportXml(cls, callback=None, *fits):
-        doc = xml.dom.minidom.Document()
-        fittings = doc.createElement("fittings")
-        doc.appendChild(fittings)
-        sFit = service.Fit.getInstance()
+        return u"".join(cls._xmlChunks(fits, callback))
 
+    @classmethod
+    def exportFits(cls, stream, fits, format="XML", callback=None):
+        """
+        Write fits to stream one at a time, utf-8 encoded, as XML document,
+        EFT blocks separated by blank lines or DNA strings one per line.
+        fits may be any iterable, like a generator loading them as needed,
+        so nothing but the fit being written needs to be in memory.
+        """
+        if format == "XML":
+            chunks = cls._xmlChunks(fits, callback)
+        elif format == "EFT":
+            chunks = cls._textChunks(fits, cls.exportEft, u"\n\n", callback)
+        elif format == "DNA":
+            chunks = cls._textChunks(fits, cls.exportDna, u"\n", callback)
+        else:
+            raise ValueError("Unknown export format: %s" % format)
+
+        for chunk in chunks:
+            stream.write(chunk.encode("utf-8"))
+
+    @staticmethod
+    def _textChunks(fits, export, separator, callback=None):
         for i, fit in enumerate(fits):
             try:
-                fitting = doc.createElement("fitting")
-                fitting.setAttribute("name", fit.name)
-                fittings.appendChild(fitting)
-                description = doc.createElement("description")
-                description.setAttribute("value", "")
-                fitting.appendChild(description)
-                shipType = doc.createElement("shipType")
-                shipType.setAttribute("value", fit.ship.item.name)
-                fitting.appendChild(shipType)
-
-                charges = {}
-                slotNum = {}
-                for module in fit.modules:
-                    if module.isEmpty:
-                        continue
-
-                    slot = module.slot
+                text = export(fit)
+            except:
+                logger.exception("Failed on fitID: %d", fit.ID)
+                continue
+            finally:
+                if callback:
+                    wx.CallAfter(callback, i)
+            yield unicode(text) + separator
 
-                    if slot == Slot.SUBSYSTEM:
-                        # Order of subsystem matters based on this attr. See GH issue #130
-                        slotId = module.getModifiedItemAttr("subSystemSlot") - 125
-                    else:
-                        if not slot in slotNum:
-                            slotNum[slot] = 0
-
-                        slotId = slotNum[slot]
-                        slotNum[slot] += 1
-
-                    hardware = doc.createElement("hardware")
-                    hardware.setAttribute("type", module.item.name)
-                    slotName = Slot.getName(slot).lower()
-                    slotName = slotName if slotName != "high" else "hi"
-                    hardware.setAttribute("slot", "%s slot %d" % (slotName, slotId))
-                    fitting.appendChild(hardware)
-
-                    if module.charge and sFit.serviceFittingOptions["exportCharges"]:
-                        if not module.charge.name in charges:
-                            charges[module.charge.name] = 0
-                        # `or 1` because some charges (ie scripts) are without qty
-                        charges[module.charge.name] += module.numCharges or 1
-
-                for drone in fit.drones:
-                    hardware = doc.createElement("hardware")
-                    hardware.setAttribute("qty", "%d" % drone.amount)
-                    hardware.setAttribute("slot", "drone bay")
-                    hardware.setAttribute("type", drone.item.name)
-                    fitting.appendChild(hardware)
-
-                for cargo in fit.cargo:
-                    if not cargo.item.name in charges:
-                        charges[cargo.item.name] = 0
-                    charges[cargo.item.name] += cargo.amount
-
-                for name, qty in charges.items():
-                    hardware = doc.createElement("hardware")
-                    hardware.setAttribute("qty", "%d" % qty)
-                    hardware.setAttribute("slot", "cargo")
-                    hardware.setAttribute("type", name)
-                    fitting.appendChild(hardware)
+    @classmethod
+    def _xmlChunks(cls, fits, callback=None):
+        """
+        Yield XML document with given fits piece by piece, one fitting at a
+        time, formatted same as minidom's toprettyxml() would.
+        """
+        sFit = service.Fit.getInstance()
+        yield u'<?xml version="1.0" ?>\n'
+        empty = True
+        for i, fit in enumerate(fits):
+            try:
+                fitting = cls._exportXmlFitting(fit, sFit)
             except:
-                print "Failed on fitID: %d"%fit.ID
+                logger.exception("Failed on fitID: %d", fit.ID)
                 continue
             finally:
                 if callback:
                     wx.CallAfter(callback, i)
 
-        return doc.toprettyxml()
+            if empty:
+                yield u"<fittings>\n"
+                empty = False
+            yield fitting
+
+        yield u"<fittings/>\n" if empty else u"</fittings>\n"
+
+    @staticmethod
+    def _exportXmlFitting(fit, sFit):
+        lines = [u'\t<fitting name="%s">\n' % _xmlEscape(fit.name),
+                 _xmlElement(u"\t\t", u"description", value=u""),
+                 _xmlElement(u"\t\t", u"shipType", value=fit.ship.item.name)]
+
+        charges = {}
+        slotNum = {}
+        for module in fit.modules:
+            if module.isEmpty:
+                continue
+
+            slot = module.slot
+
+            if slot == Slot.SUBSYSTEM:
+                # Order of subsystem matters based on this attr. See GH issue #130
+                slotId = module.getModifiedItemAttr("subSystemSlot") - 125
+            else:
+                if not slot in slotNum:
+                    slotNum[slot] = 0
+
+                slotId = slotNum[slot]
+                slotNum[slot] += 1
+
+            slotName = Slot.getName(slot).lower()
+            slotName = slotName if slotName != "high" else "hi"
+            lines.append(_xmlElement(u"\t\t", u"hardware", slot=u"%s slot %d" % (slotName, slotId),
+                                     type=module.item.name))
+
+            if module.charge and sFit.serviceFittingOptions["exportCharges"]:
+                if not module.charge.name in charges:
+                    charges[module.charge.name] = 0
+                # `or 1` because some charges (ie scripts) are without qty
+                charges[module.charge.name] += module.numCharges or 1
+
+        for drone in fit.drones:
+            lines.append(_xmlElement(u"\t\t", u"hardware", qty=u"%d" % drone.amount, slot=u"drone bay",
+                                     type=drone.item.name))
+
+        for cargo in fit.cargo:
+            if not cargo.item.name in charges:
+                charges[cargo.item.name] = 0
+            charges[cargo.item.name] += cargo.amount
+
+        for name, qty in charges.items():
+            lines.append(_xmlElement(u"\t\t", u"hardware", qty=u"%d" % qty, slot=u"cargo", type=name))
+
+        lines.append(u"\t</fitting>\n")
+        return u"".join(lines)
 
     @staticmethod
     def exportMultiBuy(fit):
@@ -20,10 +20,13 @@
 import threading
 import config
 import os
+import logging
 import eos.types
 import eos.db.migration as migration
 from eos.db.saveddata.loadDefaultDatabaseValues import DefaultDatabaseValues
 
+logger = logging.getLogger(__name__)
+
 class PrefetchThread(threading.Thread):
     def run(self):
         # We're a daemon thread, as such, interpreter might get shut down while we do stuff
@@ -32,6 +35,11 @@ class PrefetchThread(threading.Thread):
             eos.types.Character.setSkillList(eos.db.getItemsByCategory("Skill", eager=("effects", "attributes", "attributes.info.icon", "attributes.info.unit", "icon")))
         except:
             pass
+        try:
+            # Load or build item search index now rather than on first search
+            eos.db.getSearchIndex()
+        except:
+            pass
 
 prefetch = PrefetchThread()
 prefetch.daemon = True
@@ -51,7 +59,9 @@ if not os.path.exists(config.savePath):
 if os.path.isfile(config.saveDB):
     # If database exists, run migration after init'd database
     eos.db.saveddata_meta.create_all()
-    migration.update(eos.db.saveddata_engine)
+    def migrationProgress(done, total, description):
+        logger.info("Database migration [%d/%d]: %s", done, total, description)
+    migration.update(eos.db.saveddata_engine, migrationProgress)
     # Import default database values
     # Import values that must exist otherwise Pyfa breaks
     DefaultDatabaseValues.importRequiredDefaults()
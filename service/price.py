@@ -21,17 +21,112 @@ import service
 import eos.db
 import eos.types
 import time
-from xml.dom import minidom
+import threading
+from multiprocessing.pool import ThreadPool
+import logging
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+logger = logging.getLogger(__name__)
 
 VALIDITY = 24*60*60  # Price validity period, 24 hours
 REREQUEST = 4*60*60  # Re-request delay for failed fetches, 4 hours
 TIMEOUT = 15*60  # Network timeout delay for connection issues, 15 minutes
 
+class PriceProvider(object):
+    """
+    Source of market prices. fetch() is given up to chunkSize typeIDs and
+    returns {typeID: price} of those it has data for. Network errors are
+    raised as is, see service.network.
+    """
+    name = None
+    chunkSize = 200
+
+    def fetch(self, typeIDs):
+        raise NotImplementedError()
+
+class EveCentral(PriceProvider):
+    name = "eve-central"
+
+    def __init__(self, url="https://eve-central.com/api/marketstat", systemID=30000142):
+        # Jita by default
+        self.url = url
+        self.systemID = systemID
+
+    def fetch(self, typeIDs):
+        data = [("usesystem", self.systemID)]
+        for typeID in typeIDs:
+            data.append(("typeid", typeID))
+
+        network = service.Network.getInstance()
+        response = network.request(self.url, network.PRICES, data)
+        prices = {}
+        for event, elem in ElementTree.iterparse(response):
+            if elem.tag != "type":
+                continue
+            # If price data wasn't there, set price to zero
+            try:
+                prices[int(elem.get("id"))] = float(elem.findtext("sell/percentile"))
+            except (TypeError, ValueError):
+                prices[int(elem.get("id"))] = 0
+            elem.clear()
+        return prices
+
+class PriceStore(object):
+    """
+    Price objects of all types asked for so far, by typeID; a price needs
+    fetching once it's no longer valid (see eos.types.Price.isValid). Types
+    not in memory yet are read from database in one query per call, types
+    without stored price get a new, invalid one.
+    """
+
+    def __init__(self):
+        self.__prices = {}
+        self.__lock = threading.Lock()
+
+    def get(self, typeID):
+        return self.getMany((typeID,))[0]
+
+    def getMany(self, typeIDs):
+        """Return list of Price objects for typeIDs, in the same order"""
+        typeIDs = list(typeIDs)
+        prices = self.__prices
+        if any(typeID not in prices for typeID in typeIDs):
+            with self.__lock:
+                missing = set(typeID for typeID in typeIDs if typeID not in prices)
+                if missing:
+                    stored = eos.db.getPrices(missing)
+                    for typeID in missing:
+                        price = stored.get(typeID)
+                        if price is None:
+                            price = eos.types.Price(typeID)
+                            eos.db.add(price)
+                        prices[typeID] = price
+        return [prices[typeID] for typeID in typeIDs]
+
+    def clear(self):
+        with self.__lock:
+            self.__prices.clear()
+
 class Price():
+    # Where prices come from, replace with setProvider()
+    provider = EveCentral()
+    # Max amount of provider requests made at once
+    workers = 4
+
+    @classmethod
+    def setProvider(cls, provider):
+        cls.provider = provider
 
     @classmethod
     def fetchPrices(cls, prices):
-        """Fetch all prices passed to this method"""
+        """
+        Fetch all prices passed to this method which aren't valid anymore.
+        Types are requested from provider in chunks, fetched concurrently.
+        """
 
         # Dictionary for our price objects
         priceMap = {}
@@ -43,72 +138,53 @@ class Price():
         if len(priceMap) == 0:
             return
 
-        # Set of items which are still to be requested from this service
-        toRequest = set()
-
-        # Compose list of items we're going to request
-        for typeID in priceMap:
-            # Get item object
-            item = eos.db.getItem(typeID)
-            # We're not going to request items only with market group, as eve-central
-            # doesn't provide any data for items not on the market
-            if item is not None and item.marketGroupID:
-                toRequest.add(typeID)
-
-        # Do not waste our time if all items are not on the market
-        if len(toRequest) == 0:
-            return
-
-        # This will store POST data for eve-central
-        data = []
-
-        # Base request URL
-        baseurl = "https://eve-central.com/api/marketstat"
-        data.append(("usesystem", 30000142)) # Use Jita for market
-
-        for typeID in toRequest:  # Add all typeID arguments
-            data.append(("typeid", typeID))
-
-        # Attempt to send request and process it
-        try:
-            network = service.Network.getInstance()
-            data = network.request(baseurl, network.PRICES, data)
-            xml = minidom.parse(data)
-            types = xml.getElementsByTagName("marketstat").item(0).getElementsByTagName("type")
-            # Cycle through all types we've got from request
-            for type in types:
-                # Get data out of each typeID details tree
-                typeID = int(type.getAttribute("id"))
-                sell = type.getElementsByTagName("sell").item(0)
-                # If price data wasn't there, set price to zero
-                try:
-                    percprice = float(sell.getElementsByTagName("percentile").item(0).firstChild.data)
-                except (TypeError, ValueError):
-                    percprice = 0
-
+        # We're not going to request items without market group, as price
+        # sources don't provide any data for items not on the market
+        marketIndex = service.Market.getInstance().getMarketIndex()
+        toRequest = sorted(typeID for typeID in priceMap if marketIndex.getMarketGroupID(typeID, parentcheck=False))
+
+        provider = cls.provider
+        chunks = [toRequest[i:i + provider.chunkSize] for i in xrange(0, len(toRequest), provider.chunkSize)]
+
+        def fetchChunk(chunk):
+            try:
+                return chunk, provider.fetch(chunk), None
+            except Exception, e:
+                return chunk, None, e
+
+        if len(chunks) > 1:
+            pool = ThreadPool(min(cls.workers, len(chunks)))
+            try:
+                results = pool.map(fetchChunk, chunks)
+            finally:
+                pool.close()
+        else:
+            results = map(fetchChunk, chunks)
+
+        now = time.time()
+        for chunk, fetched, error in results:
+            if error is not None:
+                if isinstance(error, service.network.TimeoutError):
+                    # Timeout error deserves special treatment
+                    for typeID in chunk:
+                        priceobj = priceMap.pop(typeID)
+                        priceobj.time = now + TIMEOUT
+                        priceobj.failed = True
+                else:
+                    # all other errors will pass and continue onward to the REREQUEST delay
+                    logger.warning("Could not fetch prices from %s: %s", provider.name, error)
+                continue
+
+            for typeID, percprice in fetched.iteritems():
                 # Fill price data
-                priceobj = priceMap[typeID]
+                priceobj = priceMap.pop(typeID, None)
+                if priceobj is None:
+                    continue
                 priceobj.price = percprice
-                priceobj.time = time.time() + VALIDITY
+                priceobj.time = now + VALIDITY
                 priceobj.failed = None
 
-                # delete price from working dict
-                del priceMap[typeID]
-
-        # If getting or processing data returned any errors
-        except service.network.TimeoutError, e:
-            # Timeout error deserves special treatment
-            for typeID in priceMap.keys():
-                priceobj = priceMap[typeID]
-                priceobj.time = time.time() + TIMEOUT
-                priceobj.failed = True
-                del priceMap[typeID]
-        except:
-            # all other errors will pass and continue onward to the REREQUEST delay
-            pass
-
-        # if we get to this point, then we've got an error. Set to REREQUEST delay
-        for typeID in priceMap.keys():
-            priceobj = priceMap[typeID]
-            priceobj.time = time.time() + REREQUEST
+        # Whatever is left either failed or isn't on the market. Set to REREQUEST delay
+        for priceobj in priceMap.itervalues():
+            priceobj.time = now + REREQUEST
             priceobj.failed = True
@@ -2,23 +2,26 @@ import os
 import base64
 import time
 import zlib
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 
-import requests
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
 
 from . import version
-from compat import bytes_, text_
+from compat import bytes_, text_, text_type
 from errors import APIException
-from requests.adapters import HTTPAdapter
+from service.network import Network
 
 try:
     from urllib.parse import urlparse, urlunparse, parse_qsl
 except ImportError:  # pragma: no cover
     from urlparse import urlparse, urlunparse, parse_qsl
 
-try:
-    import pickle
-except ImportError:  # pragma: no cover
-    import cPickle as pickle
 
 try:
     from urllib.parse import quote
@@ -43,44 +46,181 @@ class APICache(object):
         raise NotImplementedError
 
 
+def _stable(key):
+    """Key in a form whose repr is the same in every run"""
+    if isinstance(key, (set, frozenset)):
+        return sorted(_stable(k) for k in key)
+    if isinstance(key, (tuple, list)):
+        return [_stable(k) for k in key]
+    if isinstance(key, text_type):
+        return key.encode("utf-8")
+    return key
+
+
 class FileCache(APICache):
-    def __init__(self, path):
-        self._cache = {}
+    """
+    On-disk cache, one file per entry named after SHA-1 of the key, so
+    entries are found again after restart. Values are stored as zlib
+    compressed JSON. Both entry count and total size are bounded, least
+    recently used files are evicted first; entries past their cached_until
+    are dropped when read. The most recently used values are kept in
+    memory as well. Files are written by a background thread, not to hold
+    up requests.
+    """
+
+    def __init__(self, path, maxEntries=2000, maxSize=64 * 1024 * 1024, memoryEntries=100):
         self.path = path
+        self.maxEntries = maxEntries
+        self.maxSize = maxSize
+        self.memoryEntries = memoryEntries
+        # {digest: value} and {digest: file size}, least recently used first
+        self._cache = OrderedDict()
+        self._files = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._queue = None
         if not os.path.isdir(self.path):
             os.mkdir(self.path, 0o700)
+        self._scan()
+
+    def __deepcopy__(self, memo):
+        # Connections are copied per character, all of them share the cache
+        return self
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.path):
+            digest, ext = os.path.splitext(name)
+            filePath = os.path.join(self.path, name)
+            if ext != '.cache':
+                continue
+            if len(digest) != 40:
+                # Named after hash() by earlier versions, unusable
+                self._unlink(filePath)
+                continue
+            try:
+                stat = os.stat(filePath)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, digest, stat.st_size))
+        entries.sort()
+        for mtime, digest, size in entries:
+            self._files[digest] = size
+            self._size += size
+        for digest in self._shrink():
+            self._unlink(self._getpath(digest))
+
+    def _digest(self, key):
+        return hashlib.sha1(bytes_(repr(_stable(key)))).hexdigest()
+
+    def _getpath(self, digest):
+        return os.path.join(self.path, digest + '.cache')
+
+    def _unlink(self, filePath):
+        try:
+            os.unlink(filePath)
+        except OSError as ex:
+            if ex.errno != 2:  # does not exist
+                raise
 
-    def _getpath(self, key):
-        return os.path.join(self.path, str(hash(key)) + '.cache')
+    def _shrink(self):
+        """Forget least recently used files over limits, returns their digests"""
+        evicted = []
+        while self._files and (len(self._files) > self.maxEntries or self._size > self.maxSize):
+            digest, size = self._files.popitem(last=False)
+            self._size -= size
+            self._cache.pop(digest, None)
+            evicted.append(digest)
+        return evicted
+
+    def _remember(self, digest, value):
+        self._cache.pop(digest, None)
+        self._cache[digest] = value
+        while len(self._cache) > self.memoryEntries:
+            self._cache.popitem(last=False)
+
+    def _submit(self, task):
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                writer = threading.Thread(target=self._writer, name="CREST cache writer")
+                writer.daemon = True
+                writer.start()
+        self._queue.put(task)
+
+    def _writer(self):
+        while True:
+            digest, value = self._queue.get()
+            try:
+                filePath = self._getpath(digest)
+                if value is None:
+                    self._unlink(filePath)
+                    continue
+                data = zlib.compress(json.dumps(value, separators=(',', ':')).encode("utf-8"))
+                tmpPath = filePath + '.tmp'
+                with open(tmpPath, 'wb') as f:
+                    f.write(data)
+                if os.path.exists(filePath):
+                    os.unlink(filePath)
+                os.rename(tmpPath, filePath)
+                with self._lock:
+                    self._size += len(data) - self._files.pop(digest, 0)
+                    self._files[digest] = len(data)
+                    evicted = self._shrink()
+                for digest in evicted:
+                    self._unlink(self._getpath(digest))
+            except (IOError, OSError, TypeError, ValueError) as ex:
+                logger.warning('Could not write cache entry %s: %s', digest, ex)
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Block until all entries put so far are written to disk"""
+        with self._lock:
+            pending = self._queue
+        if pending is not None:
+            pending.join()
 
     def put(self, key, value):
-        with open(self._getpath(key), 'wb') as f:
-            f.write(zlib.compress(pickle.dumps(value, -1)))
-        self._cache[key] = value
+        digest = self._digest(key)
+        with self._lock:
+            self._remember(digest, value)
+        self._submit((digest, value))
 
     def get(self, key):
-        if key in self._cache:
-            return self._cache[key]
-
-        try:
-            with open(self._getpath(key), 'rb') as f:
-                return pickle.loads(zlib.decompress(f.read()))
-        except IOError as ex:
-            if ex.errno == 2:  # file does not exist (yet)
+        digest = self._digest(key)
+        with self._lock:
+            value = self._cache.get(digest)
+            onDisk = digest in self._files
+            if onDisk:
+                # Mark as most recently used
+                self._files[digest] = self._files.pop(digest)
+        if value is None and onDisk:
+            filePath = self._getpath(digest)
+            try:
+                with open(filePath, 'rb') as f:
+                    value = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+                # Order of use is kept in modification times across restarts
+                os.utime(filePath, None)
+            except (IOError, OSError, ValueError, zlib.error):
+                self.invalidate(key)
                 return None
-            else:
-                raise
+            with self._lock:
+                self._remember(digest, value)
 
-    def invalidate(self, key):
-        self._cache.pop(key, None)
+        if value is not None and value.get('cached_until', 0) <= time.time():
+            self.invalidate(key)
+            return None
+        return value
 
-        try:
-            os.unlink(self._getpath(key))
-        except OSError as ex:
-            if ex.errno == 2:  # does not exist
-                pass
-            else:
-                raise
+    def invalidate(self, key):
+        digest = self._digest(key)
+        with self._lock:
+            self._cache.pop(digest, None)
+            size = self._files.pop(digest, None)
+            if size is not None:
+                self._size -= size
+        self._submit((digest, None))
 
 
 class DictCache(APICache):
@@ -99,8 +239,8 @@ class DictCache(APICache):
 
 class APIConnection(object):
     def __init__(self, additional_headers=None, user_agent=None, cache_dir=None, cache=None):
-        # Set up a Requests Session
-        session = requests.Session()
+        # Set up a Requests Session, sharing pyfa's connection pools
+        session = Network.getInstance().newSession()
         if additional_headers is None:
             additional_headers = {}
         if user_agent is None:
@@ -110,8 +250,6 @@ class APIConnection(object):
             "Accept": "application/json",
         })
         session.headers.update(additional_headers)
-        session.mount('https://public-crest.eveonline.com',
-                HTTPAdapter())
         self._session = session
         if cache:
             if isinstance(cache, APICache):
@@ -141,8 +279,12 @@ class APIConnection(object):
         for key in params:
             prms[key] = params[key]
 
-        # check cache
-        key = (resource, frozenset(self._session.headers.items()), frozenset(prms.items()))
+        # check cache. Access tokens change every few minutes, so rather
+        # than by them, authorized connections are told apart by refresh
+        # token, for cached entries to be found again after restart
+        headers = frozenset((k, v) for k, v in self._session.headers.items() if k != "Authorization")
+        identity = getattr(self, "refresh_token", None) or self._session.headers.get("Authorization")
+        key = (resource, headers, frozenset(prms.items()), identity)
         cached = self.cache.get(key)
         if cached and cached['cached_until'] > time.time():
             logger.debug('Cache hit for resource %s (params=%s)', resource, prms)
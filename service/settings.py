@@ -19,11 +19,24 @@
 
 import cPickle
 import os.path
+import threading
+import time
 import config
 import urllib2
+import logging
+from utils.fileutils import replaceFile
+
+logger = logging.getLogger(__name__)
 
 class SettingsProvider():
+    # Directory with one file per area, where older versions kept settings;
+    # areas not in store yet are read from there
     BASE_PATH = os.path.join(config.savePath, "settings")
+    # All areas are kept in one file, as {area: pickled settings}; every area
+    # is unpickled on first use
+    STORE_PATH = os.path.join(config.savePath, "settings.store")
+    # Changes are written to disk this many seconds after the last one
+    SAVE_DELAY = 2
     settings = {}
     _instance = None
     @classmethod
@@ -34,51 +47,140 @@ class SettingsProvider():
         return cls._instance
 
     def __init__(self):
-        if not os.path.exists(self.BASE_PATH):
-            os.mkdir(self.BASE_PATH);
+        self.stored = self.loadStore()
+        self.lock = threading.RLock()
+        # Areas changed since last write, and when last change was made
+        self.dirty = set()
+        self.changed = 0
+        self.cv = threading.Condition()
+        # Only one write at a time, by writer thread or saveAll()
+        self.writeLock = threading.Lock()
+        self.writer = None
+
+    def loadStore(self):
+        # Temporary file is complete once written, it's left in place of store
+        # only if replacing store with it got interrupted
+        for path in (self.STORE_PATH, self.STORE_PATH + ".tmp"):
+            try:
+                with open(path, "rb") as f:
+                    stored = cPickle.load(f)
+                if isinstance(stored, dict):
+                    return stored
+            except EnvironmentError:
+                pass
+            except Exception, e:
+                logger.warning("Could not read settings from %s: %s", path, e)
+        return {}
+
+    def readArea(self, area):
+        """Return stored settings of area, None if there are none"""
+        data = self.stored.get(area)
+        try:
+            if data is not None:
+                return cPickle.loads(data)
+
+            p = os.path.join(self.BASE_PATH, area)
+            if os.path.exists(p):
+                with open(p, "rb") as f:
+                    return cPickle.load(f)
+        except:
+            pass
+        return None
 
     def getSettings(self, area, defaults=None):
 
         s = self.settings.get(area)
         if s is None:
-            p = os.path.join(self.BASE_PATH, area)
-
-            if not os.path.exists(p):
-                info = {}
-                if defaults:
-                    for item in defaults:
-                        info[item] = defaults[item]
-
-            else:
-                try:
-                    f = open(p, "rb")
-                    info = cPickle.load(f)
-                    for item in defaults:
-                        if item not in info:
-                            info[item] = defaults[item]
-
-                except:
-                    info = {}
+            with self.lock:
+                s = self.settings.get(area)
+                if s is None:
+                    info = self.readArea(area)
+                    if not isinstance(info, dict):
+                        info = {}
                     if defaults:
                         for item in defaults:
-                            info[item] = defaults[item]
+                            if item not in info:
+                                info[item] = defaults[item]
 
-            self.settings[area] = s = Settings(p, info)
+                    self.settings[area] = s = Settings(self, area, info)
+                    if area not in self.stored:
+                        # Move it over to store, along with any defaults
+                        s.save()
 
         return s
 
+    def markDirty(self, area):
+        """Have area written to disk, once no other changes were made for SAVE_DELAY"""
+        with self.cv:
+            self.dirty.add(area)
+            self.changed = time.time()
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.processWrites, name="SettingsWriter")
+                self.writer.daemon = True
+                self.writer.start()
+            self.cv.notify()
+
+    def processWrites(self):
+        cv = self.cv
+        while True:
+            with cv:
+                while not self.dirty:
+                    cv.wait()
+                # Wait for changes to settle, so toggling a couple of
+                # preferences in a row ends up in one write
+                while self.dirty:
+                    delay = self.changed + self.SAVE_DELAY - time.time()
+                    if delay <= 0:
+                        break
+                    cv.wait(delay)
+            self.flush()
+
+    def flush(self):
+        """Write changed areas to disk now"""
+        with self.writeLock:
+            with self.cv:
+                areas = self.dirty
+                self.dirty = set()
+            if not areas:
+                return
+
+            stored = dict(self.stored)
+            for area in areas:
+                s = self.settings.get(area)
+                if s is None:
+                    continue
+                try:
+                    stored[area] = cPickle.dumps(dict(s.info), cPickle.HIGHEST_PROTOCOL)
+                except RuntimeError:
+                    # Changed by another thread while being pickled, retry later
+                    self.markDirty(area)
+            self.stored = stored
+
+            # Write into temporary file first so settings are never left half-written
+            tmpPath = self.STORE_PATH + ".tmp"
+            try:
+                with open(tmpPath, "wb") as f:
+                    cPickle.dump(stored, f, cPickle.HIGHEST_PROTOCOL)
+                    f.flush()
+                    os.fsync(f.fileno())
+                replaceFile(tmpPath, self.STORE_PATH)
+            except EnvironmentError, e:
+                logger.warning("Could not save settings to %s: %s", self.STORE_PATH, e)
+
     def saveAll(self):
-        for settings in self.settings.itervalues():
-            settings.save()
+        # Settings may be changed in place without telling, write them all
+        with self.cv:
+            self.dirty.update(self.settings)
+        self.flush()
 
 class Settings():
-    def __init__(self, location, info):
-        self.location = location
+    def __init__(self, provider, area, info):
+        self.provider = provider
+        self.area = area
         self.info = info
 
     def save(self):
-        f = open(self.location, "wb")
-        cPickle.dump(self.info, f, cPickle.HIGHEST_PROTOCOL)
+        self.provider.markDirty(self.area)
 
     def __getitem__(self, k):
         try:
@@ -88,6 +190,7 @@ class Settings():
 
     def __setitem__(self, k, v):
         self.info[k] = v
+        self.provider.markDirty(self.area)
 
     def __iter__(self):
         return self.info.__iter__()
@@ -19,7 +19,6 @@
 
 import threading
 import wx
-import urllib2
 import json
 import config
 import service
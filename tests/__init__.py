@@ -0,0 +1,33 @@
+"""
+Unit tests, run from pyfa root with:
+
+    python -m unittest discover -s tests -t .
+
+Settings and saved data go into a temporary directory, and both databases
+are in-memory ones, so tests never touch a real pyfa install. Importing
+service package needs wxPython; tests of service modules are skipped
+without it.
+"""
+
+import atexit
+import shutil
+import tempfile
+import unittest
+
+import config
+
+savePath = tempfile.mkdtemp(prefix="pyfa-tests-")
+atexit.register(shutil.rmtree, savePath, True)
+config.defPaths(savePath)
+
+import eos.config
+
+eos.config.gamedata_connectionstring = "sqlite://"
+eos.config.saveddata_connectionstring = "sqlite://"
+
+try:
+    import wx
+except ImportError:
+    wx = None
+
+requiresWx = unittest.skipIf(wx is None, "service package needs wxPython")
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tests import wx, requiresWx
+
+if wx is not None:
+    from service.pycrest.eve import FileCache
+
+
+@requiresWx
+class FileCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cachePath = os.path.join(self.path, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def entry(self, value, expires=3600):
+        return {"value": value, "cached_until": time.time() + expires}
+
+    def files(self):
+        return [name for name in os.listdir(self.cachePath) if name.endswith(".cache")]
+
+    def test_storedAcrossRestart(self):
+        cache = FileCache(self.cachePath)
+        cache.put(("host", "/path", 1), self.entry(1))
+        cache.wait()
+        cache = FileCache(self.cachePath)
+        self.assertEqual(cache.get(("host", "/path", 1))["value"], 1)
+
+    def test_expiredEntriesDropped(self):
+        cache = FileCache(self.cachePath)
+        cache.put("key", self.entry(1, expires=-1))
+        self.assertIsNone(cache.get("key"))
+        cache.wait()
+        self.assertEqual(self.files(), [])
+
+    def test_evictsByCount(self):
+        cache = FileCache(self.cachePath, maxEntries=3)
+        for i in xrange(3):
+            cache.put(i, self.entry(i))
+        cache.wait()
+        # Used most recently now, so the next one evicted is 1
+        cache.get(0)
+        for i in xrange(3, 5):
+            cache.put(i, self.entry(i))
+        cache.wait()
+        self.assertEqual(len(self.files()), 3)
+        self.assertIsNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        for i in (0, 3, 4):
+            self.assertEqual(cache.get(i)["value"], i)
+
+    def test_evictsBySize(self):
+        cache = FileCache(self.cachePath)
+        for i in xrange(5):
+            cache.put(i, self.entry("x" * 100 * i))
+        cache.wait()
+        # Order of use is told from modification times after restart
+        now = time.time()
+        for i in xrange(5):
+            os.utime(cache._getpath(cache._digest(i)), (now + i, now + i))
+        size = sum(os.path.getsize(os.path.join(self.cachePath, name)) for name in self.files())
+        cache = FileCache(self.cachePath, maxSize=size - 1)
+        self.assertEqual(len(self.files()), 4)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(4)["value"], "x" * 400)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from eos import marketIndex
+from eos.marketIndex import MarketIndex
+
+# (typeID, typeName, marketGroupID, published)
+ITEMS = (
+    (1, u"Gun I", 10, True),
+    (2, u"Gun II", None, True),
+    (3, u"Faction Gun", None, True),
+    (4, u"Hidden Gun", None, False),
+    (5, u"Old Gun", 20, True),
+    (6, u"Moved Gun", 10, True),
+)
+# (typeID, parentTypeID, metaGroupID)
+META_TYPES = (
+    (2, 1, 2),
+    (3, 1, 4),
+    (4, 1, 4),
+    (6, 1, 2),
+)
+META_GROUP_NAMES = ((1, u"Tech I"), (2, u"Tech II"), (4, u"Faction"))
+
+
+class MarketIndexTestCase(unittest.TestCase):
+    def build(self, overrides=None):
+        return MarketIndex.build(ITEMS, META_TYPES, META_GROUP_NAMES, overrides or {}, buildKey=(u"1", "key"))
+
+    def test_groupListsVariations(self):
+        index = self.build()
+        # Published children without market group of their own come along
+        self.assertEqual(index.getMarketGroupItemIDs(10), set((1, 2, 3, 6)))
+        self.assertEqual(index.getMarketGroupItemIDs(10, vars=False), set((1, 6)))
+        self.assertEqual(index.getMarketGroupItemIDs(20), set((5,)))
+
+    def test_metaData(self):
+        index = self.build()
+        self.assertEqual(index.getParentID(3), 1)
+        self.assertEqual(index.getMetaGroupID(3), 4)
+        self.assertEqual(index.getMetaGroupID(1), 0)
+        self.assertEqual(index.getMarketGroupID(2), 10)
+        self.assertIsNone(index.getMarketGroupID(2, parentcheck=False))
+        self.assertEqual(index.getVariationIDs((1,)), set((1, 2, 3, 4, 6)))
+
+    def test_overrides(self):
+        index = self.build({"published": {"Hidden Gun": True, "Old Gun": False},
+                            "metaGroups": {"Old Gun": ("Faction", "Gun I")},
+                            "marketGroups": {"Faction Gun": 20},
+                            "groups": {"Gun I": 99}})
+        self.assertTrue(index.isPublished(4))
+        self.assertFalse(index.isPublished(5))
+        self.assertEqual(index.getParentID(5), 1)
+        self.assertEqual(index.getMetaGroupID(5), 4)
+        self.assertEqual(index.getMarketGroupID(3), 20)
+        self.assertEqual(index.getMarketGroupItemIDs(10), set((1, 2, 4, 6)))
+        self.assertEqual(index.overrideIDs["Gun I"], 1)
+
+    def test_overridesKey(self):
+        key = marketIndex.overridesKey({"published": {"Gun I": True}})
+        self.assertEqual(key, marketIndex.overridesKey({"published": {u"Gun I": True}}))
+        self.assertNotEqual(key, marketIndex.overridesKey({"published": {"Gun I": False}}))
+
+    def test_saveAndLoad(self):
+        path = tempfile.mkdtemp()
+        try:
+            indexPath = os.path.join(path, "market.index")
+            self.build().save(indexPath)
+            loaded = marketIndex.load(indexPath, (u"1", "key"))
+            self.assertEqual(loaded.getMarketGroupItemIDs(10), set((1, 2, 3, 6)))
+            self.assertIsNone(marketIndex.load(indexPath, (u"2", "key")))
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+import eos.types
+from eos.marketIndex import MarketIndex
+from tests import wx, requiresWx
+
+if wx is not None:
+    import service
+    from service.network import TimeoutError
+    from service.price import Price, PriceProvider, VALIDITY, REREQUEST, TIMEOUT
+else:
+    PriceProvider = object
+
+
+class LocalProvider(PriceProvider):
+    """Stand-in for a market data service, answers from a dictionary"""
+    name = "local"
+    chunkSize = 2
+
+    def __init__(self, prices, error=None):
+        self.prices = prices
+        self.error = error
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def fetch(self, typeIDs):
+        with self.lock:
+            self.requests.append(list(typeIDs))
+        if self.error is not None:
+            raise self.error
+        return dict((typeID, self.prices[typeID]) for typeID in typeIDs if typeID in self.prices)
+
+
+class Market(object):
+    def __init__(self, index):
+        self.index = index
+
+    def getMarketIndex(self):
+        return self.index
+
+
+@requiresWx
+class PriceTestCase(unittest.TestCase):
+    def setUp(self):
+        # Types 1 to 5 are on the market, 6 is not
+        items = [(typeID, u"Item %d" % typeID, 10, True) for typeID in xrange(1, 6)]
+        items.append((6, u"Item 6", None, True))
+        market = Market(MarketIndex.build(items, (), (), {}))
+        self.getInstance = service.Market.__dict__["getInstance"]
+        service.Market.getInstance = staticmethod(lambda: market)
+        self.provider = Price.provider
+
+    def tearDown(self):
+        service.Market.getInstance = self.getInstance
+        Price.setProvider(self.provider)
+
+    def test_fetchPrices(self):
+        provider = LocalProvider({1: 10.0, 2: 20.0, 3: 30.0, 4: 40.0, 6: 60.0})
+        Price.setProvider(provider)
+        prices = [eos.types.Price(typeID) for typeID in xrange(1, 7)]
+        now = time.time()
+        Price.fetchPrices(prices)
+
+        # Requested in chunks, items off the market aren't asked for
+        self.assertEqual(sorted(typeID for request in provider.requests for typeID in request), [1, 2, 3, 4, 5])
+        self.assertTrue(all(len(request) <= provider.chunkSize for request in provider.requests))
+        for price in prices[:4]:
+            self.assertEqual(price.price, price.typeID * 10.0)
+            self.assertIsNone(price.failed)
+            self.assertGreaterEqual(price.time, now + VALIDITY)
+        for price in prices[4:]:
+            self.assertTrue(price.failed)
+            self.assertLess(price.time, now + VALIDITY)
+            self.assertGreaterEqual(price.time, now + REREQUEST)
+
+    def test_validPricesNotFetched(self):
+        provider = LocalProvider({1: 10.0})
+        Price.setProvider(provider)
+        price = eos.types.Price(1)
+        price.time = time.time() + 60
+        Price.fetchPrices([price])
+        self.assertEqual(provider.requests, [])
+
+    def test_timeout(self):
+        Price.setProvider(LocalProvider({}, error=TimeoutError("timed out")))
+        price = eos.types.Price(1)
+        now = time.time()
+        Price.fetchPrices([price])
+        self.assertTrue(price.failed)
+        self.assertGreaterEqual(price.time, now + TIMEOUT)
+        self.assertLess(price.time, now + REREQUEST)
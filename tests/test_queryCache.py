@@ -0,0 +1,50 @@
+import unittest
+
+from eos.db.cache import QueryCache, MISSING
+
+
+class QueryCacheTestCase(unittest.TestCase):
+    def test_getAndSet(self):
+        cache = QueryCache("tests.getAndSet")
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertIsNone(cache.get("a", None))
+        cache.set("a", None)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_evictsLeastRecentlyUsed(self):
+        cache = QueryCache("tests.entries", maxEntries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_evictsByWeight(self):
+        cache = QueryCache("tests.weight", maxWeight=5)
+        cache.set("a", [1, 2, 3])
+        cache.set("b", (1, 2))
+        self.assertEqual(cache.weight, 5)
+        cache.set("c", 1, weight=2)
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(cache.weight, 4)
+        # Replacing an entry doesn't count it twice
+        cache.set("c", 1)
+        self.assertEqual(cache.weight, 3)
+
+    def test_invalidateByTag(self):
+        cache = QueryCache("tests.tags")
+        cache.set("a", 1, tags=("fit1",))
+        cache.set("b", 2, tags=("fit1", "fit2"))
+        cache.set("c", 3, tags=("fit2",))
+        self.assertEqual(cache.invalidate("fit1"), 2)
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.invalidate("fit2"), 1)
+        self.assertEqual(cache.invalidate("fit1"), 0)
+        self.assertEqual(len(cache), 0)
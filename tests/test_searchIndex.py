@@ -0,0 +1,74 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from eos import searchIndex
+from eos.searchIndex import SearchIndex
+
+# (typeID, typeName, groupName, categoryName)
+ROWS = (
+    (1, u"Rifter", u"护卫舰", u"舰船"),
+    (2, u"Rifter Blueprint", u"蓝图", u"蓝图"),
+    (3, u"Large Shield Extender II", u"护盾扩展装置", u"装备"),
+    (4, u"Medium Shield Extender II", u"护盾扩展装置", u"装备"),
+    (5, u"Shield Boost Amplifier", u"护盾增效器", u"装备"),
+    (6, u"大型护盾扩展装置 II", u"护盾扩展装置", u"装备"),
+    (7, u"中型护盾扩展装置 II", u"护盾扩展装置", u"装备"),
+    (8, u"裂谷级", u"护卫舰", u"舰船"),
+)
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex.build(ROWS, clientBuild=1)
+
+    def test_search(self):
+        self.assertEqual(self.index.search("rifter"), [1, 2])
+        self.assertEqual(self.index.search("shield ext"), [3, 4])
+        self.assertEqual(self.index.search(u"护盾扩展"), [7, 6])
+        self.assertEqual(self.index.search("rifter", categories=[u"舰船"]), [1])
+        self.assertEqual(self.index.search("shield*II"), [3, 4])
+        self.assertEqual(self.index.search("nothing"), [])
+
+    def test_fuzzy(self):
+        self.assertEqual(set(self.index.search("shild")), set((3, 4, 5)))
+        # Fuzzy matches can't be narrowed from
+        ranks, narrowable = self.index.match("shild")
+        self.assertFalse(narrowable)
+
+    def test_saveAndLoad(self):
+        path = tempfile.mkdtemp()
+        try:
+            indexPath = os.path.join(path, "eve.search")
+            self.index.save(indexPath)
+            loaded = searchIndex.load(indexPath, 1)
+            self.assertEqual(loaded.search("rifter"), [1, 2])
+            self.assertIsNone(searchIndex.load(indexPath, 2))
+        finally:
+            shutil.rmtree(path)
+
+    def test_narrowing(self):
+        # Every extension of a narrowable text matches same as a full search
+        texts = (u"s", u"sh", u"shi", u"shie", u"shield", u"shield ", u"shield e", u"shield ex",
+                 u"shield ext", u"shield extender", u"shield extender i", u"shield extender ii")
+        previous = None
+        for text in texts:
+            full, narrowable = self.index.match(text)
+            if previous is not None:
+                narrowed, narrowedNarrowable = self.index.match(text, within=previous)
+                self.assertEqual(narrowed, full, text)
+                self.assertEqual(narrowedNarrowable, narrowable, text)
+            previous = full if narrowable else None
+
+    def test_narrowingWithCategories(self):
+        previous, narrowable = self.index.match(u"护", categories=[u"装备"])
+        self.assertTrue(narrowable)
+        narrowed, _ = self.index.match(u"护盾扩", categories=[u"装备"], within=previous)
+        full, _ = self.index.match(u"护盾扩", categories=[u"装备"])
+        self.assertEqual(narrowed, full)
+        self.assertEqual(set(full), set((6, 7)))
+
+    def test_cancelled(self):
+        self.assertIsNone(self.index.match("shield extender", cancelled=lambda: True))
@@ -0,0 +1,79 @@
+import cPickle
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import wx, requiresWx
+
+if wx is not None:
+    from service.settings import SettingsProvider
+
+
+@requiresWx
+class SettingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def provider(self):
+        class Provider(SettingsProvider):
+            BASE_PATH = os.path.join(self.path, "settings")
+            STORE_PATH = os.path.join(self.path, "settings.store")
+            # Tests write with flush() themselves
+            SAVE_DELAY = 3600
+            settings = {}
+        return Provider()
+
+    def test_flushWritesChangedAreas(self):
+        provider = self.provider()
+        settings = provider.getSettings("area", {"a": 1, "b": 2})
+        settings["a"] = 3
+        provider.flush()
+        self.assertFalse(os.path.exists(provider.STORE_PATH + ".tmp"))
+
+        settings = self.provider().getSettings("area", {"a": 1, "c": 4})
+        self.assertEqual((settings["a"], settings["b"], settings["c"]), (3, 2, 4))
+
+    def test_flushKeepsOtherAreas(self):
+        provider = self.provider()
+        provider.getSettings("one", {"a": 1})
+        provider.getSettings("two", {"b": 2})["b"] = 5
+        provider.flush()
+        provider = self.provider()
+        provider.getSettings("two")["b"] = 6
+        provider.flush()
+        provider = self.provider()
+        self.assertEqual(provider.getSettings("one")["a"], 1)
+        self.assertEqual(provider.getSettings("two")["b"], 6)
+
+    def test_saveAllWritesInPlaceChanges(self):
+        provider = self.provider()
+        provider.getSettings("area", {"list": []})
+        provider.flush()
+        provider.getSettings("area")["list"].append(1)
+        provider.saveAll()
+        self.assertEqual(self.provider().getSettings("area")["list"], [1])
+
+    def test_legacyAreaMigrated(self):
+        os.mkdir(os.path.join(self.path, "settings"))
+        with open(os.path.join(self.path, "settings", "area"), "wb") as f:
+            cPickle.dump({"a": 7}, f)
+        provider = self.provider()
+        self.assertEqual(provider.getSettings("area")["a"], 7)
+        provider.flush()
+        self.assertIn("area", self.provider().loadStore())
+
+    def test_loadFallsBackToTemporaryFile(self):
+        provider = self.provider()
+        provider.getSettings("area", {"a": 1})
+        provider.flush()
+        # As left behind if replacing store got interrupted
+        os.rename(provider.STORE_PATH, provider.STORE_PATH + ".tmp")
+        self.assertEqual(self.provider().getSettings("area")["a"], 1)
+
+        with open(provider.STORE_PATH, "wb") as f:
+            f.write("not a pickle")
+        self.assertEqual(self.provider().getSettings("area")["a"], 1)
@@ -0,0 +1,47 @@
+import threading
+import unittest
+
+from tests import wx, requiresWx
+
+if wx is not None:
+    from service.character import Character
+
+
+class Item(object):
+    def __init__(self, ID, requiredSkills=None):
+        self.ID = ID
+        self.requiredSkills = requiredSkills or {}
+
+
+@requiresWx
+class SkillClosureTestCase(unittest.TestCase):
+    def setUp(self):
+        # Closures need no database, skip setting up default characters
+        self.sChar = Character.__new__(Character)
+        self.sChar._Character__skillClosures = {}
+        self.sChar._Character__skillClosuresLock = threading.RLock()
+
+    def closure(self, item):
+        return dict((skill.ID, level) for skill, level in self.sChar.getSkillClosure(item))
+
+    def test_nestedRequirements(self):
+        base = Item(1)
+        middle = Item(2, {base: 3})
+        other = Item(3, {base: 5})
+        item = Item(10, {middle: 1, other: 2})
+        # Highest level needed of each skill wins
+        self.assertEqual(self.closure(item), {1: 5, 2: 1, 3: 2})
+        self.assertEqual(self.closure(middle), {1: 3})
+        self.assertEqual(self.closure(base), {})
+
+    def test_builtOnce(self):
+        item = Item(10, {Item(1): 1})
+        first = self.sChar.getSkillClosure(item)
+        item.requiredSkills = {}
+        self.assertIs(self.sChar.getSkillClosure(item), first)
+
+    def test_loopInRequirements(self):
+        first = Item(1)
+        second = Item(2, {first: 2})
+        first.requiredSkills = {second: 1}
+        self.assertEqual(self.closure(Item(10, {first: 4})), {1: 4, 2: 1})
@@ -0,0 +1,105 @@
+# coding: utf-8
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from eos import snapshot
+
+SCHEMA = (
+    "CREATE TABLE metadata (field_name TEXT, field_value TEXT)",
+    "CREATE TABLE invtypes (typeID INTEGER, typeName TEXT, groupID INTEGER, marketGroupID INTEGER, "
+    "iconID INTEGER, raceID INTEGER, factionID INTEGER, published BOOLEAN, volume FLOAT, mass FLOAT, "
+    "capacity FLOAT)",
+    "CREATE TABLE invmetatypes (typeID INTEGER, parentTypeID INTEGER, metaGroupID INTEGER)",
+    "CREATE TABLE dgmtypeattribs (typeID INTEGER, attributeID INTEGER, value FLOAT)",
+    "CREATE TABLE dgmtypeeffects (typeID INTEGER, effectID INTEGER)",
+    "CREATE TABLE dgmeffects (effectID INTEGER, effectName TEXT)",
+    "CREATE TABLE dgmattribs (attributeID INTEGER, attributeName TEXT, displayName TEXT, defaultValue FLOAT, "
+    "unitID INTEGER, iconID INTEGER, highIsGood BOOLEAN, published BOOLEAN)",
+    "CREATE TABLE invgroups (groupID INTEGER, groupName TEXT, categoryID INTEGER, published BOOLEAN)",
+    "CREATE TABLE invcategories (categoryID INTEGER, categoryName TEXT, published BOOLEAN)",
+)
+
+ROWS = {
+    "metadata": ((u"client_build", u"1234"),),
+    "invtypes": ((1, u"Rifter", 25, 61, None, 2, None, 1, 27289.0, 1067000.0, 140.0),
+                 (2, u"裂谷级", 25, None, None, 2, None, 1, 27289.0, 1067000.0, 140.0),
+                 (3, u"Gun I", 55, 10, 350, None, None, 1, 5.0, 500.0, 1.0)),
+    "invmetatypes": ((2, 1, 1),),
+    "dgmtypeattribs": ((1, 9, 350.0), (1, 182, 3.0), (1, 277, 1.0), (1, 48, None), (3, 64, 2.5)),
+    "dgmtypeeffects": ((3, 10), (3, 12), (1, 12)),
+    "dgmeffects": ((10, u"targetAttack"), (12, u"online")),
+    "dgmattribs": ((9, u"hp", u"Structure", 0.0, 1, None, 1, 1),
+                   (48, u"cpuOutput", u"CPU", 0.0, None, None, 1, 1),
+                   (64, u"damageMultiplier", None, 1.0, 104, None, 1, 1),
+                   (182, u"requiredSkill1", None, 0.0, None, None, 1, 0),
+                   (277, u"requiredSkill1Level", None, 0.0, None, None, 1, 0)),
+    "invgroups": ((25, u"护卫舰", 6, 1), (55, u"Projectile Weapon", 7, 1)),
+    "invcategories": ((6, u"舰船", 1), (7, u"装备", 1)),
+}
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        dbPath = os.path.join(self.path, "eve.db")
+        db = sqlite3.connect(dbPath)
+        for statement in SCHEMA:
+            db.execute(statement)
+        for table, rows in ROWS.iteritems():
+            for row in rows:
+                db.execute("INSERT INTO %s VALUES (%s)" % (table, ", ".join("?" * len(row))), row)
+        db.commit()
+        db.close()
+        self.snapPath = os.path.join(self.path, "eve.snap")
+        snapshot.build(dbPath, self.snapPath)
+        self.snapshot = snapshot.load(self.snapPath, 1234)
+
+    def tearDown(self):
+        self.snapshot.close()
+        shutil.rmtree(self.path)
+
+    def test_load(self):
+        self.assertEqual(self.snapshot.clientBuild, u"1234")
+        self.assertIsNone(snapshot.load(self.snapPath, 1235))
+        self.assertIsNone(snapshot.load(os.path.join(self.path, "missing.snap")))
+
+    def test_item(self):
+        item = self.snapshot.getItem(1)
+        self.assertEqual(item.name, u"Rifter")
+        variation = self.snapshot.getItem(u"裂谷级")
+        self.assertEqual((variation.ID, variation.parentTypeID, variation.metaGroupID), (2, 1, 1))
+        self.assertEqual(item.group.name, u"护卫舰")
+        self.assertEqual(item.category.name, u"舰船")
+        self.assertIsNone(item.iconID)
+        self.assertEqual(item.requiredSkills, {3: 1.0})
+        self.assertEqual(item.effects, {u"online": 12})
+        self.assertIsNone(self.snapshot.getItem(4))
+        self.assertIsNone(self.snapshot.getItem(u"Nothing"))
+        self.assertRaises(TypeError, self.snapshot.getItem, 1.0)
+
+    def test_attributes(self):
+        item = self.snapshot.getItem(1)
+        self.assertEqual(item.getAttribute("hp"), 350.0)
+        self.assertEqual(item.getAttribute(9), 350.0)
+        # NULL values are left out
+        self.assertIsNone(item.getAttribute("cpuOutput"))
+        self.assertEqual(item.attributes, {u"hp": 350.0, u"requiredSkill1": 3.0, u"requiredSkill1Level": 1.0})
+        self.assertEqual(list(self.snapshot.getAttributeRows([3, 1], [9, 64])), [(1, 9, 350.0), (3, 64, 2.5)])
+
+    def test_groupsAndCategories(self):
+        group = self.snapshot.getGroup(u"护卫舰")
+        self.assertEqual(sorted(item.ID for item in group.items), [1, 2])
+        category = self.snapshot.getCategory(7)
+        self.assertEqual([group.name for group in category.groups], [u"Projectile Weapon"])
+        self.assertEqual(self.snapshot.getCategory(u"舰船").ID, 6)
+        self.assertEqual([item.ID for item in self.snapshot.getItemsWithEffect("online")], [1, 3])
+
+    def test_attributeInfo(self):
+        info = self.snapshot.getAttributeInfo("damageMultiplier")
+        self.assertEqual((info.ID, info.unitID, info.defaultValue), (64, 104, 1.0))
+        self.assertIsNone(info.displayName)
+        self.assertEqual(self.snapshot.getAttributeInfo(9).displayName, u"Structure")
+        self.assertIsNone(self.snapshot.getAttributeInfo("nothing"))
@@ -0,0 +1,23 @@
+import os
+import sys
+
+def replaceFile(src, dst):
+    """
+    Move file src over dst. On Windows os.rename() won't overwrite, so
+    MoveFileEx is used, which replaces atomically like rename does elsewhere;
+    should it be unavailable, dst is removed first.
+    """
+    if os.name == "nt":
+        try:
+            import ctypes
+            encoding = sys.getfilesystemencoding()
+            # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+            if ctypes.windll.kernel32.MoveFileExW(
+                    src if isinstance(src, unicode) else src.decode(encoding),
+                    dst if isinstance(dst, unicode) else dst.decode(encoding), 0x1 | 0x8):
+                return
+        except (ImportError, AttributeError, UnicodeError):
+            pass
+        if os.path.exists(dst):
+            os.remove(dst)
+    os.rename(src, dst)